@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmark of the encodings of the device requests
+
+Compares JSON, CBOR and MessagePack for a small attribute update and
+a batch update of many entities: the bytes on the wire, the decode time
+and the time from the body to the HTTPRequest (decode and validation).
+The encodings whose package is not installed are skipped.
+
+Usage:
+python bench_codecs.py [number of iterations]
+"""
+# Standard Library imports
+import json
+import os
+import sys
+import timeit
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+os.environ.setdefault("LOG_TO_FILE", "false")
+os.environ.setdefault("LOGGING_LEVEL", "WARNING")
+
+# custom imports
+import Codecs
+from main import IoTAgent
+
+SMALL = {"url": "http://orion:1026/v2/entities/urn:ngsi_ld:TrayLoaderStorage:1/attrs/TrayLoaderStorageTrayCounter",
+         "method": "PUT",
+         "headers": ["Content-Type: application/json"],
+         "data": {"value": {"$inc": -1}, "type": "Number"}}
+BATCH = {"url": "http://orion:1026/v2/op/update",
+         "method": "POST",
+         "headers": ["Content-Type: application/json"],
+         "data": {"actionType": "append",
+                  "entities": [{"id": f"urn:ngsi_ld:Sensor:{i}", "type": "Sensor",
+                                "temperature": {"type": "Number", "value": 20.5 + i},
+                                "pressure": {"type": "Number", "value": 1013 + i},
+                                "ok": {"type": "Boolean", "value": True}} for i in range(50)]}}
+
+
+def encoders() -> dict:
+    """Return the available encodings: {Content-Type: encode function}"""
+    encodings = {"application/json": lambda obj: json.dumps(obj).encode("utf-8")}
+    supported = Codecs.available()
+    if "application/cbor" in supported:
+        import cbor2
+        encodings["application/cbor"] = cbor2.dumps
+    if "application/msgpack" in supported:
+        import msgpack
+        encodings["application/msgpack"] = msgpack.packb
+    return encodings
+
+
+def main(number: int):
+    # a handler without a connection
+    agent = IoTAgent.__new__(IoTAgent)
+    for name, envelope in (("small update", SMALL), ("batch of 50 entities", BATCH)):
+        print(f"{name}:")
+        for content_type, encode in encoders().items():
+            body = encode(envelope)
+            assert agent._prepare_request(body, content_type).data == json.dumps(envelope["data"])
+            decode_time = timeit.timeit(lambda: Codecs.decode(body, content_type), number=number) / number
+            prepare_time = timeit.timeit(lambda: agent._prepare_request(body, content_type), number=number) / number
+            print(f"    {content_type:<22s}{len(body):7d} bytes  decode {decode_time * 1e6:8.2f} us"
+                  f"  to HTTPRequest {prepare_time * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmark of the HTTP compression
+
+For typical bodies, from a PLC attribute update to a list of entities
+returned by Orion, compares gzip and deflate at the levels 1, 6 and 9:
+the compressed size, the saved bytes and the CPU time of the compression
+and of the decompression. The bodies below COMPRESSION_MIN_BYTES
+(default: 1024) are not compressed by the agent, see src/Compression.py.
+
+Usage:
+python bench_compression.py [number of iterations]
+"""
+# Standard Library imports
+import gzip
+import json
+import os
+import sys
+import timeit
+import zlib
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+os.environ.setdefault("LOG_TO_FILE", "false")
+os.environ.setdefault("LOGGING_LEVEL", "WARNING")
+
+# custom imports
+import Compression
+
+
+def entity(i: int) -> dict:
+    return {"id": f"urn:ngsi_ld:Workstation:{i}", "type": "Workstation",
+            "Available": {"type": "Boolean", "value": True, "metadata": {}},
+            "RefJob": {"type": "Relationship", "value": f"urn:ngsi_ld:Job:{i}", "metadata": {}},
+            "GoodPartCounter": {"type": "Number", "value": 1000 + i, "metadata": {}},
+            "RejectPartCounter": {"type": "Number", "value": i % 7, "metadata": {}},
+            "Temperature": {"type": "Number", "value": 20.5 + i / 10, "metadata": {}}}
+
+
+BODIES = {"attribute update": json.dumps({"value": {"$inc": -1}, "type": "Number"}),
+          "one entity": json.dumps(entity(1)),
+          "batch of 20 entities": json.dumps({"actionType": "append", "entities": [entity(i) for i in range(20)]}),
+          "list of 1000 entities": json.dumps([entity(i) for i in range(1000)])}
+
+DECOMPRESS = {"gzip": gzip.decompress, "deflate": zlib.decompress}
+
+
+def main(number: int):
+    for name, text in BODIES.items():
+        body = text.encode("utf-8")
+        note = "" if len(body) >= Compression.COMPRESSION_MIN_BYTES else ", below COMPRESSION_MIN_BYTES"
+        print(f"{name}: {len(body)} bytes{note}")
+        # fewer iterations for the large bodies
+        iterations = max(1, number * 1000 // max(len(body), 1000))
+        for encoding in Compression.ENCODINGS:
+            for level in (1, 6, 9):
+                compressed = Compression.compress(body, encoding, level)
+                compress = timeit.timeit(lambda: Compression.compress(body, encoding, level), number=iterations)
+                decompress = timeit.timeit(lambda: DECOMPRESS[encoding](compressed), number=iterations)
+                print(f"  {encoding:7s} level {level}: {len(compressed):8d} bytes ({len(body) - len(compressed):+8d} saved), "
+                      f"compress {compress / iterations * 1e6:9.1f} us, decompress {decompress / iterations * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmark of the declarative transform rules
+
+Compares the compiled example rule (src/plugin/rules.example.json)
+with the built-in transform logic. The Orion lookups are served
+from the warm entity cache, and the Workstations, which are never cached,
+from an in-memory stub of the batch query, so only the evaluation
+itself is measured.
+
+Usage:
+python bench_rules.py [number of iterations]
+"""
+# Standard Library imports
+import os
+import sys
+import timeit
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+os.environ.setdefault("ORION_HOST", "localhost")
+os.environ.setdefault("ORION_PORT", "1026")
+os.environ.setdefault("ORION_CACHE_TTL", "3600")
+os.environ.setdefault("LOG_TO_FILE", "false")
+os.environ.setdefault("LOGGING_LEVEL", "WARNING")
+
+# custom imports
+from HTTPRequest import HTTPRequest
+from plugin import Orion, rules, transform
+import Tenancy
+
+ENTITIES = {
+    "urn:ngsi_ld:Workstation:1": {"refJob": "urn:ngsi_ld:Job:1"},
+    "urn:ngsi_ld:Job:1": {"refOperation": "urn:ngsi_ld:Operation:1"},
+    "urn:ngsi_ld:Operation:1": {"partsPerCycle": 8},
+}
+
+
+def query_entities(object_ids: list, attrs: list = None, host: str = None, port: int = None, tenant: tuple = None):
+    """Serve Orion.queryEntities from ENTITIES, without Orion"""
+    return {object_id: {"id": object_id, **ENTITIES[object_id]} for object_id in object_ids if object_id in ENTITIES}
+
+
+def main(number: int):
+    Orion.queryEntities = query_entities
+    for entity_id, values in ENTITIES.items():
+        Orion.cache.put((Tenancy.DEFAULT_TENANT, entity_id), values, ["partsPerCycle", "refJob", "refOperation"])
+    compiled = rules.load_rules(os.path.join(SRC, "plugin", "rules.example.json"))
+    req = HTTPRequest(url="", headers={}, method="PUT",
+                      transform={"ws": "urn:ngsi_ld:Workstation:1", "ct": "good", "cc": 14})
+    assert rules.apply_rules(compiled, req) == transform(req)
+
+    compile_time = timeit.timeit(lambda: rules.load_rules(os.path.join(SRC, "plugin", "rules.example.json")), number=100) / 100
+    rule_time = timeit.timeit(lambda: rules.apply_rules(compiled, req), number=number) / number
+    builtin_time = timeit.timeit(lambda: transform(req), number=number) / number
+    print(f"rule set compilation: {compile_time * 1e6:8.2f} us")
+    print(f"rule evaluation:      {rule_time * 1e6:8.2f} us/request")
+    print(f"built-in transform:   {builtin_time * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
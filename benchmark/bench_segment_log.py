@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmark of the store-and-forward buffer
+
+Measures the append throughput of the SegmentLog with and without fsync,
+from one thread and from several threads. With fsync, the threads share
+the fsyncs (group commit), so the throughput grows with the threads.
+
+Usage:
+python bench_segment_log.py [number of records per thread] [number of threads]
+"""
+# Standard Library imports
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+os.environ.setdefault("LOG_TO_FILE", "false")
+os.environ.setdefault("LOGGING_LEVEL", "WARNING")
+
+# custom imports
+from SegmentLog import SegmentLog
+
+# about the size of a buffered PUT request
+RECORD = b"x" * 200
+
+
+def measure(fsync: bool, number: int, threads: int) -> float:
+    """Return the appended records per second"""
+    directory = tempfile.mkdtemp()
+    try:
+        log = SegmentLog(directory, fsync=fsync)
+        workers = [threading.Thread(target=lambda: [log.append(RECORD) for _ in range(number)])
+                   for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        log.close()
+        return number * threads / elapsed
+    finally:
+        shutil.rmtree(directory)
+
+
+def main(number: int, threads: int):
+    for fsync in (False, True):
+        for count in (1, threads):
+            rate = measure(fsync, number, count)
+            print(f"fsync={'on ' if fsync else 'off'} threads={count:<3d} {rate:12.0f} records/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 8)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the startup of the IoT agent
+
+Measures, in fresh interpreters:
+    - the import time of main, with the slowest imports reported
+      by python -X importtime
+    - the time from starting main.py until the listener answers
+      and until GET /ready returns 200
+
+The agent is started with the plugin. A stub answering GET /version
+stands in for Orion, so the probes of the readiness check succeed.
+
+Usage:
+python bench_startup.py [number of runs]
+"""
+# Standard Library imports
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+ENV = {**os.environ,
+       "ORION_HOST": "localhost",
+       "HEALTH_PROBE_INTERVAL": "0.01",
+       "USE_PLUGIN": os.environ.get("USE_PLUGIN", "true"),
+       "LOG_TO_FILE": "false",
+       "LOGGING_LEVEL": "WARNING",
+       "ACCESS_LOG": "false"}
+
+
+def import_times() -> tuple:
+    """Import main with -X importtime
+
+    Returns:
+        (the cumulative import time of main in seconds,
+        a list of (cumulative seconds, module) of the direct imports)
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=SRC, env=ENV, capture_output=True, text=True, check=True)
+    total = 0.0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0 and name.strip() == "main":
+            total = int(cumulative) / 1e6
+        elif depth == 1:
+            modules.append((int(cumulative) / 1e6, name.strip()))
+    return total, sorted(modules, reverse=True)
+
+
+class _OrionStub(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+def _get(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def time_to_ready() -> tuple:
+    """Start main.py and poll it
+
+    Returns:
+        (seconds until the listener answers, seconds until /ready is 200)
+    """
+    port = _free_port()
+    started = time.perf_counter()
+    agent = subprocess.Popen([sys.executable, "main.py"], cwd=SRC, env={**ENV, "PORT": str(port)},
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    listening = None
+    try:
+        while time.perf_counter() - started < 30:
+            try:
+                status = _get(f"http://localhost:{port}/ready")
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.002)
+                continue
+            if listening is None:
+                listening = time.perf_counter() - started
+            if status == 200:
+                return listening, time.perf_counter() - started
+            time.sleep(0.002)
+        raise RuntimeError("The agent did not become ready in 30 s")
+    finally:
+        agent.terminate()
+        agent.wait()
+
+
+def main(number: int):
+    orion = ThreadingHTTPServer(("localhost", 0), _OrionStub)
+    threading.Thread(target=orion.serve_forever, daemon=True).start()
+    ENV["ORION_PORT"] = str(orion.server_address[1])
+    runs = [import_times() for _ in range(number)]
+    print(f"import main:       {statistics.median(total for total, _ in runs) * 1e3:8.1f} ms (median of {number})")
+    for seconds, name in runs[-1][1][:8]:
+        print(f"    {name:<24s}{seconds * 1e3:8.1f} ms")
+    startups = [time_to_ready() for _ in range(number)]
+    print(f"listener answers:  {statistics.median(listening for listening, _ in startups) * 1e3:8.1f} ms")
+    print(f"ready:             {statistics.median(ready for _, ready in startups) * 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
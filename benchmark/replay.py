@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Replay of a traffic capture against an IoT agent
+
+Sends the requests captured with CAPTURE_DIR (see src/Capture.py) to an agent
+again, keeping their original spacing divided by the speed, or as fast as the
+concurrent senders can, and reports the throughput, the latency percentiles
+and the status codes. Replays against a test agent: the requests update Orion.
+
+If the senders cannot keep up with the pace, the requests are sent late,
+the "behind schedule" line shows by how much.
+
+Usage:
+python replay.py <capture directory> [--target http://localhost:4315] [--speed 1 | N | max] [--concurrency 8]
+"""
+# Standard Library imports
+import argparse
+from collections import Counter
+import os
+import queue
+import sys
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+os.environ.setdefault("LOG_TO_FILE", "false")
+os.environ.setdefault("LOGGING_LEVEL", "WARNING")
+
+# custom imports
+import Capture
+
+
+def percentile(values: list, share: float) -> float:
+    """Return a percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+class Replay:
+    """Sends a capture to an agent
+
+    Args:
+        target (str): the URL of the agent
+        speed (float): the pace relative to the capture, 0 for as fast as possible
+        concurrency (int): the number of concurrent senders
+    """
+
+    def __init__(self, target: str, speed: float, concurrency: int):
+        self.target = target
+        self.speed = speed
+        self.concurrency = concurrency
+        self.latencies = []
+        self.delays = []
+        self.statuses = Counter()
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(maxsize=concurrency * 4)
+
+    def _send(self):
+        import requests
+        session = requests.Session()
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            due, body, headers = item
+            if due is not None:
+                wait = due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            started = time.monotonic()
+            try:
+                status = session.post(self.target, data=body, headers=headers, timeout=30).status_code
+            except requests.exceptions.RequestException as error:
+                status = type(error).__name__
+            latency = time.monotonic() - started
+            with self._lock:
+                self.latencies.append(latency)
+                if due is not None:
+                    self.delays.append(max(0.0, started - due))
+                self.statuses[status] += 1
+
+    def run(self, captured) -> float:
+        """Send the requests
+
+        Args:
+            captured: the (timestamp, body, headers) of the requests
+
+        Returns:
+            the seconds the replay took
+        """
+        senders = [threading.Thread(target=self._send, daemon=True) for _ in range(self.concurrency)]
+        for sender in senders:
+            sender.start()
+        started = time.monotonic()
+        first = None
+        for timestamp, body, headers in captured:
+            if first is None:
+                first = timestamp
+            due = started + (timestamp - first) / self.speed if self.speed else None
+            self._pending.put((due, body, headers))
+        for _ in senders:
+            self._pending.put(None)
+        for sender in senders:
+            sender.join()
+        return time.monotonic() - started
+
+    def report(self, elapsed: float):
+        latencies = sorted(self.latencies)
+        print(f"requests:        {len(latencies)} in {elapsed:.3f} s, {len(latencies) / elapsed if elapsed else 0:.1f} requests/s")
+        print("latency (ms):    " + "  ".join(f"{label}={percentile(latencies, share) * 1000:.1f}" for label, share in
+                                              (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p99.9", 0.999))) +
+              f"  max={latencies[-1] * 1000 if latencies else 0:.1f}")
+        if self.delays:
+            delays = sorted(self.delays)
+            print(f"behind schedule: p50={percentile(delays, 0.5) * 1000:.1f} ms  p99={percentile(delays, 0.99) * 1000:.1f} ms")
+        print("status codes:    " + "  ".join(f"{status}: {count}" for status, count in
+                                              sorted(self.statuses.items(), key=lambda item: str(item[0]))))
+
+
+def main(directory: str, target: str, speed: str, concurrency: int):
+    speed = 0.0 if speed == "max" else float(speed)
+    if speed < 0:
+        raise SystemExit(f"Invalid speed: {speed}")
+    replay = Replay(target, speed, concurrency)
+    elapsed = replay.run(Capture.read(directory))
+    replay.report(elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a traffic capture against an IoT agent")
+    parser.add_argument("directory", help="the CAPTURE_DIR of the capture")
+    parser.add_argument("--target", default="http://localhost:4315", help="the URL of the agent")
+    parser.add_argument("--speed", default="1", help="the pace relative to the capture, or max. Default: 1")
+    parser.add_argument("--concurrency", type=int, default=8, help="the number of concurrent senders. Default: 8")
+    arguments = parser.parse_args()
+    main(arguments.directory, arguments.target, arguments.speed, arguments.concurrency)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+A module for aggregating high-frequency sensor values over time windows
+
+Some devices send analog readings at scan rate, and every reading
+would become an Orion update. The attributes listed in
+AGGREGATE_ATTRIBUTES are aggregated over tumbling windows instead,
+and Orion gets one update per window and entity:
+    min, max, mean: of the readings in the window
+    last: the last reading in the window
+The windows are aligned to multiples of their length, so the updates
+of all entities arrive together. The attributes not listed, for example
+critical ones, are forwarded at every reading.
+
+Only updates of a single numeric attribute are aggregated:
+    PUT /v2/entities/<id>/attrs/<attr> with {"value": <number>, ...}
+    PUT /v2/entities/<id>/attrs/<attr>/value with a text/plain number
+The update sent at the end of the window is the last reading with the
+aggregated value, so its type and metadata are kept.
+
+The accumulators of all series (entity, attribute and tenant) are kept in
+parallel arrays, so a reading costs a few array writes, not an object.
+The slot of a series without readings for AGGREGATE_IDLE_WINDOWS windows
+is reclaimed and reused by a new series, so the arrays do not grow
+with every entity ever seen.
+
+Environment variables:
+AGGREGATE_ATTRIBUTES:
+    "<attribute>=<function>:<window seconds>" pairs, for example
+    "temperature=mean:10,pressure=max:5". Default: not set, nothing is aggregated
+AGGREGATE_IDLE_WINDOWS:
+    the number of windows without readings after which a series is forgotten. Default: 10
+"""
+# Standard Library imports
+from array import array
+import json
+import math
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+# custom imports
+import Config
+from HTTPRequest import HTTPRequest
+from Logger import getLogger
+import Metrics
+import Tenancy
+
+logger = getLogger(__name__)
+
+FUNCTIONS = ("min", "max", "mean", "last")
+
+# an update of a single attribute, with the value only if the group is set
+ATTRIBUTE_PATTERN = re.compile(r'^/v2/entities/[^/?#]+/attrs/([^/?#]+)(/value)?$')
+
+
+def parse_rules(text: str) -> dict:
+    """Parse AGGREGATE_ATTRIBUTES
+
+    Args:
+        text (str): for example "temperature=mean:10,pressure=max:5"
+
+    Returns:
+        {attribute: (function, window seconds)}
+
+    Raises:
+        ValueError: if a pair is invalid
+    """
+    rules = {}
+    for pair in text.split(","):
+        if not pair.strip():
+            continue
+        attribute, _, rule = pair.partition("=")
+        function, _, window = rule.partition(":")
+        function = function.strip().lower()
+        if not attribute.strip() or function not in FUNCTIONS:
+            raise ValueError(f"Invalid aggregation: {pair}, the function must be one of {FUNCTIONS}")
+        try:
+            window = float(window)
+        except ValueError:
+            raise ValueError(f"Invalid aggregation window: {pair}") from None
+        if not window > 0:
+            raise ValueError(f"Invalid aggregation window: {pair}")
+        rules[attribute.strip()] = (function, window)
+    return rules
+
+
+try:
+    AGGREGATE_ATTRIBUTES = parse_rules(Config.get("AGGREGATE_ATTRIBUTES") or "")
+except ValueError as error:
+    raise RuntimeError(f"Critical: invalid AGGREGATE_ATTRIBUTES: {error}") from error
+AGGREGATE_IDLE_WINDOWS = Config.current().get_int("AGGREGATE_IDLE_WINDOWS", 10, minimum=1)
+
+
+def _reading(req: HTTPRequest):
+    """Return the aggregated attribute and the numeric value of an update
+
+    Returns:
+        (attribute, value), or None if the request is not an update of a single numeric attribute
+    """
+    if req.method != "PUT":
+        return None
+    match = ATTRIBUTE_PATTERN.match(urlsplit(req.url).path)
+    if match is None:
+        return None
+    attribute, value_only = match.groups()
+    try:
+        if value_only:
+            if req.headers.get("Content-Type") != "text/plain":
+                return None
+            value = json.loads(req.data)
+        else:
+            value = json.loads(req.data).get("value")
+    except (ValueError, AttributeError):
+        return None
+    if type(value) not in (int, float) or not math.isfinite(value):
+        return None
+    return attribute, value
+
+
+class Aggregator:
+    """Aggregates the readings of the configured attributes
+
+    Args:
+        rules (dict): {attribute: (function, window seconds)}, see parse_rules
+        send: the function sending the aggregated HTTPRequest of a window
+        clock: the function returning the current time in seconds
+        idle_windows (int): the number of windows without readings after which a slot is reclaimed
+    """
+
+    def __init__(self, rules: dict, send, clock=time.time, idle_windows: int = AGGREGATE_IDLE_WINDOWS):
+        self.rules = rules
+        self.send = send
+        self.clock = clock
+        self.idle_windows = idle_windows
+        self._lock = threading.Lock()
+        self._slots = {}
+        # the reclaimed slots, reused before the arrays grow
+        self._free = []
+        # the accumulators of the series, indexed by slot
+        self._count = array("q")
+        self._sum = array("d")
+        self._min = array("d")
+        self._max = array("d")
+        self._last = array("d")
+        self._ints = array("b")
+        self._window_end = array("d")
+        self._window = array("d")
+        # the function, the last request of the series, the template of the aggregated update,
+        # and the key of the series, None for a free slot
+        self._functions = []
+        self._requests = []
+        self._keys = []
+        self._thread = None
+        Metrics.register_gauge("aggregation_series", lambda: len(self._slots))
+
+    def start(self):
+        """Start the thread sending the aggregates of the ended windows"""
+        tick = min(window for _, window in self.rules.values()) / 10
+        self._thread = threading.Thread(target=self._run, args=(min(max(tick, 0.05), 1.0),),
+                                        name="aggregation", daemon=True)
+        self._thread.start()
+
+    def add(self, req: HTTPRequest) -> bool:
+        """Add a request to its window if it is aggregated
+
+        Args:
+            req (HTTPRequest): the decoded request
+
+        Returns:
+            True if the request was aggregated, False if it must be forwarded
+        """
+        reading = _reading(req)
+        if reading is None or reading[0] not in self.rules:
+            return False
+        attribute, value = reading
+        function, window = self.rules[attribute]
+        now = self.clock()
+        key = (Tenancy.tenant_of(req.headers), req.url)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._new_slot(key, function, window)
+            if self._count[slot] == 0:
+                self._window_end[slot] = (math.floor(now / window) + 1) * window
+                self._sum[slot] = 0.0
+                self._min[slot] = math.inf
+                self._max[slot] = -math.inf
+                self._ints[slot] = 1
+            self._count[slot] += 1
+            self._sum[slot] += value
+            self._min[slot] = min(self._min[slot], value)
+            self._max[slot] = max(self._max[slot], value)
+            self._last[slot] = value
+            if type(value) is not int:
+                self._ints[slot] = 0
+            self._requests[slot] = req
+        Metrics.inc("aggregation_samples_total")
+        return True
+
+    def _new_slot(self, key: tuple, function: str, window: float) -> int:
+        """Take a free slot for a new series, or grow the arrays, the lock must be held"""
+        if self._free:
+            slot = self._free.pop()
+            self._functions[slot] = function
+            self._window[slot] = window
+            self._keys[slot] = key
+        else:
+            slot = len(self._requests)
+            for accumulator in (self._count, self._ints):
+                accumulator.append(0)
+            for accumulator in (self._sum, self._min, self._max, self._last, self._window_end):
+                accumulator.append(0.0)
+            self._window.append(window)
+            self._functions.append(function)
+            self._requests.append(None)
+            self._keys.append(key)
+        self._slots[key] = slot
+        return slot
+
+    def flush(self, everything: bool = False) -> list:
+        """Send the aggregates of the ended windows
+
+        Args:
+            everything (bool): send the open windows too, at shutdown
+
+        Returns:
+            the sent requests
+        """
+        now = self.clock()
+        updates = []
+        with self._lock:
+            for slot, req in enumerate(self._requests):
+                if self._count[slot] == 0:
+                    if self._keys[slot] is not None and \
+                            now >= self._window_end[slot] + self.idle_windows * self._window[slot]:
+                        # the series is idle, its slot is reused by the next new one
+                        del self._slots[self._keys[slot]]
+                        self._keys[slot] = None
+                        self._free.append(slot)
+                    continue
+                if not everything and self._window_end[slot] > now:
+                    continue
+                updates.append(self._aggregate(slot, req))
+                self._count[slot] = 0
+                self._requests[slot] = None
+        for update in updates:
+            try:
+                self.send(update)
+            except Exception as error:
+                logger.error(f"Failed to send the aggregate of {update.url}: {type(error).__name__}: {error}")
+        Metrics.inc("aggregation_updates_total", len(updates))
+        return updates
+
+    def _aggregate(self, slot: int, req: HTTPRequest) -> HTTPRequest:
+        """Build the update of a window from its last request"""
+        function = self._functions[slot]
+        if function == "mean":
+            value = self._sum[slot] / self._count[slot]
+        else:
+            value = {"min": self._min, "max": self._max, "last": self._last}[function][slot]
+            if self._ints[slot]:
+                value = int(value)
+        headers = dict(req.headers)
+        if urlsplit(req.url).path.endswith("/value"):
+            data = json.dumps(value)
+        else:
+            data = json.dumps({**json.loads(req.data), "value": value})
+        if "Content-Length" in headers:
+            headers["Content-Length"] = str(len(data))
+        return HTTPRequest(url=req.url, headers=headers, method=req.method, transform=req.transform, data=data)
+
+    def _run(self, tick: float):
+        while True:
+            time.sleep(tick)
+            self.flush()
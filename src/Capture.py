@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+A module for capturing the traffic of the IoT devices
+
+If CAPTURE_DIR is set, the body of every POST request of an IoT device
+is appended to a rotating log in that directory, with its arrival time
+and the headers the agent reads (Content-Type and the tenant headers).
+benchmark/replay.py sends a capture to an agent again, at the original
+pace or faster, to size the hardware or to validate an upgrade.
+
+The capture is a SegmentLog without fsync: a record is a single
+write of the request as it arrived, so it is cheap enough to keep on.
+The log keeps the newest CAPTURE_MAX_BYTES, the oldest segments are dropped.
+If a record cannot be written, the request is served anyway
+and the capture_errors_total metric is incremented.
+
+A record is
+    <timestamp: 8 bytes><length of each header: 3 x 2 bytes><headers><body>
+with the timestamp in seconds since the epoch.
+
+Environment variables:
+CAPTURE_DIR:
+    the directory of the capture. Default: not set, no capture
+CAPTURE_SEGMENT_BYTES:
+    the size of a segment file. Default: 16777216
+CAPTURE_MAX_BYTES:
+    the maximum size of the capture. Default: 268435456
+"""
+# Standard Library imports
+import struct
+import time
+
+# custom imports
+import Config
+from Logger import getLogger
+import Metrics
+from SegmentLog import SegmentLog, read_records
+import Tenancy
+
+logger = getLogger(__name__)
+
+CAPTURE_DIR = Config.get("CAPTURE_DIR") or None
+CAPTURE_SEGMENT_BYTES = Config.current().get_int("CAPTURE_SEGMENT_BYTES", 16 * 1024 * 1024, minimum=1024)
+CAPTURE_MAX_BYTES = Config.current().get_int("CAPTURE_MAX_BYTES", 256 * 1024 * 1024, minimum=CAPTURE_SEGMENT_BYTES)
+
+# the headers of the device request that change how the agent handles it
+HEADERS = ("Content-Type", Tenancy.SERVICE_HEADER, Tenancy.SERVICE_PATH_HEADER)
+RECORD_HEADER = struct.Struct(">d" + "H" * len(HEADERS))
+
+
+def encode(timestamp: float, body: bytes, headers) -> bytes:
+    """Encode a captured request
+
+    Args:
+        timestamp (float): its arrival time, in seconds since the epoch
+        body (bytes): its body
+        headers: its HTTP headers, only HEADERS are kept
+
+    Returns:
+        the record
+    """
+    values = [(headers.get(name) or "").encode("utf-8") for name in HEADERS]
+    return b"".join((RECORD_HEADER.pack(timestamp, *map(len, values)), *values, body))
+
+
+def decode(record: bytes) -> tuple:
+    """Decode a captured request
+
+    Returns:
+        (timestamp, body, headers), the headers without the missing ones
+
+    Raises:
+        ValueError: if the record is too short
+    """
+    try:
+        timestamp, *lengths = RECORD_HEADER.unpack_from(record)
+    except struct.error as error:
+        raise ValueError(f"Invalid capture record: {error}") from None
+    headers = {}
+    position = RECORD_HEADER.size
+    for name, length in zip(HEADERS, lengths):
+        if length:
+            headers[name] = record[position:position + length].decode("utf-8")
+        position += length
+    if position > len(record):
+        raise ValueError("Invalid capture record: truncated headers")
+    return timestamp, record[position:], headers
+
+
+def read(directory: str):
+    """Read a capture, oldest request first
+
+    Args:
+        directory (str): the CAPTURE_DIR of the capture
+
+    Yields:
+        (timestamp, body, headers) of every request
+
+    Raises:
+        OSError: if the directory cannot be read
+    """
+    for record in read_records(directory):
+        yield decode(record)
+
+
+class Capture:
+    """Appends the requests of the IoT devices to a capture
+
+    Args:
+        directory (str): the directory of the capture, created if missing
+        segment_bytes (int): the size of a segment file
+        max_bytes (int): the maximum size of the capture
+
+    Raises:
+        OSError: if the directory cannot be created or read
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = CAPTURE_SEGMENT_BYTES, max_bytes: int = CAPTURE_MAX_BYTES):
+        self.log = SegmentLog(directory, segment_bytes=segment_bytes, fsync=False, max_bytes=max_bytes)
+
+    def record(self, body: bytes, headers):
+        """Capture a request, never raises
+
+        Args:
+            body (bytes): the body of the request
+            headers: its HTTP headers
+        """
+        try:
+            self.log.append(encode(time.time(), body, headers))
+        except (OSError, struct.error) as error:
+            # struct.error: a header longer than 65535 bytes
+            Metrics.inc("capture_errors_total")
+            logger.debug(f"Failed to capture the request: {error}")
+            return
+        Metrics.inc("capture_records_total")
+
+    def close(self):
+        """Close the capture"""
+        self.log.close()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the encodings of the requests of the IoT devices
+
+The IoT devices may send the request object (url, method, headers,
+data, transform) in a compact binary encoding instead of JSON text,
+selected by the Content-Type header of their HTTP request:
+    - application/cbor: CBOR (RFC 8949), needs the cbor2 package
+    - application/msgpack, application/x-msgpack, application/vnd.msgpack:
+      MessagePack, needs the msgpack package
+Every other Content-Type is decoded as JSON, as before.
+
+The binary encodings are decoded straight into python objects,
+without an intermediate JSON text. The cbor2 and msgpack packages are
+optional and imported at the first request using them. If the package
+of an encoding is missing, its requests are refused with
+UnsupportedMediaTypeError.
+"""
+# Standard Library imports
+import importlib
+import json
+
+# custom imports
+from Logger import getLogger
+
+logger = getLogger(__name__)
+
+CBOR_TYPES = ("application/cbor",)
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# media type: (package, function decoding bytes)
+_DECODERS = {
+    **{media_type: ("cbor2", lambda module, body: module.loads(body)) for media_type in CBOR_TYPES},
+    **{media_type: ("msgpack", lambda module, body: module.unpackb(body, raw=False)) for media_type in MSGPACK_TYPES},
+}
+
+# package: the imported module, or None if it is not installed
+_modules = {}
+
+
+class UnsupportedMediaTypeError(Exception):
+    """The encoding of the request is not supported by the installed packages"""
+
+
+def is_binary(content_type: str) -> bool:
+    """Check if a Content-Type is one of the binary encodings"""
+    return media_type(content_type) in _DECODERS
+
+
+def media_type(content_type: str) -> str:
+    """Return the media type of a Content-Type header, without its parameters"""
+    if not content_type:
+        return ""
+    return content_type.split(";", 1)[0].strip().lower()
+
+
+def _module(package: str):
+    """Import an optional package once
+
+    Returns:
+        the module, or None if the package is not installed
+    """
+    if package not in _modules:
+        try:
+            _modules[package] = importlib.import_module(package)
+        except ImportError:
+            logger.warning(f"The {package} package is not installed, its encoding is not supported")
+            _modules[package] = None
+    return _modules[package]
+
+
+def available() -> list:
+    """Import the optional packages and return the supported binary media types"""
+    return [media_type for media_type, (package, _) in _DECODERS.items() if _module(package) is not None]
+
+
+def decode(body: bytes, content_type: str = None):
+    """Decode the body of a request
+
+    Args:
+        body (bytes): the body of the HTTP request
+        content_type (str): its Content-Type header
+
+    Returns:
+        the decoded object
+
+    Raises:
+        UnsupportedMediaTypeError: if the package of the encoding is not installed
+        ValueError: if the body cannot be decoded
+    """
+    decoder = _DECODERS.get(media_type(content_type))
+    if decoder is None:
+        return json.loads(body)
+    package, function = decoder
+    module = _module(package)
+    if module is None:
+        raise UnsupportedMediaTypeError(f"{media_type(content_type)} is not supported: "
+                                        f"the {package} package is not installed")
+    try:
+        return function(module, body)
+    except Exception as error:
+        raise ValueError(f"The body is not valid {media_type(content_type)}: {error}") from error
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the HTTP compression of the agent
+
+The agent can compress, with gzip or deflate:
+    - the bodies of the POST and PUT requests it sends to Orion, if
+      ORION_COMPRESSION is set. Orion itself does not decode compressed
+      requests, so this is for an Orion behind a proxy that does,
+      for example across a slow plant network link.
+    - the responses to the IoT devices sending an Accept-Encoding header,
+      if COMPRESS_RESPONSES is true. Only the forwarded Orion responses
+      are compressed, the error messages of the agent are short.
+The bodies below COMPRESSION_MIN_BYTES are sent as they are, since compressing
+the small messages of a PLC costs CPU time and saves hardly any bytes.
+
+The responses of Orion are always accepted compressed: requests sends
+"Accept-Encoding: gzip, deflate" and decodes the responses.
+
+benchmark/bench_compression.py measures the CPU time and the saved bytes
+for typical entity sizes.
+
+Environment variables:
+ORION_COMPRESSION:
+    "gzip" or "deflate" to compress the request bodies to Orion. Default: none
+COMPRESS_RESPONSES:
+    "true" to compress the responses to the IoT devices. Default: false
+COMPRESSION_MIN_BYTES:
+    the smallest body that is compressed. Default: 1024
+COMPRESSION_LEVEL:
+    the compression level, 1 (fastest) to 9 (smallest). Default: 6
+"""
+# Standard Library imports
+import gzip
+import zlib
+
+# custom imports
+import Config
+import Metrics
+
+ENCODINGS = ("gzip", "deflate")
+
+ORION_COMPRESSION = (Config.get("ORION_COMPRESSION") or "none").lower().strip()
+if ORION_COMPRESSION == "none":
+    ORION_COMPRESSION = None
+elif ORION_COMPRESSION not in ENCODINGS:
+    raise RuntimeError(f"Critical: invalid ORION_COMPRESSION: {ORION_COMPRESSION}, use one of {ENCODINGS} or none")
+COMPRESS_RESPONSES = Config.current().get_bool("COMPRESS_RESPONSES", False)
+COMPRESSION_MIN_BYTES = Config.current().get_int("COMPRESSION_MIN_BYTES", 1024, minimum=0)
+COMPRESSION_LEVEL = min(Config.current().get_int("COMPRESSION_LEVEL", 6, minimum=1), 9)
+
+
+def compress(body: bytes, encoding: str, level: int = COMPRESSION_LEVEL) -> bytes:
+    """Compress a body
+
+    Args:
+        body (bytes): the body
+        encoding (str): "gzip" or "deflate"
+        level (int): the compression level
+
+    Returns:
+        the compressed body
+    """
+    if encoding == "gzip":
+        # mtime=0: the same body is compressed to the same bytes
+        return gzip.compress(body, level, mtime=0)
+    # the HTTP deflate encoding is the zlib format
+    return zlib.compress(body, level)
+
+
+def accepted_encoding(accept_encoding: str):
+    """Choose the encoding of a response
+
+    Args:
+        accept_encoding (str): the Accept-Encoding header of the request
+
+    Returns:
+        "gzip" or "deflate", gzip preferred, None if neither is accepted
+    """
+    if not accept_encoding:
+        return None
+    accepted = set()
+    # the encodings refused with q=0, which the wildcard does not accept
+    refused = set()
+    wildcard = False
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.partition(";")
+        name = name.strip().lower()
+        quality = parameters.strip().lower()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    refused.add(name)
+                    continue
+            except ValueError:
+                continue
+        if name == "*":
+            wildcard = True
+        accepted.add(name)
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    if wildcard:
+        for encoding in ENCODINGS:
+            if encoding not in refused:
+                return encoding
+    return None
+
+
+def _compress_if_large(body: bytes, encoding: str, direction: str) -> tuple:
+    if encoding is None or len(body) < COMPRESSION_MIN_BYTES:
+        return body, None
+    compressed = compress(body, encoding)
+    if len(compressed) >= len(body):
+        return body, None
+    Metrics.inc(f"compression_{direction}_bytes_total", len(body))
+    Metrics.inc(f"compression_{direction}_compressed_bytes_total", len(compressed))
+    return compressed, encoding
+
+
+def compress_request(body: bytes) -> tuple:
+    """Compress the body of a request to Orion, see ORION_COMPRESSION
+
+    Returns:
+        (the body to send, its Content-Encoding, None if it is not compressed)
+    """
+    return _compress_if_large(body, ORION_COMPRESSION, "request")
+
+
+def compress_response(body: bytes, accept_encoding: str) -> tuple:
+    """Compress a response to an IoT device, see COMPRESS_RESPONSES
+
+    Args:
+        body (bytes): the response
+        accept_encoding (str): the Accept-Encoding header of the IoT device
+
+    Returns:
+        (the body to send, its Content-Encoding, None if it is not compressed)
+    """
+    if not COMPRESS_RESPONSES:
+        return body, None
+    return _compress_if_large(body, accepted_encoding(accept_encoding), "response")
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the adaptive concurrency limit of the requests to Orion
+
+A fixed number of senders either under-uses Orion or overloads it,
+depending on the load of its database. If ADAPTIVE_CONCURRENCY is true,
+the requests to each Orion (the forwarded ones, the plugin's lookups
+and the health probes) wait for a slot of an AdaptiveLimiter, see Sessions.py.
+
+The limiter adjusts the number of slots to the response times of Orion
+(additive increase, multiplicative decrease):
+    - it remembers the lowest response time, the latency of Orion without queueing
+    - while the smoothed response time stays below CONCURRENCY_LATENCY_TOLERANCE
+      times the lowest one and all the slots are used, the limit grows
+      by one slot per limit responses
+    - when the response time climbs above that, or Orion fails or responds
+      with 429 or 503, the limit is cut by CONCURRENCY_BACKOFF, at most once per round trip
+So the concurrency tracks the capacity of Orion. The limit of every Orion
+is reported in the concurrency_limit metric, summed over the Orion instances.
+
+The in-flight requests are limited by the threads sending them too,
+so SENDER_THREADS should be at least CONCURRENCY_MAX_LIMIT.
+
+Environment variables:
+ADAPTIVE_CONCURRENCY:
+    "true" to limit the concurrent requests to each Orion. Default: false
+CONCURRENCY_INITIAL_LIMIT:
+    the initial limit. Default: 4
+CONCURRENCY_MIN_LIMIT:
+    the lowest limit. Default: 1
+CONCURRENCY_MAX_LIMIT:
+    the highest limit. Default: 64
+CONCURRENCY_LATENCY_TOLERANCE:
+    the response time, relative to the lowest one, above which the limit is cut. Default: 2
+CONCURRENCY_BACKOFF:
+    the factor of the cut. Default: 0.8
+CONCURRENCY_TIMEOUT:
+    the maximum number of seconds to wait for a slot. Default: 5,
+    then ConcurrencyLimitError is raised
+"""
+# Standard Library imports
+import threading
+import time
+
+# custom imports
+import Config
+from Logger import getLogger
+import Metrics
+
+logger = getLogger(__name__)
+
+ADAPTIVE_CONCURRENCY = Config.current().get_bool("ADAPTIVE_CONCURRENCY", False)
+CONCURRENCY_MIN_LIMIT = Config.current().get_int("CONCURRENCY_MIN_LIMIT", 1, minimum=1)
+CONCURRENCY_MAX_LIMIT = Config.current().get_int("CONCURRENCY_MAX_LIMIT", 64, minimum=CONCURRENCY_MIN_LIMIT)
+CONCURRENCY_INITIAL_LIMIT = min(max(Config.current().get_int("CONCURRENCY_INITIAL_LIMIT", 4),
+                                    CONCURRENCY_MIN_LIMIT), CONCURRENCY_MAX_LIMIT)
+CONCURRENCY_LATENCY_TOLERANCE = max(Config.current().get_float("CONCURRENCY_LATENCY_TOLERANCE", 2.0), 1.0)
+CONCURRENCY_BACKOFF = Config.current().get_float("CONCURRENCY_BACKOFF", 0.8)
+if not 0 < CONCURRENCY_BACKOFF < 1:
+    CONCURRENCY_BACKOFF = 0.8
+CONCURRENCY_TIMEOUT = Config.current().get_float("CONCURRENCY_TIMEOUT", 5.0)
+
+
+class ConcurrencyLimitError(Exception):
+    """Raised when a request to Orion waited CONCURRENCY_TIMEOUT seconds for a slot
+
+    Orion is reachable but saturated, so the request is neither buffered
+    nor reported as a connection error, the agent is overloaded.
+    """
+
+
+# the share of a new response time in the smoothed one
+SMOOTHING = 0.2
+# the share of a new response time in the lowest one, if it is higher,
+# so that a permanently slower Orion becomes the new normal
+BASELINE_DRIFT = 0.001
+
+
+class AdaptiveLimiter:
+    """Limits the concurrent requests to an Orion, adapting the limit to its response times
+
+    Args:
+        initial (int): the initial limit
+        min_limit (int): the lowest limit
+        max_limit (int): the highest limit
+        tolerance (float): the response time, relative to the lowest one, above which the limit is cut
+        backoff (float): the factor of the cut
+        clock: the function returning the current time in seconds
+    """
+
+    def __init__(self, initial: int = CONCURRENCY_INITIAL_LIMIT, min_limit: int = CONCURRENCY_MIN_LIMIT,
+                 max_limit: int = CONCURRENCY_MAX_LIMIT, tolerance: float = CONCURRENCY_LATENCY_TOLERANCE,
+                 backoff: float = CONCURRENCY_BACKOFF, clock=time.monotonic):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.clock = clock
+        self.in_flight = 0
+        # the lowest and the smoothed response time
+        self.baseline = None
+        self.latency = None
+        self._last_decrease = None
+        self._changed = threading.Condition()
+
+    def acquire(self, timeout: float = None) -> bool:
+        """Wait for a free slot
+
+        Args:
+            timeout (float): the maximum number of seconds to wait. Default: no limit
+
+        Returns:
+            True if a slot was taken, False if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float, overloaded: bool = False):
+        """Free a slot and adapt the limit
+
+        Args:
+            latency (float): the response time of the request in seconds,
+                None if it was not sent, then the limit does not change
+            overloaded (bool): the request failed or Orion was overloaded
+        """
+        with self._changed:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if latency is None:
+                self._changed.notify()
+                return
+            if not overloaded:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += (latency - self.baseline) * BASELINE_DRIFT
+                self.latency = latency if self.latency is None else \
+                    SMOOTHING * latency + (1 - SMOOTHING) * self.latency
+            now = self.clock()
+            if overloaded or self.latency > self.tolerance * self.baseline:
+                # the responses to the requests sent before the cut do not cut again
+                if self._last_decrease is None or now - self._last_decrease >= (self.latency or latency):
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._changed.notify()
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def limiter_for(target: str) -> AdaptiveLimiter:
+    """Return the limiter of a target, created at the first call
+
+    Args:
+        target (str): the "host:port" of the target
+    """
+    with _lock:
+        limiter = _limiters.get(target)
+        if limiter is None:
+            limiter = _limiters[target] = AdaptiveLimiter()
+    return limiter
+
+
+def _total(attribute: str):
+    with _lock:
+        limiters = list(_limiters.values())
+    return sum(int(getattr(limiter, attribute)) for limiter in limiters)
+
+
+if ADAPTIVE_CONCURRENCY:
+    Metrics.register_gauge("concurrency_limit", lambda: _total("limit"))
+    Metrics.register_gauge("concurrency_in_flight", lambda: _total("in_flight"))
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+The central configuration of the IoT agent
+
+The settings are the environment variables. If CONFIG_FILE is set,
+the KEY=VALUE lines of that file override them. The file has the format
+of docker's --env-file: empty lines and lines starting with # are ignored.
+
+The configuration can be reloaded while the agent is running, after
+editing CONFIG_FILE, with kill -HUP <pid> or POST /admin/reload.
+The modules register the settings they can change at runtime with
+add_listener. A reload is atomic: every affected listener first checks
+the new settings and prepares the change, and only if all of them
+succeed are the changes committed. Otherwise the old configuration stays.
+The other settings are applied at the next restart.
+
+Environment variables:
+CONFIG_FILE:
+    the path of the configuration file. Default: not set
+"""
+# Standard Library imports
+import os
+import threading
+
+CONFIG_FILE = os.environ.get("CONFIG_FILE")
+if not CONFIG_FILE:
+    CONFIG_FILE = None
+
+
+class Config:
+    """An immutable snapshot of the settings
+
+    The typed getters fall back to the default if the setting
+    is missing or invalid, like the module-level settings do.
+
+    Args:
+        values (dict): the settings by name
+    """
+
+    def __init__(self, values: dict):
+        self._values = dict(values)
+
+    def get(self, name: str, default: str = None) -> str:
+        """Return a setting as a string, default if it is not set"""
+        return self._values.get(name, default)
+
+    def get_int(self, name: str, default: int, minimum: int = None) -> int:
+        """Return a setting as an int, default if it is not set or invalid"""
+        try:
+            value = int(self._values[name])
+        except (KeyError, TypeError, ValueError):
+            return default
+        return default if minimum is not None and value < minimum else value
+
+    def get_float(self, name: str, default: float) -> float:
+        """Return a setting as a float, default if it is not set or invalid"""
+        try:
+            return float(self._values[name])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def get_bool(self, name: str, default: bool) -> bool:
+        """Return a setting as a bool, "true" or "false" in any case"""
+        value = str(self._values.get(name, "")).strip().lower()
+        if value == "true":
+            return True
+        if value == "false":
+            return False
+        return default
+
+    def changed(self, other: "Config") -> set:
+        """Return the names of the settings that differ from another snapshot"""
+        return {name for name in self._values.keys() | other._values.keys()
+                if self._values.get(name) != other._values.get(name)}
+
+
+def read_file(path: str) -> dict:
+    """Read the KEY=VALUE lines of a configuration file
+
+    Args:
+        path (str): the path of the file
+
+    Returns:
+        the settings by name
+
+    Raises:
+        OSError: if the file cannot be read
+        ValueError: if a line is not KEY=VALUE
+    """
+    values = {}
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("export "):
+                line = line[len("export "):]
+            name, separator, value = line.partition("=")
+            if not separator or not name.strip():
+                raise ValueError(f"{path}, line {number}: not a KEY=VALUE line: {line}")
+            values[name.strip()] = value.strip()
+    return values
+
+
+# the environment of a process does not change from the outside,
+# it is read once, only the CONFIG_FILE is read again by reload
+_environment = dict(os.environ)
+
+
+def load() -> Config:
+    """Read the CONFIG_FILE over the environment variables
+
+    Raises:
+        OSError: if CONFIG_FILE cannot be read
+        ValueError: if CONFIG_FILE is invalid
+    """
+    values = dict(_environment)
+    if CONFIG_FILE is not None:
+        values.update(read_file(CONFIG_FILE))
+    return Config(values)
+
+
+try:
+    _current = load()
+except (OSError, ValueError) as error:
+    raise RuntimeError(f"Critical: cannot read CONFIG_FILE: {error}") from error
+
+# reentrant: a listener may import a module registering another listener
+_lock = threading.RLock()
+# (names, prepare) pairs, see add_listener
+_listeners = []
+
+
+def current() -> Config:
+    """Return the current configuration"""
+    return _current
+
+
+def get(name: str, default: str = None) -> str:
+    """Return a setting of the current configuration as a string"""
+    return _current.get(name, default)
+
+
+def add_listener(names: tuple, prepare):
+    """Register a function applying some settings at runtime
+
+    Args:
+        names (tuple): the names of the settings the function applies
+        prepare: called with the new Config if one of the settings changed.
+            It checks the settings, raising ValueError if they are invalid,
+            and returns a function without arguments that applies them.
+            The returned function must not fail.
+    """
+    with _lock:
+        _listeners.append((frozenset(names), prepare))
+
+
+def is_reloadable(name: str) -> bool:
+    """Check if a setting is applied at runtime"""
+    return any(name in names for names, _ in _listeners)
+
+
+def reload() -> list:
+    """Reload the configuration and apply the changed settings
+
+    Returns:
+        the sorted names of the changed settings
+
+    Raises:
+        OSError: if CONFIG_FILE cannot be read
+        ValueError: if CONFIG_FILE or a changed setting is invalid,
+            the old configuration stays in effect
+    """
+    global _current
+    with _lock:
+        new = load()
+        old = _current
+        changed = new.changed(old)
+        # the listeners may import modules reading the new settings
+        _current = new
+        try:
+            commits = [prepare(new) for names, prepare in list(_listeners) if names & changed]
+        except BaseException:
+            _current = old
+            raise
+        for commit in commits:
+            if commit is not None:
+                commit()
+    return sorted(changed)
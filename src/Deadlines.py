@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the deadlines of the requests
+
+Every request of an IoT device gets a deadline when it arrives:
+REQUEST_TIMEOUT seconds later, or the "timeout" given in the request,
+at most REQUEST_MAX_TIMEOUT. The deadline is kept per thread like the
+trace, see Tracing.py, and travels with the request through the pipeline.
+
+Every HTTP request to Orion, forwarded or sent by the plugin, times out
+at the deadline, see Sessions.py. The requests without a deadline, such as
+the replays of the offline buffer, time out after REQUEST_TIMEOUT seconds.
+A request whose deadline passed while it was queued is not sent at all.
+
+Environment variables:
+REQUEST_TIMEOUT:
+    the seconds a request of an IoT device may take. Default: 10
+REQUEST_MAX_TIMEOUT:
+    the maximum "timeout" of a request. Default: 60
+"""
+# Standard Library imports
+import threading
+import time
+
+# custom imports
+import Config
+
+REQUEST_TIMEOUT = Config.current().get_float("REQUEST_TIMEOUT", 10.0)
+if not REQUEST_TIMEOUT > 0:
+    REQUEST_TIMEOUT = 10.0
+REQUEST_MAX_TIMEOUT = max(Config.current().get_float("REQUEST_MAX_TIMEOUT", 60.0), REQUEST_TIMEOUT)
+
+_local = threading.local()
+
+
+class DeadlineExceededError(Exception):
+    """Raised if the deadline of a request passed before it was done"""
+
+
+def start(timeout: float = None) -> float:
+    """Start the deadline of a new request in the current thread
+
+    Args:
+        timeout (float): the seconds the request may take. Default: REQUEST_TIMEOUT
+
+    Returns:
+        the deadline, in time.monotonic() seconds
+    """
+    _local.started = time.monotonic()
+    _local.deadline = _local.started + (REQUEST_TIMEOUT if timeout is None else timeout)
+    return _local.deadline
+
+
+def set_timeout(timeout) -> float:
+    """Change the deadline of the current request to a timeout given by the IoT device
+
+    The timeout counts from the start of the request and is capped by REQUEST_MAX_TIMEOUT.
+
+    Args:
+        timeout: the seconds the request may take
+
+    Returns:
+        the new deadline
+
+    Raises:
+        ValueError: if the timeout is not a positive number
+    """
+    timeout = float(timeout)
+    if not timeout > 0:
+        raise ValueError(f"Invalid timeout: {timeout}, it must be a positive number of seconds")
+    started = getattr(_local, "started", None)
+    if started is None:
+        return start(min(timeout, REQUEST_MAX_TIMEOUT))
+    _local.deadline = started + min(timeout, REQUEST_MAX_TIMEOUT)
+    return _local.deadline
+
+
+def current():
+    """Return the deadline of the current thread, None if there is none"""
+    return getattr(_local, "deadline", None)
+
+
+def activate(deadline):
+    """Set the deadline of the current thread
+
+    Args:
+        deadline (float): the deadline to continue, or None to clear it
+    """
+    _local.deadline = deadline
+    _local.started = None
+
+
+def remaining():
+    """Return the seconds left until the deadline, None if there is none"""
+    deadline = current()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired() -> bool:
+    """Check if the deadline of the current thread passed"""
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check():
+    """Raise DeadlineExceededError if the deadline of the current thread passed"""
+    if expired():
+        raise DeadlineExceededError("The deadline of the request passed")
+
+
+def timeout_for(timeout=None):
+    """Return the timeout of an HTTP request sent in the current thread
+
+    Args:
+        timeout: the timeout asked by the caller, if any
+
+    Returns:
+        the caller's timeout, shortened to the deadline, or REQUEST_TIMEOUT
+        if there is neither. A (connect, read) tuple is returned as it is.
+
+    Raises:
+        DeadlineExceededError: if the deadline passed
+    """
+    if isinstance(timeout, tuple):
+        return timeout
+    left = remaining()
+    if left is None:
+        return REQUEST_TIMEOUT if timeout is None else timeout
+    if left <= 0:
+        raise DeadlineExceededError("The deadline of the request passed")
+    return left if timeout is None else min(timeout, left)
@@ -17,9 +17,16 @@ class HTTPRequest:
     and thus does not uses the transform field.
     The transform field may be used to pass moTe information
     to the plugin.transform module
+
+    The idempotency_key is set if the IoT device sent one,
+    duplicates of the request are not sent to Orion again
+
+    The priority is "high" or "normal", see Priority.py
     """
     url: str
     headers: dict
     method: str
     transform: dict = field(default_factory=lambda: {})
     data: str = field(default='')
+    idempotency_key: str = field(default='')
+    priority: str = field(default='normal')
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the health of the IoT agent and its Orion brokers
+
+The OrionProbe checks every Orion the agent sends requests to in the
+background, with GET /version, so GET /ready can report the result
+without sending a request to Orion itself.
+
+Each Orion has a circuit breaker driven by the probes. It opens
+after HEALTH_FAILURE_THRESHOLD consecutive failed probes and closes
+at the first successful one. The agent is not ready while a breaker is open.
+
+Environment variables:
+HEALTH_PROBE_INTERVAL:
+    the seconds between two probes of an Orion. Default: 5
+HEALTH_PROBE_TIMEOUT:
+    the seconds to wait for the response of a probe. Default: 2
+HEALTH_FAILURE_THRESHOLD:
+    the consecutive failed probes that open the breaker. Default: 3
+"""
+# Standard Library imports
+import threading
+import time
+
+# custom imports
+import Config
+from Logger import getLogger
+import Metrics
+import Sessions
+
+logger = getLogger(__name__)
+
+HEALTH_PROBE_INTERVAL = Config.current().get_float("HEALTH_PROBE_INTERVAL", 5.0)
+HEALTH_PROBE_TIMEOUT = Config.current().get_float("HEALTH_PROBE_TIMEOUT", 2.0)
+HEALTH_FAILURE_THRESHOLD = Config.current().get_int("HEALTH_FAILURE_THRESHOLD", 3, minimum=1)
+
+
+class OrionProbe:
+    """Probes the Orion brokers in the background
+
+    Args:
+        targets: a function returning the "host:port" addresses to probe,
+            called before every round, so changed targets are picked up
+        interval (float): the seconds between two rounds
+        timeout (float): the timeout of a probe
+        failure_threshold (int): the consecutive failures that open a breaker
+    """
+
+    def __init__(self, targets, interval: float = HEALTH_PROBE_INTERVAL,
+                 timeout: float = HEALTH_PROBE_TIMEOUT, failure_threshold: int = HEALTH_FAILURE_THRESHOLD):
+        self.targets = targets
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self._lock = threading.Lock()
+        self._states = {}
+        self._thread = None
+        Metrics.register_gauge("orion_breakers_open", lambda: sum(
+            1 for state in self.status().values() if state["breaker"] == "open"))
+
+    def start(self):
+        """Start the probe thread"""
+        self._thread = threading.Thread(target=self._run, name="orion-probe", daemon=True)
+        self._thread.start()
+
+    def probe(self, address: str) -> dict:
+        """Probe an Orion once and update its state
+
+        Args:
+            address (str): the "host:port" of the Orion
+
+        Returns:
+            the new state of the Orion, see status
+        """
+        url = f"http://{address}/version"
+        started = time.perf_counter()
+        error = None
+        try:
+            response = Sessions.get_session(url).get(url, timeout=self.timeout)
+            response.close()
+            if response.status_code >= 500:
+                error = f"status code {response.status_code}"
+        except Exception as probe_error:
+            error = f"{type(probe_error).__name__}: {probe_error}"
+        latency = time.perf_counter() - started
+        with self._lock:
+            state = self._states.setdefault(address, {"failures": 0})
+            state["failures"] = state["failures"] + 1 if error else 0
+            state["checked_at"] = time.time()
+            state["latency_ms"] = round(latency * 1e3, 3)
+            state["error"] = error
+            opened = state.get("breaker") != "open" and state["failures"] >= self.failure_threshold
+            closed = state.get("breaker") == "open" and not error
+            state["breaker"] = "open" if state["failures"] >= self.failure_threshold else "closed"
+            result = dict(state)
+        if opened:
+            logger.warning(f"Orion {address} is unreachable, breaker opened: {error}")
+            Metrics.inc("orion_breaker_opened_total")
+        elif closed:
+            logger.info(f"Orion {address} is reachable again, breaker closed")
+        return result
+
+    def status(self) -> dict:
+        """Return the state of every probed Orion
+
+        Returns:
+            a dict by "host:port" of dicts with the keys breaker ("open" or
+            "closed"), failures (consecutive), checked_at (epoch seconds),
+            latency_ms and error (None if the last probe succeeded)
+        """
+        with self._lock:
+            return {address: dict(state) for address, state in self._states.items()}
+
+    def healthy(self) -> bool:
+        """Check if every breaker is closed and every target was probed"""
+        states = self.status()
+        return all(address in states and states[address]["breaker"] == "closed"
+                   for address in self.targets())
+
+    def _run(self):
+        """Probe every target forever"""
+        while True:
+            try:
+                targets = list(self.targets())
+            except Exception as error:
+                logger.error(f"Failed to get the Orion targets: {error}")
+                targets = []
+            with self._lock:
+                for address in set(self._states) - set(targets):
+                    del self._states[address]
+            for address in targets:
+                self.probe(address)
+            time.sleep(self.interval)
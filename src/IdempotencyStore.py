@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""The IdempotencyStore class
+
+IoT devices retry a request if their HTTP library times out, even if
+the IoT agent has already forwarded it to Orion. To make retries safe,
+a device can put an idempotency key into the request. The store keeps
+the Orion responses of the recently completed keys for a time window,
+so a retried request gets the same response without touching Orion.
+
+If a duplicate arrives while the first request is still being processed,
+it waits for the result of the first request.
+"""
+# Standard Library imports
+from collections import OrderedDict
+import threading
+import time
+
+
+class _Entry:
+    __slots__ = ("done", "expires_at", "response")
+
+    def __init__(self, expires_at: float):
+        self.done = threading.Event()
+        self.expires_at = expires_at
+        self.response = None
+
+
+class IdempotencyStore:
+    """A bounded, time-windowed store of completed requests
+
+    Args:
+        ttl (float): the number of seconds a completed key is remembered for
+        max_keys (int): the maximum number of remembered keys,
+            the oldest keys are forgotten first
+        wait_timeout (float): the maximum number of seconds a duplicate
+            waits for the first request to complete
+    """
+
+    def __init__(self, ttl: float, max_keys: int, wait_timeout: float = 30.0):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """Start processing a request with an idempotency key
+
+        Args:
+            key: the idempotency key, any hashable value
+
+        Returns:
+            None if the key is new: the caller must process the request,
+                then call complete or abort.
+            The stored response if the key was completed,
+                or completes while waiting for it.
+        """
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                self._evict(now)
+                entry = self._entries.get(key)
+                if entry is None:
+                    self._entries[key] = _Entry(now + self.ttl)
+                    return None
+            entry.done.wait(self.wait_timeout)
+            if entry.response is not None:
+                return entry.response
+            if not entry.done.is_set():
+                # the first request is stuck, process this one too
+                return None
+            # the first request failed, try to become the first one
+
+    def complete(self, key, response):
+        """Store the response of a processed request
+
+        Args:
+            key: the idempotency key
+            response: the response to return to the duplicates
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(0)
+            entry.response = response
+            entry.expires_at = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+        entry.done.set()
+
+    def abort(self, key):
+        """Forget a key whose request failed, so it can be retried
+
+        Args:
+            key: the idempotency key
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+    def _evict(self, now: float):
+        """Forget the expired and the oldest keys, the lock must be held"""
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at >= now and len(self._entries) < self.max_keys:
+                break
+            del self._entries[key]
+            entry.done.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
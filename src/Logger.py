@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 """
 A module for configuring all loggers identically
-All the options are set in environment variables
+All the options are set in environment variables or in the CONFIG_FILE,
+see Config.py. LOGGING_LEVEL is applied to every logger when the
+configuration is reloaded
 
 Environment variables (defaults are starred):
 LOGGING_LEVEL:
@@ -19,19 +21,34 @@ LOG_TO_FILE:
 LOG_TO_STDOUT:
     TRUE*
     FALSE
+
+ACCESS_LOG:
+    TRUE*
+    FALSE
+    one JSON line per request handled by the IoT agent
+
+ACCESS_LOG_FILE:
+    the file the access log is written to.
+    Default: stdout
 """
 # Standard Library imports
+import atexit
 import logging
-import os
+import logging.handlers
+import queue
 import sys
+import threading
+
+# custom imports
+import Config
 
 # get environment variables
 # if they are missing, set default values
-LOGGING_LEVEL = os.environ.get("LOGGING_LEVEL")
+LOGGING_LEVEL = Config.get("LOGGING_LEVEL")
 if LOGGING_LEVEL is None:
     LOGGING_LEVEL = "DEBUG"
 
-LOG_TO_FILE = os.environ.get("LOG_TO_FILE")
+LOG_TO_FILE = Config.get("LOG_TO_FILE")
 if LOG_TO_FILE is None:
     LOG_TO_FILE = True
 elif LOG_TO_FILE.lower() == "false":
@@ -39,7 +56,7 @@ elif LOG_TO_FILE.lower() == "false":
 else:
     LOG_TO_FILE = True
 
-LOG_TO_STDOUT = os.environ.get("LOG_TO_STDOUT")
+LOG_TO_STDOUT = Config.get("LOG_TO_STDOUT")
 if LOG_TO_STDOUT is None:
     LOG_TO_STDOUT = True
 elif LOG_TO_STDOUT.lower() == "false":
@@ -48,31 +65,126 @@ else:
     LOG_TO_STDOUT = True
 
 
+ACCESS_LOG = Config.get("ACCESS_LOG")
+if ACCESS_LOG is None:
+    ACCESS_LOG = True
+elif ACCESS_LOG.lower() == "false":
+    ACCESS_LOG = False
+else:
+    ACCESS_LOG = True
+
+ACCESS_LOG_FILE = Config.get("ACCESS_LOG_FILE")
+
+LOGGING_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+# the names of the loggers configured by getLogger
+_names = set()
+# the handlers shared by all loggers, created by the first getLogger call
+_handlers = None
+_lock = threading.Lock()
+
+
+def _sharedHandlers() -> list:
+    """Create the file and stream handlers once, the lock must be held"""
+    global _handlers
+    if _handlers is None:
+        formatter = logging.Formatter("%(asctime)s:%(name)s:%(message)s")
+        _handlers = []
+        if LOG_TO_FILE:
+            _handlers.append(logging.FileHandler(f"{__name__}.log"))
+        if LOG_TO_STDOUT:
+            _handlers.append(logging.StreamHandler(sys.stdout))
+        for handler in _handlers:
+            handler.setFormatter(formatter)
+    return _handlers
+
+
 def getLogger(name: str):
     """Return a configured logger
 
+    Calling the function again with the same name returns the same
+    logger without adding handlers again. All loggers share
+    one file handler and one stream handler.
+
     Args:
         name (str): the invoking module's __name__
 
     Returns:
         A logger for a specific file.
     """
-    logging_levels = {
-        "DEBUG": logging.DEBUG,
-        "INFO": logging.INFO,
-        "WARNING": logging.WARNING,
-        "ERROR": logging.ERROR,
-        "CRITICAL": logging.CRITICAL,
-    }
     logger = logging.getLogger(name)
-    formatter = logging.Formatter("%(asctime)s:%(name)s:%(message)s")
-    logger.setLevel(logging_levels[LOGGING_LEVEL])
-    if LOG_TO_FILE:
-        file_handler = logging.FileHandler(f"{__name__}.log")
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    if LOG_TO_STDOUT:
-        stream_handler = logging.StreamHandler(sys.stdout)
-        stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+    with _lock:
+        if name in _names:
+            return logger
+        logger.setLevel(LOGGING_LEVELS[LOGGING_LEVEL])
+        for handler in _sharedHandlers():
+            logger.addHandler(handler)
+        _names.add(name)
     return logger
+
+
+def getAccessLogger():
+    """Return the access logger
+
+    The records are put into an in-memory queue and written
+    by a background thread, so logging never blocks the request handlers.
+    Calling the function again returns the same logger.
+
+    Returns:
+        the access logger, disabled if ACCESS_LOG is false
+    """
+    logger = logging.getLogger("access")
+    if logger.handlers:
+        return logger
+    logger.propagate = False
+    if not ACCESS_LOG:
+        logger.disabled = True
+        logger.addHandler(logging.NullHandler())
+        return logger
+    if ACCESS_LOG_FILE:
+        sink = logging.FileHandler(ACCESS_LOG_FILE)
+    else:
+        sink = logging.StreamHandler(sys.stdout)
+    sink.setFormatter(logging.Formatter("%(message)s"))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, sink)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def setLevel(level: str):
+    """Change the level of every logger configured by getLogger
+
+    Args:
+        level (str): one of the keys of LOGGING_LEVELS, in any case
+
+    Raises:
+        ValueError: if the level is unknown
+    """
+    global LOGGING_LEVEL
+    level = level.upper()
+    if level not in LOGGING_LEVELS:
+        raise ValueError(f"Unknown LOGGING_LEVEL: {level}, use one of {', '.join(LOGGING_LEVELS)}")
+    LOGGING_LEVEL = level
+    for name in list(_names):
+        logging.getLogger(name).setLevel(LOGGING_LEVELS[level])
+
+
+def _prepareReload(config: Config.Config):
+    """Check the LOGGING_LEVEL of a reloaded configuration, see Config.add_listener"""
+    level = config.get("LOGGING_LEVEL", "DEBUG").upper()
+    if level not in LOGGING_LEVELS:
+        raise ValueError(f"Unknown LOGGING_LEVEL: {level}, use one of {', '.join(LOGGING_LEVELS)}")
+    return lambda: setLevel(level)
+
+
+Config.add_listener(("LOGGING_LEVEL",), _prepareReload)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+A module for collecting the metrics of the IoT agent
+
+Counters, gauges and summaries are kept in memory
+and rendered in the Prometheus text format on GET /metrics.
+All functions are thread-safe.
+"""
+# Standard Library imports
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_gauge_functions = {}
+_summaries = {}
+
+
+def inc(name: str, value: float = 1):
+    """Increase a counter
+
+    Args:
+        name (str): the name of the counter
+        value (float): the increment. Default: 1
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float):
+    """Set the value of a gauge
+
+    Args:
+        name (str): the name of the gauge
+        value (float): the current value
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def register_gauge(name: str, function):
+    """Register a gauge whose value is computed when the metrics are rendered
+
+    Args:
+        name (str): the name of the gauge
+        function: a callable without arguments returning the current value
+    """
+    with _lock:
+        _gauge_functions[name] = function
+
+
+def observe(name: str, value: float):
+    """Add an observation to a summary
+
+    The count, the sum and the maximum of the observations are kept.
+
+    Args:
+        name (str): the name of the summary
+        value (float): the observed value, for example a duration in seconds
+    """
+    with _lock:
+        summary = _summaries.get(name)
+        if summary is None:
+            _summaries[name] = [1, value, value]
+        else:
+            summary[0] += 1
+            summary[1] += value
+            if value > summary[2]:
+                summary[2] = value
+
+
+def get(name: str):
+    """Return the current value of a counter or gauge, None if it does not exist"""
+    with _lock:
+        if name in _counters:
+            return _counters[name]
+        if name in _gauges:
+            return _gauges[name]
+        function = _gauge_functions.get(name)
+    return function() if function is not None else None
+
+
+def render() -> str:
+    """Render all metrics in the Prometheus text format
+
+    Returns:
+        the metrics as text
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        gauge_functions = dict(_gauge_functions)
+        summaries = {name: tuple(summary) for name, summary in _summaries.items()}
+    for name, function in gauge_functions.items():
+        try:
+            gauges[name] = function()
+        except Exception:
+            continue
+    lines = []
+    for name in sorted(counters):
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {counters[name]}")
+    for name in sorted(gauges):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {gauges[name]}")
+    for name in sorted(summaries):
+        count, sum_, max_ = summaries[name]
+        lines.append(f"# TYPE {name} summary")
+        lines.append(f"{name}_count {count}")
+        lines.append(f"{name}_sum {sum_}")
+        lines.append(f"{name}_max {max_}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Remove all metrics"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _gauge_functions.clear()
+        _summaries.clear()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""The Pipeline class
+
+The pipeline decouples the request handlers from the Orion broker.
+The handlers parse and transform the requests, then put them
+into a bounded queue. A fixed pool of sender threads takes them
+from the queue and sends them to Orion. The handler waits for
+the result and returns it to the IoT device.
+
+If Orion slows down, the queue fills up and the queue-full policy
+decides what happens to new requests:
+    block: wait for a free slot for at most put_timeout seconds
+    reject: fail immediately
+    drop_oldest: fail the oldest queued request to make room
+Either way, the number of queued requests and sender threads stays bounded.
+
+The high and normal priority requests have separate queues, see Priority.py.
+Every sender takes the queued high priority requests first, and
+the high priority senders take only those, so a deep queue of normal
+requests does not delay the high priority ones.
+
+A job carries the deadline of its request, see Deadlines.py. If the deadline
+passed while the job was queued, the sender fails it without sending it.
+"""
+# Standard Library imports
+from collections import deque
+import threading
+import time
+
+# custom imports
+import Deadlines
+import Metrics
+from Priority import HIGH, NORMAL
+import Tracing
+
+QUEUE_FULL_POLICIES = ("block", "reject", "drop_oldest")
+
+
+class QueueFullError(Exception):
+    """Raised if a request cannot be queued or was dropped from the queue"""
+
+
+class Job:
+    """A request waiting in the pipeline
+
+    The job carries the trace and the deadline of the submitting thread,
+    so the sender continues them.
+
+    Args:
+        req: the request to send
+        priority (str): "high" or "normal"
+    """
+
+    __slots__ = ("req", "priority", "enqueued_at", "trace", "deadline", "cancelled", "_done", "_result", "_error")
+
+    def __init__(self, req, priority: str = NORMAL):
+        self.req = req
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.trace = Tracing.current()
+        self.deadline = Deadlines.current()
+        self.cancelled = False
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def cancel(self):
+        """Tell the senders not to send the request, its handler stopped waiting"""
+        self.cancelled = True
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_error(self, error: Exception):
+        self._error = error
+        self._done.set()
+
+    def result(self, timeout: float = None):
+        """Wait for the request to be sent
+
+        Args:
+            timeout (float): the maximum number of seconds to wait. Default: no limit
+
+        Returns:
+            the result of the send function
+
+        Raises:
+            the exception raised by the send function,
+            QueueFullError if the request was dropped,
+            Deadlines.DeadlineExceededError if its deadline passed in the queue,
+            TimeoutError if the timeout expired
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError("The request was not sent in time")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class Pipeline:
+    """A bounded queue between the request handlers and a pool of senders
+
+    Args:
+        send: the function sending a request, its return value
+            is the result of the job
+        queue_size (int): the maximum number of queued requests
+        senders (int): the number of sender threads
+        full_policy (str): "block", "reject" or "drop_oldest"
+        put_timeout (float): the maximum number of seconds to wait
+            for a free slot with the "block" policy
+        high_senders (int): the number of sender threads of the high priority requests only
+        high_queue_size (int): the maximum number of queued high priority requests.
+            Default: queue_size
+
+    Raises:
+        ValueError: if the full_policy is unknown
+    """
+
+    def __init__(self, send, queue_size: int, senders: int, full_policy: str = "block", put_timeout: float = 5.0,
+                 high_senders: int = 0, high_queue_size: int = None):
+        if full_policy not in QUEUE_FULL_POLICIES:
+            raise ValueError(f"Unknown queue-full policy: {full_policy}, use one of {QUEUE_FULL_POLICIES}")
+        self.send = send
+        self.senders = senders
+        self.high_senders = high_senders
+        self.full_policy = full_policy
+        self.put_timeout = put_timeout
+        self._queues = {HIGH: deque(), NORMAL: deque()}
+        self._sizes = {HIGH: high_queue_size or queue_size, NORMAL: queue_size}
+        # guards the queues, notified when a job is queued or taken
+        self._changed = threading.Condition()
+        self._threads = []
+        Metrics.register_gauge("pipeline_queue_depth", self.depth)
+        Metrics.register_gauge("pipeline_high_queue_depth", lambda: self.depth(HIGH))
+        Metrics.set_gauge("pipeline_queue_size", queue_size)
+        Metrics.set_gauge("pipeline_senders", senders)
+        Metrics.set_gauge("pipeline_high_senders", high_senders)
+
+    def start(self):
+        """Start the sender threads"""
+        for i in range(self.senders):
+            thread = threading.Thread(target=self._run_sender, name=f"sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        for i in range(self.high_senders):
+            thread = threading.Thread(target=self._run_sender, args=(True,), name=f"high-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def depth(self, priority: str = NORMAL) -> int:
+        """Return the number of queued requests of a priority class"""
+        return len(self._queues[priority])
+
+    def size(self, priority: str = NORMAL) -> int:
+        """Return the maximum number of queued requests of a priority class"""
+        return self._sizes[priority]
+
+    def alive(self) -> bool:
+        """Check if every sender thread is running"""
+        return all(thread.is_alive() for thread in self._threads)
+
+    def submit(self, req, priority: str = NORMAL) -> Job:
+        """Queue a request for sending
+
+        Args:
+            req: the request to send
+            priority (str): "high" or "normal"
+
+        Returns:
+            the queued Job
+
+        Raises:
+            QueueFullError: if the queue is full and the policy is
+                "reject", or "block" and no slot freed up in time
+        """
+        job = Job(req, priority)
+        pending = self._queues[priority]
+        size = self._sizes[priority]
+        dropped = None
+        with self._changed:
+            if len(pending) >= size:
+                if self.full_policy == "block":
+                    deadline = time.monotonic() + self.put_timeout
+                    while len(pending) >= size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            Metrics.inc("pipeline_rejected_total")
+                            raise QueueFullError(f"The queue is full, no free slot in {self.put_timeout} s")
+                        self._changed.wait(remaining)
+                elif self.full_policy == "reject":
+                    Metrics.inc("pipeline_rejected_total")
+                    raise QueueFullError("The queue is full")
+                else:
+                    dropped = pending.popleft()
+            pending.append(job)
+            self._changed.notify_all()
+        if dropped is not None:
+            Metrics.inc("pipeline_dropped_total")
+            dropped.set_error(QueueFullError("The request was dropped from the full queue"))
+        Metrics.inc("pipeline_submitted_total")
+        if priority == HIGH:
+            Metrics.inc("pipeline_high_submitted_total")
+        return job
+
+    def _take(self, high_only: bool) -> Job:
+        """Wait for a queued job, the high priority ones first"""
+        with self._changed:
+            while True:
+                if self._queues[HIGH]:
+                    job = self._queues[HIGH].popleft()
+                    break
+                if not high_only and self._queues[NORMAL]:
+                    job = self._queues[NORMAL].popleft()
+                    break
+                self._changed.wait()
+            self._changed.notify_all()
+        return job
+
+    def _run_sender(self, high_only: bool = False):
+        """Send the queued requests one by one
+
+        Args:
+            high_only (bool): send the high priority requests only
+        """
+        while True:
+            job = self._take(high_only)
+            if job.cancelled:
+                Metrics.inc("pipeline_cancelled_total")
+                continue
+            wait = time.monotonic() - job.enqueued_at
+            Metrics.observe("pipeline_high_queue_wait_seconds" if job.priority == HIGH
+                            else "pipeline_queue_wait_seconds", wait)
+            if job.deadline is not None and job.deadline <= time.monotonic():
+                Metrics.inc("pipeline_expired_total")
+                job.set_error(Deadlines.DeadlineExceededError(
+                    f"The deadline of the request passed after {wait:.3f} s in the queue"))
+                continue
+            Tracing.activate(job.trace)
+            Deadlines.activate(job.deadline)
+            try:
+                job.set_result(self.send(job.req))
+            except Exception as error:
+                job.set_error(error)
+            finally:
+                Tracing.activate(None)
+                Deadlines.activate(None)
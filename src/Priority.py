@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the priority classes of the requests
+
+The requests are either "high" or "normal" priority. The high priority
+requests, such as alarms, are sent before the queued normal ones,
+and the pipeline has dedicated senders for them, see Pipeline.py,
+so they keep a low latency even if the queue of the counters is deep.
+
+A request is high priority if
+    - its "priority" field is "high", or
+    - it matches a rule in PRIORITY_HIGH, unless its "priority" field is "normal"
+
+The rules of PRIORITY_HIGH are comma-separated, each of them one of
+    attribute:<name>: the request updates this attribute, in its url
+        (/attrs/<name>) or in its JSON data, for example "attribute:Failed"
+    template:<name>: the request was rendered from this template, see Templates.py
+    url:<regular expression>: the regular expression matches the url,
+        it may not contain a comma
+
+Environment variables:
+PRIORITY_HIGH:
+    the rules of the high priority requests. Default: not set, only the "priority" field counts
+"""
+# Standard Library imports
+import json
+import re
+from urllib.parse import urlsplit
+
+# custom imports
+import Config
+from HTTPRequest import HTTPRequest
+from Logger import getLogger
+
+logger = getLogger(__name__)
+
+HIGH = "high"
+NORMAL = "normal"
+PRIORITIES = (HIGH, NORMAL)
+
+# the attribute of /v2/entities/<id>/attrs/<attribute>
+ATTRIBUTE_PATTERN = re.compile(r'/attrs/([^/?#]+)')
+
+
+class Rules:
+    """The rules of the high priority requests
+
+    Args:
+        text (str): the rules, see the module docstring
+
+    Raises:
+        ValueError: if a rule is invalid
+    """
+
+    def __init__(self, text: str):
+        self.attributes = set()
+        self.templates = set()
+        self.urls = []
+        for rule in text.split(","):
+            if not rule.strip():
+                continue
+            kind, _, value = rule.partition(":")
+            kind, value = kind.strip().lower(), value.strip()
+            if not value:
+                raise ValueError(f"Invalid priority rule: {rule}")
+            if kind == "attribute":
+                self.attributes.add(value)
+            elif kind == "template":
+                self.templates.add(value)
+            elif kind == "url":
+                try:
+                    self.urls.append(re.compile(value))
+                except re.error as error:
+                    raise ValueError(f"Invalid priority rule: {rule}: {error}") from None
+            else:
+                raise ValueError(f"Invalid priority rule: {rule}, use attribute:, template: or url:")
+
+    def __bool__(self) -> bool:
+        return bool(self.attributes or self.templates or self.urls)
+
+    def match(self, req: HTTPRequest, template: str = None) -> bool:
+        """Check if a request matches a rule
+
+        Args:
+            req (HTTPRequest): the decoded request
+            template (str): the name of its template, if any
+        """
+        if template is not None and template in self.templates:
+            return True
+        if any(pattern.search(req.url) for pattern in self.urls):
+            return True
+        if self.attributes:
+            match = ATTRIBUTE_PATTERN.search(urlsplit(req.url).path)
+            if match is not None and match.group(1) in self.attributes:
+                return True
+            # the JSON data is parsed only if it may contain the attribute
+            if req.data and any(f'"{attribute}"' in req.data for attribute in self.attributes):
+                return bool(self.attributes & _data_attributes(req.data))
+        return False
+
+
+def _data_attributes(data: str) -> set:
+    """Return the attribute names of the JSON data of an update
+
+    The data is either the attributes of an entity or a batch update
+    with a list of entities.
+    """
+    try:
+        data = json.loads(data)
+    except ValueError:
+        return set()
+    if not isinstance(data, dict):
+        return set()
+    attributes = set(data)
+    entities = data.get("entities")
+    if isinstance(entities, list):
+        for entity in entities:
+            if isinstance(entity, dict):
+                attributes.update(entity)
+    return attributes
+
+
+try:
+    PRIORITY_HIGH = Rules(Config.get("PRIORITY_HIGH") or "")
+except ValueError as error:
+    raise RuntimeError(f"Critical: invalid PRIORITY_HIGH: {error}") from error
+
+
+def classify(req: HTTPRequest, requested=None, template: str = None) -> str:
+    """Return the priority class of a request
+
+    Args:
+        req (HTTPRequest): the decoded request
+        requested: the "priority" field of the request, if any
+        template (str): the name of its template, if any
+
+    Returns:
+        "high" or "normal"
+
+    Raises:
+        ValueError: if the requested priority is unknown
+    """
+    if requested is not None:
+        requested = str(requested).lower().strip()
+        if requested not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {requested}, use one of {PRIORITIES}")
+        return requested
+    return HIGH if PRIORITY_HIGH and PRIORITY_HIGH.match(req, template) else NORMAL
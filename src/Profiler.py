@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+A sampling profiler for analysing the running IoT agent
+
+While a capture is running, a background thread takes the stack
+of every other thread at a fixed interval. The samples are returned
+either as collapsed stacks (one "frame;frame;frame count" line per
+distinct stack, the input format of flamegraph.pl and speedscope)
+or as a text table of the functions with the most samples.
+
+When no capture is running, the profiler has no overhead at all:
+there is no thread, no hook and no instrumentation.
+
+Only one capture can run at a time.
+"""
+# Standard Library imports
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+# the maximum length of a capture in seconds
+MAX_SECONDS = 300
+
+_capture_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Raised if a capture is already running"""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample(seconds: float, interval: float = 0.005) -> Counter:
+    """Sample the stacks of all threads
+
+    Args:
+        seconds (float): the length of the capture, at most MAX_SECONDS
+        interval (float): the time between two samples in seconds
+
+    Returns:
+        a Counter of the stacks, each stack is a tuple of frame names
+        from the outermost to the innermost, starting with the thread name
+
+    Raises:
+        ProfilerBusyError: if a capture is already running
+    """
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile capture is already running")
+    try:
+        seconds = min(max(seconds, 0.0), MAX_SECONDS)
+        stacks = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[tuple(reversed(stack))] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _capture_lock.release()
+
+
+def collapsed(stacks: Counter) -> str:
+    """Format the samples as collapsed stacks for flame graphs
+
+    Args:
+        stacks (Counter): the result of sample
+
+    Returns:
+        one "frame;frame;frame count" line per distinct stack
+    """
+    lines = [";".join(stack) + f" {count}" for stack, count in stacks.most_common()]
+    return "\n".join(lines) + "\n"
+
+
+def top(stacks: Counter, limit: int = 40) -> str:
+    """Format the samples as a table of the functions with the most samples
+
+    Args:
+        stacks (Counter): the result of sample
+        limit (int): the number of functions listed
+
+    Returns:
+        the table as text. "self" counts the samples where the function
+        was running, "total" where it was on the stack
+    """
+    total_samples = sum(stacks.values())
+    own = Counter()
+    cumulative = Counter()
+    for stack, count in stacks.items():
+        if len(stack) > 1:
+            own[stack[-1]] += count
+        for frame in set(stack[1:]):
+            cumulative[frame] += count
+    lines = [f"{total_samples} samples", f"{'self':>8} {'total':>8}  function"]
+    for frame, count in cumulative.most_common(limit):
+        lines.append(f"{own[frame]:>8} {count:>8}  {frame}")
+    return "\n".join(lines) + "\n"
+
+
+def capture_to_file(seconds: float, directory: str, logger=None):
+    """Capture a profile and write the collapsed stacks into a file
+
+    Used by the signal handler, so it never raises.
+
+    Args:
+        seconds (float): the length of the capture
+        directory (str): the directory of the output file
+        logger: the logger to report the result to
+    """
+    try:
+        stacks = sample(seconds)
+        path = os.path.join(directory, f"iotagent-http-profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(collapsed(stacks))
+        if logger is not None:
+            logger.warning(f"Profile written to {path}")
+    except Exception as error:
+        if logger is not None:
+            logger.error(f"Profile capture failed: {error}")
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""The SegmentLog class
+
+An append-only log of records on disk, consumed in order by one reader.
+
+The log is a directory of segment files named by a sequence number.
+Records are appended to the last segment, and a new segment is started
+when it reaches segment_bytes. Each record is stored as
+    <length: 4 bytes><crc32: 4 bytes><payload>
+so a record torn by a crash is detected and cut off when the log is opened.
+
+Durability: with fsync enabled, append returns only after the record
+is fsynced. The fsyncs are batched (group commit): while one thread
+fsyncs, the records appended by the other threads accumulate, and the
+next fsync makes all of them durable at once.
+
+The reader's position (the cursor) is persisted every CURSOR_SYNC_EVERY
+records and when the log is drained, so after a crash at most that many
+records are read again. Consumed segments are deleted. If the log grows
+beyond max_bytes, the oldest segments are dropped (compaction), so
+an outage cannot fill up the disk.
+"""
+# Standard Library imports
+import os
+import struct
+import threading
+import zlib
+
+# custom imports
+from Logger import getLogger
+
+logger = getLogger(__name__)
+
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+# the cursor is persisted after this many consumed records
+CURSOR_SYNC_EVERY = 100
+
+
+def read_records(directory: str):
+    """Read every record of a log without consuming them
+
+    Used to read logs that are written but never consumed, such as the traffic
+    captures of Capture.py. A torn record ends its segment.
+
+    Args:
+        directory (str): the directory of the segment files
+
+    Yields:
+        the payloads, oldest first
+
+    Raises:
+        OSError: if the directory cannot be read
+    """
+    segments = sorted(name for name in os.listdir(directory)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+    for name in segments:
+        try:
+            file = open(os.path.join(directory, name), "rb")
+        except FileNotFoundError:
+            # dropped by the writer meanwhile
+            continue
+        with file:
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, crc = RECORD_HEADER.unpack(header)
+                payload = file.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                yield payload
+
+
+class SegmentLog:
+    """A persistent, segmented, append-only log with a single reader
+
+    Args:
+        directory (str): the directory of the segment files, created if missing
+        segment_bytes (int): the size after which a new segment is started
+        fsync (bool): if True, append returns after the record is on disk
+        max_bytes (int): the maximum size of the unconsumed records,
+            the oldest segments are dropped beyond it. 0: no limit
+
+    Raises:
+        OSError: if the directory cannot be created or read
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024,
+                 fsync: bool = True, max_bytes: int = 0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+        self._retired = []
+        self._reader = None
+        self._reader_segment = None
+        self._unsaved_reads = 0
+        os.makedirs(directory, exist_ok=True)
+        self._cursor = self._load_cursor()
+        # the unconsumed records and bytes of each segment
+        self._records = {}
+        self._bytes = {}
+        self._recover()
+        self._active = max(self._records) if self._records else self._cursor[0]
+        if self._active not in self._records:
+            self._records[self._active] = 0
+            self._bytes[self._active] = 0
+        self._file = open(self._path(self._active), "ab", buffering=0)
+        self._active_size = self._file.tell()
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:020d}{SEGMENT_SUFFIX}")
+
+    def _segment_ids(self) -> list:
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _load_cursor(self) -> tuple:
+        """Read the persisted (segment, position) of the reader"""
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), encoding="ascii") as file:
+                segment, position = file.read().split()
+                return int(segment), int(position)
+        except (OSError, ValueError):
+            segments = self._segment_ids()
+            return (segments[0] if segments else 0), 0
+
+    def _save_cursor(self):
+        """Persist the cursor atomically, the lock must be held"""
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w", encoding="ascii") as file:
+            file.write(f"{self._cursor[0]} {self._cursor[1]}")
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        self._unsaved_reads = 0
+
+    def _scan(self, segment: int, start: int):
+        """Count the valid records of a segment from a position
+
+        Returns:
+            (records, end position of the last valid record)
+        """
+        records = 0
+        position = start
+        with open(self._path(segment), "rb") as file:
+            file.seek(start)
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, crc = RECORD_HEADER.unpack(header)
+                payload = file.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                records += 1
+                position += RECORD_HEADER.size + length
+        return records, position
+
+    def _recover(self):
+        """Find the unconsumed records, delete the consumed segments
+        and cut off a torn record at the end of the log"""
+        segments = self._segment_ids()
+        for segment in segments:
+            if segment < self._cursor[0]:
+                os.remove(self._path(segment))
+                continue
+            start = self._cursor[1] if segment == self._cursor[0] else 0
+            records, end = self._scan(segment, start)
+            size = os.path.getsize(self._path(segment))
+            if end < size:
+                logger.warning(f"Cutting off {size - end} invalid bytes at the end of segment {segment}")
+                with open(self._path(segment), "r+b") as file:
+                    file.truncate(end)
+            self._records[segment] = records
+            self._bytes[segment] = end - start
+        if self._cursor[0] not in self._records:
+            # the segment of the cursor is gone, for example it was dropped
+            self._cursor = (min(self._records), 0) if self._records else (self._cursor[0], 0)
+
+    def append(self, record: bytes):
+        """Append a record
+
+        Args:
+            record (bytes): the payload
+
+        Raises:
+            OSError: if the record cannot be written
+        """
+        data = RECORD_HEADER.pack(len(record), zlib.crc32(record)) + record
+        with self._lock:
+            if self._active_size >= self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._active_size += len(data)
+            self._records[self._active] += 1
+            self._bytes[self._active] += len(data)
+            self._written += 1
+            sequence = self._written
+            if self.max_bytes:
+                self._compact()
+        if self.fsync:
+            self._sync(sequence)
+
+    def _rotate(self):
+        """Start a new segment, the lock must be held"""
+        if self.fsync:
+            # the syncer fsyncs and closes it, see _sync
+            self._retired.append(self._file)
+        else:
+            self._file.close()
+        self._active += 1
+        self._records[self._active] = 0
+        self._bytes[self._active] = 0
+        self._file = open(self._path(self._active), "ab", buffering=0)
+        self._active_size = 0
+
+    def _sync(self, sequence: int):
+        """Make the records up to sequence durable, batching the fsyncs"""
+        with self._sync_lock:
+            if self._synced >= sequence:
+                # an fsync started after the record was written covered it
+                return
+            with self._lock:
+                target = self._written
+                retired, self._retired = self._retired, []
+                file = self._file
+            for old in retired:
+                os.fsync(old.fileno())
+                old.close()
+            os.fsync(file.fileno())
+            self._synced = target
+
+    def _compact(self):
+        """Drop the oldest segments beyond max_bytes, the lock must be held"""
+        while sum(self._bytes.values()) > self.max_bytes and len(self._records) > 1:
+            oldest = min(self._records)
+            dropped = self._records.pop(oldest)
+            del self._bytes[oldest]
+            self.dropped += dropped
+            logger.warning(f"The log exceeded {self.max_bytes} bytes, {dropped} records dropped")
+            os.remove(self._path(oldest))
+            if self._cursor[0] == oldest:
+                self._cursor = (min(self._records), 0)
+                self._save_cursor()
+
+    def __len__(self):
+        """Return the number of unconsumed records"""
+        with self._lock:
+            return sum(self._records.values())
+
+    def size(self) -> int:
+        """Return the size of the unconsumed records in bytes"""
+        with self._lock:
+            return sum(self._bytes.values())
+
+    def peek(self):
+        """Read the oldest unconsumed record, only one thread may read
+
+        Returns:
+            (payload, token) or None if there is no complete record.
+            Pass the token to consume to consume the record.
+        """
+        with self._lock:
+            cursor = self._cursor
+            if self._records.get(cursor[0], 0) == 0:
+                later = [segment for segment in self._records if segment > cursor[0]]
+                if not later:
+                    return None
+                # the segment is consumed, continue with the next one
+                self._records.pop(cursor[0], None)
+                self._bytes.pop(cursor[0], None)
+                os.remove(self._path(cursor[0]))
+                cursor = self._cursor = (min(later), 0)
+                self._save_cursor()
+        segment, position = cursor
+        if self._reader_segment != segment:
+            if self._reader is not None:
+                self._reader.close()
+            self._reader = open(self._path(segment), "rb")
+            self._reader_segment = segment
+        self._reader.seek(position)
+        header = self._reader.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return None
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = self._reader.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            # the record is still being written
+            return None
+        return payload, (cursor, (segment, position + RECORD_HEADER.size + length))
+
+    def consume(self, token):
+        """Mark a record returned by peek as consumed
+
+        Args:
+            token: the token returned by peek
+        """
+        cursor, next_cursor = token
+        with self._lock:
+            if self._cursor != cursor:
+                # the segment was dropped by compaction meanwhile
+                return
+            self._cursor = next_cursor
+            self._records[cursor[0]] -= 1
+            self._bytes[cursor[0]] -= next_cursor[1] - cursor[1]
+            self._unsaved_reads += 1
+            if self._unsaved_reads >= CURSOR_SYNC_EVERY or sum(self._records.values()) == 0:
+                self._save_cursor()
+
+    def close(self):
+        """Make every record durable, persist the cursor and close the files"""
+        if self.fsync:
+            self._sync(self._written)
+        with self._lock:
+            self._save_cursor()
+            self._file.close()
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+                self._reader_segment = None
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the pooled HTTP connections of the IoT agent
+
+Every target (scheme, host and port) gets its own requests.Session
+with a connection pool, so the requests to an Orion instance reuse
+kept-alive connections instead of opening a new TCP connection each time.
+The forwarded requests and the plugin's lookups share the pools.
+
+Environment variables:
+HTTP_POOL_SIZE:
+    the maximum number of kept-alive connections per target.
+    Default: 10
+HTTP_MAX_TARGETS:
+    the maximum number of targets with a pool, the least recently
+    used pool is closed when a new target is added. Default: 64
+
+Both are applied when the configuration is reloaded, see Config.py.
+
+Every request times out at the deadline of the request of the IoT device
+it serves, see Deadlines.py. If ADAPTIVE_CONCURRENCY is true, the requests
+to each target wait for a slot of its concurrency limiter, see Concurrency.py.
+"""
+# Standard Library imports
+from collections import OrderedDict
+import threading
+import time
+from urllib.parse import urlsplit
+
+# custom imports
+import Concurrency
+import Config
+import Deadlines
+import Metrics
+
+# the status codes of an overloaded target
+OVERLOADED_STATUS_CODES = (429, 503)
+
+
+def _pool_settings(config: Config.Config) -> tuple:
+    """Return the HTTP_POOL_SIZE and HTTP_MAX_TARGETS of a configuration"""
+    return config.get_int("HTTP_POOL_SIZE", 10, minimum=1), config.get_int("HTTP_MAX_TARGETS", 64, minimum=1)
+
+
+HTTP_POOL_SIZE, HTTP_MAX_TARGETS = _pool_settings(Config.current())
+
+_sessions = OrderedDict()
+_lock = threading.Lock()
+
+
+_adapter_class = None
+
+
+def _adapter(limiter=None, **kwargs):
+    """Create the HTTPAdapter of a target
+
+    The adapter times out every request at the deadline of the current
+    thread, or after REQUEST_TIMEOUT seconds if it has none, see Deadlines.py.
+    If there is a concurrency limiter, the requests wait for its slots.
+    The adapter counts its requests in flight, so that a retired session
+    is closed when they finished, see _retire.
+
+    Args:
+        limiter (Concurrency.AdaptiveLimiter): the limiter of the target, if any
+        kwargs: the arguments of the HTTPAdapter
+    """
+    global _adapter_class
+    if _adapter_class is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        class AgentAdapter(HTTPAdapter):
+            def __init__(self, limiter=None, **kwargs):
+                super().__init__(**kwargs)
+                self.limiter = limiter
+                self.in_flight = 0
+                self.retired = False
+                self._state_lock = threading.Lock()
+
+            def retire(self):
+                """Close the connections once the requests in flight finished"""
+                with self._state_lock:
+                    self.retired = True
+                    idle = self.in_flight == 0
+                if idle:
+                    self.close()
+
+            def send(self, request, timeout=None, **kwargs):
+                with self._state_lock:
+                    self.in_flight += 1
+                try:
+                    return self._send(request, timeout, **kwargs)
+                finally:
+                    with self._state_lock:
+                        self.in_flight -= 1
+                        idle = self.retired and self.in_flight == 0
+                    if idle:
+                        self.close()
+
+            def _send(self, request, timeout=None, **kwargs):
+                try:
+                    timeout = Deadlines.timeout_for(timeout)
+                except Deadlines.DeadlineExceededError:
+                    Metrics.inc("deadline_exceeded_total")
+                    raise
+                if self.limiter is None:
+                    return super().send(request, timeout=timeout, **kwargs)
+                wait = Concurrency.CONCURRENCY_TIMEOUT
+                if isinstance(timeout, (int, float)):
+                    wait = min(wait, timeout)
+                if not self.limiter.acquire(wait):
+                    Metrics.inc("concurrency_limit_timeouts_total")
+                    raise Concurrency.ConcurrencyLimitError(
+                        f"No free slot for {request.url} in {wait} s, the concurrency limit is {int(self.limiter.limit)}")
+                try:
+                    # the wait for the slot counts against the deadline
+                    timeout = Deadlines.timeout_for(timeout)
+                except Deadlines.DeadlineExceededError:
+                    self.limiter.release(None)
+                    Metrics.inc("deadline_exceeded_total")
+                    raise
+                started = time.monotonic()
+                overloaded = True
+                try:
+                    response = super().send(request, timeout=timeout, **kwargs)
+                    overloaded = response.status_code in OVERLOADED_STATUS_CODES
+                    return response
+                finally:
+                    self.limiter.release(time.monotonic() - started, overloaded)
+
+        _adapter_class = AgentAdapter
+    return _adapter_class(limiter, **kwargs)
+
+
+def _new_session(netloc: str = None):
+    """Create a session with a pool of HTTP_POOL_SIZE connections
+
+    Args:
+        netloc (str): the "host:port" of the target, for its concurrency limiter
+    """
+    # requests is imported by the first request, not at startup
+    import requests
+    session = requests.Session()
+    limiter = None
+    if Concurrency.ADAPTIVE_CONCURRENCY and netloc is not None:
+        limiter = Concurrency.limiter_for(netloc)
+    adapter = _adapter(limiter, pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _retire(session):
+    """Close an evicted session once the requests in flight on it finished
+
+    Another thread may have taken the session just before it was evicted.
+    """
+    for adapter in set(session.adapters.values()):
+        retire = getattr(adapter, "retire", None)
+        if retire is not None:
+            retire()
+        else:
+            adapter.close()
+
+
+def get_session(url: str):
+    """Get the pooled session of the target of a URL
+
+    Args:
+        url (str): the URL of the request
+
+    Returns:
+        the requests.Session of the scheme, host and port of the URL
+    """
+    parts = urlsplit(url)
+    key = (parts.scheme.lower(), parts.netloc.lower())
+    with _lock:
+        session = _sessions.get(key)
+        if session is not None:
+            _sessions.move_to_end(key)
+            return session
+        session = _sessions[key] = _new_session(key[1])
+        evicted = []
+        while len(_sessions) > HTTP_MAX_TARGETS:
+            evicted.append(_sessions.popitem(last=False)[1])
+        Metrics.set_gauge("http_pool_targets", len(_sessions))
+    for old in evicted:
+        _retire(old)
+    return session
+
+
+def close_all():
+    """Close every pooled connection"""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+        Metrics.set_gauge("http_pool_targets", 0)
+    for session in sessions:
+        session.close()
+
+
+def configure(pool_size: int, max_targets: int):
+    """Change the size of the pools and the number of targets
+
+    If the pool size changed, the pools are replaced: the new requests
+    use new pools, the requests in flight finish on their old connections,
+    which are closed afterwards.
+
+    Args:
+        pool_size (int): the maximum number of kept-alive connections per target
+        max_targets (int): the maximum number of targets with a pool
+    """
+    global HTTP_POOL_SIZE, HTTP_MAX_TARGETS
+    with _lock:
+        if pool_size != HTTP_POOL_SIZE:
+            evicted = list(_sessions.values())
+            _sessions.clear()
+        else:
+            evicted = []
+            while len(_sessions) > max_targets:
+                evicted.append(_sessions.popitem(last=False)[1])
+        HTTP_POOL_SIZE, HTTP_MAX_TARGETS = pool_size, max_targets
+        Metrics.set_gauge("http_pool_targets", len(_sessions))
+    for old in evicted:
+        _retire(old)
+
+
+def _prepare_reload(config: Config.Config):
+    """Apply the pool settings of a reloaded configuration, see Config.add_listener"""
+    pool_size, max_targets = _pool_settings(config)
+    return lambda: configure(pool_size, max_targets)
+
+
+Config.add_listener(("HTTP_POOL_SIZE", "HTTP_MAX_TARGETS"), _prepare_reload)
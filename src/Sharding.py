@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+A module for spreading the entities over several Orion instances
+
+If ORION_SHARDS lists several Orion instances (shards), each entity
+lives in one of them. The shard of an entity is, in order of precedence:
+    1. the shard it was pinned to, see pin
+    2. the shard of its type in ORION_SHARD_TYPES, the type is taken
+       from the urn:ngsi_ld:<Type>:<id> pattern of the entity id
+    3. the shard given by a consistent-hash ring over the entity id
+
+The consistent-hash ring places every shard at many points of a circle,
+so adding or removing a shard only moves the entities between
+the neighbouring points, about 1/N of all entities.
+
+The forwarded requests and the plugin's lookups are routed to the shard
+of their entity and reuse the pooled connections of that shard,
+see Sessions.py. When entities move to another shard, the registered
+listeners are notified, so the caches can drop exactly the moved entities.
+
+Pinning an entity only changes where the agent sends its requests.
+The entity itself must be migrated separately: create it in the new
+shard before pinning it there, and delete it from the old shard after.
+The pins are kept in ORION_SHARD_PINS_FILE, if it is set, so that they
+survive a restart.
+
+Environment variables:
+ORION_SHARDS:
+    the Orion instances, for example "orion-a:1026,orion-b:1026".
+    Default: not set, there is no sharding
+ORION_SHARD_TYPES:
+    the shard of some entity types, for example
+    "Workstation=orion-a:1026,Job=orion-b:1026". Default: not set
+ORION_SHARD_PINS_FILE:
+    the JSON file of the pinned entities, read at startup and written
+    at every pin. Default: not set, the pins are lost at a restart
+
+ORION_SHARDS and ORION_SHARD_TYPES are applied when the configuration is reloaded, see Config.py.
+Only the entities whose shard changed are reported as moved.
+"""
+# Standard Library imports
+from bisect import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+
+# custom imports
+import Config
+from Logger import getLogger
+import Metrics
+
+logger = getLogger(__name__)
+
+# the number of points of each shard on the ring
+VIRTUAL_NODES = 64
+
+# the type of an NGSI-LD style entity id, urn:ngsi_ld:<Type>:<id>
+ENTITY_TYPE_PATTERN = re.compile(r'^urn:ngsi[-_]ld:([^:]+):')
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def parse_address(address: str) -> str:
+    """Normalize a shard address
+
+    Args:
+        address (str): "host" or "host:port", the port defaults to 1026
+
+    Returns:
+        "host:port"
+
+    Raises:
+        ValueError: if the address is invalid
+    """
+    host, _, port = address.strip().partition(":")
+    if not host:
+        raise ValueError(f"Invalid shard address: {address}")
+    return f"{host.lower()}:{int(port) if port else 1026}"
+
+
+def entity_type(entity_id: str):
+    """Get the type of an entity from its id
+
+    Args:
+        entity_id (str): an id like urn:ngsi_ld:Workstation:1
+
+    Returns:
+        the type, for example "Workstation", or None if the id does not follow the pattern
+    """
+    match = ENTITY_TYPE_PATTERN.match(entity_id)
+    return match.group(1) if match else None
+
+
+class HashRing:
+    """A consistent-hash ring of shards
+
+    Args:
+        shards (list): the "host:port" addresses of the shards
+        virtual_nodes (int): the number of points of each shard on the ring
+    """
+
+    def __init__(self, shards: list, virtual_nodes: int = VIRTUAL_NODES):
+        points = sorted((_hash(f"{shard}#{i}"), shard) for shard in shards for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key: str) -> str:
+        """Return the shard of a key, the first point clockwise from its hash"""
+        index = bisect(self._hashes, _hash(key))
+        return self._shards[index % len(self._shards)]
+
+
+class Router:
+    """The shard of every entity
+
+    Args:
+        shards (list): the "host:port" addresses of the shards
+        types (dict): the "host:port" shard of some entity types
+        pins (dict): the "host:port" shard of some entity ids
+
+    Raises:
+        ValueError: if there are no shards
+    """
+
+    def __init__(self, shards: list, types: dict = None, pins: dict = None):
+        if not shards:
+            raise ValueError("At least one shard is needed")
+        self.shards = [parse_address(shard) for shard in shards]
+        self.types = {type_: parse_address(shard) for type_, shard in (types or {}).items()}
+        self.pins = dict(pins or {})
+        self._ring = HashRing(self.shards)
+
+    def shard_for(self, entity_id: str) -> str:
+        """Return the "host:port" shard of an entity"""
+        shard = self.pins.get(entity_id)
+        if shard is not None:
+            return shard
+        if self.types:
+            shard = self.types.get(entity_type(entity_id))
+            if shard is not None:
+                return shard
+        return self._ring.shard_for(entity_id)
+
+    def to_dict(self) -> dict:
+        return {"shards": self.shards, "types": self.types, "pins": self.pins}
+
+
+def _parse_map(value: str) -> dict:
+    """Parse "key=host:port,key=host:port" into a dict
+
+    Raises:
+        ValueError: if an item is invalid
+    """
+    result = {}
+    for item in value.split(","):
+        key, separator, address = item.partition("=")
+        if not separator or not key.strip():
+            raise ValueError(f"Invalid item: {item}, use key=host:port")
+        result[key.strip()] = parse_address(address)
+    return result
+
+
+def _shard_settings(config: Config.Config) -> tuple:
+    """Parse the ORION_SHARDS and ORION_SHARD_TYPES of a configuration
+
+    Returns:
+        (the list of shards or None, the dict of the shards of the types or None)
+
+    Raises:
+        ValueError: if an address is invalid
+    """
+    shards = config.get("ORION_SHARDS")
+    types = config.get("ORION_SHARD_TYPES")
+    if not shards:
+        return None, None
+    shards = [parse_address(address) for address in shards.split(",")]
+    return shards, _parse_map(types) if types else None
+
+
+def load_pins(path: str) -> dict:
+    """Read the pinned entities
+
+    Args:
+        path (str): the JSON file of the pins, {entity id: "host:port"}
+
+    Returns:
+        the "host:port" shard of the pinned entities, empty if the file does not exist
+
+    Raises:
+        OSError: if the file cannot be read
+        ValueError: if the file is invalid
+    """
+    try:
+        with open(path, encoding="utf-8") as file:
+            pins = json.load(file)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(pins, dict):
+        raise ValueError(f"{path} must contain a JSON object")
+    return {str(entity_id): parse_address(str(shard)) for entity_id, shard in pins.items()}
+
+
+def _save_pins(path: str, pins: dict):
+    """Write the pinned entities atomically"""
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(pins, file, indent=1, sort_keys=True)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+try:
+    ORION_SHARDS, ORION_SHARD_TYPES = _shard_settings(Config.current())
+except ValueError as error:
+    raise RuntimeError(f"Critical: invalid ORION_SHARDS or ORION_SHARD_TYPES: {error}") from error
+ORION_SHARD_PINS_FILE = Config.get("ORION_SHARD_PINS_FILE") or None
+try:
+    _pins = load_pins(ORION_SHARD_PINS_FILE) if ORION_SHARD_PINS_FILE else None
+except (OSError, ValueError) as error:
+    raise RuntimeError(f"Critical: cannot read ORION_SHARD_PINS_FILE: {error}") from error
+# the current Router, replaced as a whole when the shards change
+router = None
+if ORION_SHARDS:
+    router = Router(ORION_SHARDS, ORION_SHARD_TYPES, _pins)
+    logger.info(f"Orion shards: {router.shards}, pinned entities: {len(router.pins)}")
+
+_lock = threading.Lock()
+_listeners = []
+
+
+def enabled() -> bool:
+    """Check if the entities are sharded"""
+    return router is not None
+
+
+def shard_for(entity_id: str):
+    """Return the "host:port" shard of an entity, None if there is no sharding"""
+    current = router
+    return current.shard_for(entity_id) if current is not None else None
+
+
+def is_shard(netloc: str) -> bool:
+    """Check if a "host:port" is one of the shards"""
+    current = router
+    if current is None:
+        return False
+    try:
+        address = parse_address(netloc)
+    except ValueError:
+        return False
+    return address in current.shards or address in current.types.values() or address in current.pins.values()
+
+
+def add_listener(callback):
+    """Register a function called when entities move to another shard
+
+    Args:
+        callback: called with a predicate, a function that takes
+            an entity id and returns True if the entity moved
+    """
+    with _lock:
+        _listeners.append(callback)
+
+
+def _notify(moved):
+    Metrics.inc("orion_shard_moves_total")
+    for callback in list(_listeners):
+        try:
+            callback(moved)
+        except Exception as error:
+            logger.error(f"Shard move listener failed: {error}")
+
+
+def pin(entity_id: str, shard: str = None):
+    """Move an entity to a shard, or back to its default shard
+
+    Only the caches of this entity are invalidated. The entity must be
+    migrated to the new shard separately. The pins are saved
+    to ORION_SHARD_PINS_FILE, if it is set, before they apply.
+
+    Args:
+        entity_id (str): the entity id
+        shard (str): the "host:port" of the shard, None to remove the pin
+
+    Raises:
+        RuntimeError: if there is no sharding
+        ValueError: if the shard address is invalid
+        OSError: if the pins cannot be saved, then the entity does not move
+    """
+    global router
+    with _lock:
+        if router is None:
+            raise RuntimeError("The entities are not sharded, set ORION_SHARDS")
+        pins = dict(router.pins)
+        if shard is None:
+            pins.pop(entity_id, None)
+        else:
+            pins[entity_id] = parse_address(shard)
+        if ORION_SHARD_PINS_FILE:
+            _save_pins(ORION_SHARD_PINS_FILE, pins)
+        old = router
+        router = Router(old.shards, old.types, pins)
+        new = router
+    if old.shard_for(entity_id) != new.shard_for(entity_id):
+        logger.info(f"{entity_id} moved from {old.shard_for(entity_id)} to {new.shard_for(entity_id)}")
+        _notify(lambda moved_id: moved_id == entity_id)
+
+
+def configure(shards: list = None, types: dict = None):
+    """Replace the shards, keeping the pins
+
+    The entities whose shard changed are reported to the listeners.
+
+    Args:
+        shards (list): the "host:port" addresses of the shards, None or empty disables sharding
+        types (dict): the "host:port" shard of some entity types
+
+    Raises:
+        ValueError: if an address is invalid
+    """
+    global router
+    with _lock:
+        old = router
+        router = Router(shards, types, old.pins if old is not None else None) if shards else None
+        new = router
+    if old is None and new is None:
+        return
+
+    def moved(entity_id):
+        return (old.shard_for(entity_id) if old is not None else None) != \
+            (new.shard_for(entity_id) if new is not None else None)
+
+    _notify(moved)
+
+
+def _prepare_reload(config: Config.Config):
+    """Apply the shards of a reloaded configuration, see Config.add_listener"""
+    shards, types = _shard_settings(config)
+    if shards:
+        # check the addresses before the commit
+        Router(shards, types)
+    return lambda: configure(shards, types)
+
+
+Config.add_listener(("ORION_SHARDS", "ORION_SHARD_TYPES"), _prepare_reload)
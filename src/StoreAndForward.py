@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""The StoreAndForward class
+
+If Orion is unreachable, the write requests (POST, PUT, DELETE) are
+appended to a SegmentLog on disk instead of being lost, and the IoT
+device gets 202 Accepted. A background thread replays the buffered
+requests in order, at most rate requests per second, once Orion is
+reachable again. While the buffer is not empty, new write requests are
+buffered too, so the writes reach Orion in the order they arrived.
+
+A replayed request that fails to connect is retried after
+retry_interval seconds, as is one answered with a 5xx status code.
+A request Orion rejects with a 4xx status code is dropped and logged.
+"""
+# Standard Library imports
+import json
+import threading
+import time
+
+# custom imports
+import Concurrency
+from HTTPRequest import HTTPRequest
+from Logger import getLogger
+import Metrics
+from SegmentLog import SegmentLog
+
+logger = getLogger(__name__)
+
+# the length of the window the replay rate is measured over, in seconds
+RATE_WINDOW = 10.0
+
+
+def encode(req: HTTPRequest) -> bytes:
+    """Serialize a request for the buffer"""
+    return json.dumps({"url": req.url, "method": req.method, "headers": req.headers,
+                       "data": req.data, "idempotency_key": req.idempotency_key},
+                      separators=(",", ":")).encode("utf-8")
+
+
+def decode(record: bytes) -> HTTPRequest:
+    """Deserialize a request from the buffer
+
+    Raises:
+        ValueError: if the record is not a serialized request
+    """
+    fields = json.loads(record)
+    return HTTPRequest(url=fields["url"], method=fields["method"], headers=fields["headers"],
+                       data=fields.get("data", ""), idempotency_key=fields.get("idempotency_key", ""))
+
+
+class StoreAndForward:
+    """A persistent buffer of the requests Orion could not receive
+
+    Args:
+        log (SegmentLog): the storage of the buffered requests
+        send: the function sending a request to Orion, returning the response
+        rate (float): the maximum number of replayed requests per second
+        retry_interval (float): the seconds to wait after a failed replay
+    """
+
+    def __init__(self, log: SegmentLog, send, rate: float = 50.0, retry_interval: float = 5.0):
+        self.log = log
+        self.send = send
+        self.rate = rate
+        self.retry_interval = retry_interval
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        Metrics.register_gauge("buffer_backlog_records", lambda: len(self.log))
+        Metrics.register_gauge("buffer_backlog_bytes", self.log.size)
+        Metrics.register_gauge("buffer_dropped_total", lambda: self.log.dropped)
+        Metrics.set_gauge("buffer_replay_rate", 0)
+
+    def start(self):
+        """Start the replay thread"""
+        self._thread = threading.Thread(target=self._run, name="buffer-replay", daemon=True)
+        self._thread.start()
+
+    def backlog(self) -> int:
+        """Return the number of buffered requests"""
+        return len(self.log)
+
+    def store(self, req: HTTPRequest):
+        """Buffer a request
+
+        Args:
+            req (HTTPRequest): the request to forward later
+
+        Raises:
+            OSError: if the request cannot be written to the disk
+        """
+        self.log.append(encode(req))
+        Metrics.inc("buffer_appended_total")
+        self._wakeup.set()
+
+    def _count_replayed(self):
+        """Update the replay metrics"""
+        Metrics.inc("buffer_replayed_total")
+        self._window_count += 1
+        now = time.monotonic()
+        if now - self._window_start >= RATE_WINDOW:
+            Metrics.set_gauge("buffer_replay_rate", round(self._window_count / (now - self._window_start), 3))
+            self._window_start = now
+            self._window_count = 0
+
+    def replay_one(self) -> bool:
+        """Replay the oldest buffered request
+
+        Returns:
+            True if the request was consumed (sent or dropped),
+            False if Orion is unavailable,
+            None if there is no buffered request
+        """
+        item = self.log.peek()
+        if item is None:
+            return None
+        record, token = item
+        try:
+            req = decode(record)
+        except (ValueError, KeyError, TypeError) as error:
+            logger.error(f"Dropping an unreadable buffered request: {error}")
+            self.log.consume(token)
+            return True
+        import requests
+        try:
+            res = self.send(req)
+        except (requests.exceptions.ConnectionError, Concurrency.ConcurrencyLimitError) as error:
+            logger.debug(f"Replay failed, Orion is still unavailable: {error}")
+            Metrics.inc("buffer_replay_failures_total")
+            return False
+        except Exception as error:
+            logger.error(f"Dropping a buffered request that cannot be sent: {req}, {error}")
+            self.log.consume(token)
+            return True
+        if res.status_code >= 500:
+            logger.debug(f"Replay failed with status code {res.status_code}")
+            Metrics.inc("buffer_replay_failures_total")
+            return False
+        if res.status_code >= 400:
+            logger.error(f"Orion rejected a buffered request with status code {res.status_code}: {req}")
+        self.log.consume(token)
+        self._count_replayed()
+        return True
+
+    def _run(self):
+        """Replay the buffered requests forever"""
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        while True:
+            started = time.monotonic()
+            try:
+                replayed = self.replay_one()
+            except Exception as error:
+                logger.error(f"Replaying the buffer failed: {error}")
+                replayed = False
+            if replayed:
+                delay = interval - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                continue
+            if replayed is None:
+                if len(self.log) == 0:
+                    Metrics.set_gauge("buffer_replay_rate", 0)
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+            else:
+                time.sleep(self.retry_interval)
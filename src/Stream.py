@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the stream listener of the IoT agent
+
+An HTTP request and response per update is overkill for high-frequency
+signals such as cycle counts and states. The stream listener accepts the
+same request objects as POST / (JSON, or an encoding of Codecs.py)
+over UDP or persistent TCP connections, without HTTP. The requests are
+framed in one of two ways:
+    newline: one request per line
+    length: each request is preceded by its length in bytes,
+        a 4-byte big-endian unsigned integer
+A UDP datagram contains one or more frames.
+
+The requests are processed like the HTTP ones: decoded, transformed
+by the plugin and forwarded to Orion. If acks are enabled, every request
+is answered with a frame "<status code>[ <idempotency key>]", where the
+status code is the one the HTTP request would have got. On a TCP
+connection, the acks are sent in the order of the requests.
+
+Without acks, the requests are put into a queue of STREAM_QUEUE_SIZE
+and processed by STREAM_WORKERS threads. If the queue is full,
+the request is dropped and counted in stream_dropped_total.
+UDP requests always go through the queue.
+
+Environment variables:
+STREAM_UDP_PORT:
+    the UDP port of the listener. Default: not set, no UDP listener
+STREAM_TCP_PORT:
+    the TCP port of the listener. Default: not set, no TCP listener
+STREAM_FRAMING:
+    "newline" or "length". Default: newline
+STREAM_CONTENT_TYPE:
+    the encoding of the requests, see Codecs.py. Default: application/json.
+    A binary encoding needs STREAM_FRAMING=length, its requests may contain newlines
+STREAM_ACKS:
+    "true" to answer every request. Default: false
+STREAM_WORKERS:
+    the threads processing the queued requests. Default: 1, which keeps their order
+STREAM_QUEUE_SIZE:
+    the maximum number of queued requests. Default: 1000
+STREAM_MAX_FRAME_BYTES:
+    the maximum size of a request. Default: 65536
+"""
+# Standard Library imports
+import queue
+import socket
+import socketserver
+import struct
+import threading
+
+# custom imports
+import Codecs
+import Config
+from Logger import getLogger
+import Metrics
+
+logger = getLogger(__name__)
+
+FRAMINGS = ("newline", "length")
+_LENGTH = struct.Struct(">I")
+
+STREAM_UDP_PORT = Config.current().get_int("STREAM_UDP_PORT", None, minimum=0)
+STREAM_TCP_PORT = Config.current().get_int("STREAM_TCP_PORT", None, minimum=0)
+STREAM_FRAMING = (Config.get("STREAM_FRAMING") or "newline").lower()
+if STREAM_FRAMING not in FRAMINGS:
+    logger.warning(f"Invalid STREAM_FRAMING: {STREAM_FRAMING}, using newline")
+    STREAM_FRAMING = "newline"
+STREAM_CONTENT_TYPE = Config.get("STREAM_CONTENT_TYPE") or "application/json"
+
+
+def check_framing(framing: str, content_type: str):
+    """Check that the framing can delimit the requests of an encoding
+
+    Raises:
+        ValueError: if the encoding is binary and the framing is not length,
+            a newline byte may be part of a binary request
+    """
+    if Codecs.is_binary(content_type) and framing != "length":
+        raise ValueError(f"the binary {content_type} encoding needs STREAM_FRAMING=length, not {framing}")
+
+
+STREAM_ACKS = Config.current().get_bool("STREAM_ACKS", False)
+STREAM_WORKERS = Config.current().get_int("STREAM_WORKERS", 1, minimum=1)
+STREAM_QUEUE_SIZE = Config.current().get_int("STREAM_QUEUE_SIZE", 1000, minimum=1)
+STREAM_MAX_FRAME_BYTES = Config.current().get_int("STREAM_MAX_FRAME_BYTES", 65536, minimum=1)
+if STREAM_UDP_PORT is not None or STREAM_TCP_PORT is not None:
+    try:
+        check_framing(STREAM_FRAMING, STREAM_CONTENT_TYPE)
+    except ValueError as error:
+        raise RuntimeError(f"Critical: invalid STREAM_CONTENT_TYPE: {error}") from error
+
+
+def encode_frame(payload: bytes, framing: str) -> bytes:
+    """Frame a message
+
+    Args:
+        payload (bytes): the message, without a newline if framing is newline
+        framing (str): "newline" or "length"
+
+    Returns:
+        the framed message
+    """
+    if framing == "length":
+        return _LENGTH.pack(len(payload)) + payload
+    return payload + b"\n"
+
+
+class FrameDecoder:
+    """Splits a byte stream into frames
+
+    Args:
+        framing (str): "newline" or "length"
+        max_frame (int): the maximum size of a frame in bytes
+    """
+
+    def __init__(self, framing: str, max_frame: int = STREAM_MAX_FRAME_BYTES):
+        self.framing = framing
+        self.max_frame = max_frame
+        self._buffer = b""
+
+    def feed(self, data: bytes, final: bool = False) -> list:
+        """Add the received bytes and return the completed frames
+
+        Args:
+            data (bytes): the received bytes
+            final (bool): the data ends with the last frame, like a datagram.
+                A last line without a newline is a frame too
+
+        Raises:
+            ValueError: if a frame is longer than max_frame,
+                or the data is final but the last frame is incomplete
+        """
+        buffer = self._buffer + data if self._buffer else data
+        frames = []
+        start = 0
+        if self.framing == "length":
+            while len(buffer) - start >= _LENGTH.size:
+                (length,) = _LENGTH.unpack_from(buffer, start)
+                if length > self.max_frame:
+                    raise ValueError(f"The frame of {length} bytes is longer than {self.max_frame} bytes")
+                end = start + _LENGTH.size + length
+                if end > len(buffer):
+                    break
+                frames.append(buffer[start + _LENGTH.size:end])
+                start = end
+        else:
+            while True:
+                end = buffer.find(b"\n", start)
+                if end < 0:
+                    break
+                frame = buffer[start:end].strip()
+                if frame:
+                    frames.append(frame)
+                start = end + 1
+        self._buffer = buffer[start:]
+        if len(self._buffer) > self.max_frame + _LENGTH.size:
+            raise ValueError(f"The frame is longer than {self.max_frame} bytes")
+        if final and self._buffer.strip():
+            if self.framing == "length":
+                raise ValueError("The last frame is incomplete")
+            frames.append(self._buffer.strip())
+            self._buffer = b""
+        return frames
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class StreamListener:
+    """The UDP and TCP listeners
+
+    Args:
+        process: a function taking the request (bytes) and its content type,
+            returning the status code and the idempotency key of the request
+        udp_port (int): the UDP port, None for no UDP listener
+        tcp_port (int): the TCP port, None for no TCP listener
+        framing (str): "newline" or "length"
+        content_type (str): the encoding of the requests
+        acks (bool): answer every request
+        workers (int): the threads processing the queued requests
+        queue_size (int): the maximum number of queued requests
+        max_frame (int): the maximum size of a request in bytes
+        host (str): the address to listen on. Default: all
+    """
+
+    def __init__(self, process, udp_port: int = STREAM_UDP_PORT, tcp_port: int = STREAM_TCP_PORT,
+                 framing: str = STREAM_FRAMING, content_type: str = STREAM_CONTENT_TYPE, acks: bool = STREAM_ACKS,
+                 workers: int = STREAM_WORKERS, queue_size: int = STREAM_QUEUE_SIZE,
+                 max_frame: int = STREAM_MAX_FRAME_BYTES, host: str = ""):
+        self.process = process
+        self.framing = framing
+        self.content_type = content_type
+        self.acks = acks
+        self.workers = workers
+        self.max_frame = max_frame
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._udp = None
+        self._tcp = None
+        self.udp_address = None
+        self.tcp_address = None
+        if udp_port is not None:
+            self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._udp.bind((host, udp_port))
+            self.udp_address = self._udp.getsockname()
+        if tcp_port is not None:
+            self._tcp = _TCPServer((host, tcp_port), self._tcp_handler_class())
+            self.tcp_address = self._tcp.server_address
+        Metrics.register_gauge("stream_queue_depth", self._queue.qsize)
+
+    def start(self):
+        """Start the listener and worker threads"""
+        for number in range(self.workers):
+            threading.Thread(target=self._run_worker, name=f"stream-worker-{number}", daemon=True).start()
+        if self._udp is not None:
+            threading.Thread(target=self._serve_udp, name="stream-udp", daemon=True).start()
+            logger.info(f"Stream listener on UDP {self.udp_address[1]}, {self.framing} framing")
+        if self._tcp is not None:
+            threading.Thread(target=self._tcp.serve_forever, name="stream-tcp", daemon=True).start()
+            logger.info(f"Stream listener on TCP {self.tcp_address[1]}, {self.framing} framing")
+
+    def close(self):
+        """Stop listening"""
+        if self._tcp is not None:
+            self._tcp.shutdown()
+            self._tcp.server_close()
+        if self._udp is not None:
+            self._udp.close()
+
+    def handle(self, payload: bytes, reply=None):
+        """Process a request and send its ack
+
+        Args:
+            payload (bytes): the request
+            reply: a function sending the framed ack, None for no ack
+        """
+        try:
+            status_code, idempotency_key = self.process(payload, self.content_type)
+        except Exception as error:
+            logger.error(f"Failed to process a stream request: {type(error).__name__}: {error}")
+            status_code, idempotency_key = 500, ""
+        Metrics.inc("stream_requests_total")
+        if reply is None:
+            return
+        ack = f"{status_code} {idempotency_key}" if idempotency_key else str(status_code)
+        try:
+            reply(encode_frame(ack.encode("utf-8"), self.framing))
+        except OSError as error:
+            logger.debug(f"Failed to send a stream ack: {error}")
+
+    def submit(self, payload: bytes, reply=None):
+        """Queue a request for the workers, drop it if the queue is full"""
+        try:
+            self._queue.put_nowait((payload, reply))
+        except queue.Full:
+            Metrics.inc("stream_dropped_total")
+            logger.warning("The stream queue is full, request dropped")
+
+    def _run_worker(self):
+        while True:
+            payload, reply = self._queue.get()
+            self.handle(payload, reply)
+
+    def _serve_udp(self):
+        """Receive datagrams until the socket is closed"""
+        while True:
+            try:
+                data, address = self._udp.recvfrom(65535)
+            except OSError:
+                return
+            reply = (lambda ack, address=address: self._udp.sendto(ack, address)) if self.acks else None
+            try:
+                frames = FrameDecoder(self.framing, self.max_frame).feed(data, final=True)
+            except ValueError as error:
+                logger.error(f"Invalid datagram from {address[0]}: {error}")
+                continue
+            for frame in frames:
+                self.submit(frame, reply)
+
+    def _tcp_handler_class(self):
+        listener = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                connection = self.request
+                if listener.acks:
+                    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                decoder = FrameDecoder(listener.framing, listener.max_frame)
+                while True:
+                    try:
+                        data = connection.recv(65536)
+                    except OSError:
+                        return
+                    if not data:
+                        return
+                    try:
+                        frames = decoder.feed(data)
+                    except ValueError as error:
+                        logger.error(f"Closing the stream connection of {self.client_address[0]}: {error}")
+                        return
+                    for frame in frames:
+                        if listener.acks:
+                            # the acks of a connection keep the order of its requests
+                            listener.handle(frame, connection.sendall)
+                        else:
+                            listener.submit(frame)
+
+        return Handler
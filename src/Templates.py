@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the request templates of the IoT devices
+
+Instead of the whole request, an IoT device may send the name
+of a template and the values of its placeholders only:
+
+    {"template": "storageDecrement", "params": {"id": "urn:ngsi_ld:Storage:1", "delta": -1}}
+
+The templates are defined in the JSON file given in TEMPLATES_FILE:
+
+    {"templates": {
+        "storageDecrement": {
+            "method": "PUT",
+            "url": "/v2/entities/{id}/attrs/Counter",
+            "headers": ["Content-Type: application/json"],
+            "data": {"value": {"$inc": "{delta}"}, "type": "Number"}
+        }
+    }}
+
+A template has the url, method, headers, data and transform keys
+of the JSON request, see the README. Relative urls are prefixed with
+ORION_HOST and ORION_PORT. Strings may contain {name} placeholders,
+a string that is a single placeholder keeps the type of the value.
+The values in the url are percent-encoded.
+
+Every template is validated and compiled once, when the file is loaded,
+so the requests rendered from it are not validated again. The file is
+loaded again when the configuration is reloaded, see Config.py.
+
+Environment variables:
+TEMPLATES_FILE:
+    the path of the template file. Default: not set, there are no templates
+"""
+# Standard Library imports
+import json
+import string
+from urllib.parse import quote, urlsplit
+
+# custom imports
+import Config
+from HTTPRequest import HTTPRequest
+from Logger import getLogger
+
+logger = getLogger(__name__)
+
+_formatter = string.Formatter()
+
+
+def placeholders(template: str) -> list:
+    """Return the placeholder names of a template string
+
+    Raises:
+        ValueError: if the template is malformed
+    """
+    return [name for _, name, _, _ in _formatter.parse(template) if name is not None]
+
+
+def compile_template(template, label: str, encode=None):
+    """Compile a template into a function of the variables
+
+    Args:
+        template: a string with {name} placeholders,
+            or a JSON skeleton (dict, list) containing such strings,
+            or any other constant
+        label (str): the name of the template, for error messages
+        encode: a function applied to the values inserted into a string.
+            Default: the values are inserted as they are
+
+    Returns:
+        a function that takes the variables (dict) and returns the rendered template
+
+    Raises:
+        ValueError: if a string template is malformed
+    """
+    if isinstance(template, str):
+        try:
+            names = placeholders(template)
+        except ValueError as error:
+            raise ValueError(f"{label}: malformed template: {template}") from error
+        if not names:
+            return lambda variables: template
+        if template == "{" + names[0] + "}" and encode is None:
+            name = names[0]
+            return lambda variables: variables[name]
+        if encode is None:
+            return template.format_map
+        return lambda variables: template.format_map({name: encode(variables[name]) for name in names})
+    if isinstance(template, dict):
+        items = [(key, compile_template(value, label, encode)) for key, value in template.items()]
+        return lambda variables: {key: render(variables) for key, render in items}
+    if isinstance(template, list):
+        renders = [compile_template(value, label, encode) for value in template]
+        return lambda variables: [render(variables) for render in renders]
+    return lambda variables: template
+
+
+def _names(template) -> set:
+    """Return the placeholder names of a JSON skeleton"""
+    if isinstance(template, str):
+        return set(placeholders(template))
+    if isinstance(template, dict):
+        return set().union(*(_names(value) for value in template.values()))
+    if isinstance(template, list):
+        return set().union(*(_names(value) for value in template))
+    return set()
+
+
+def _encode_url_value(value) -> str:
+    return quote(str(value), safe=":")
+
+
+def _parse_headers(headers, label: str) -> dict:
+    """Parse the headers of a template like the headers of a JSON request
+
+    Raises:
+        ValueError: if a header is not "key: value" or "key"
+    """
+    if isinstance(headers, dict):
+        return {str(name): value for name, value in headers.items()}
+    if not isinstance(headers, list):
+        raise ValueError(f"{label}: headers must be a list of \"key: value\" strings")
+    parsed = {}
+    for header in headers:
+        split = [x.strip() for x in str(header).split(':')]
+        if len(split) > 2:
+            raise ValueError(f'{label}: the header "{header}" does not have a structure of "key: value" or "key"')
+        parsed[split[0]] = split[1] if len(split) == 2 else None
+    return parsed
+
+
+class Template:
+    """A compiled request template
+
+    Args:
+        name (str): the name of the template
+        spec (dict): the template definition, see the module docstring
+        host (str): Orion host for relative urls
+        port: Orion port for relative urls
+
+    Raises:
+        ValueError: if the definition is invalid
+    """
+
+    def __init__(self, name: str, spec: dict, host: str, port):
+        label = f"Template {name}"
+        self.name = name
+        if not isinstance(spec, dict) or "url" not in spec:
+            raise ValueError(f"{label}: an object with a url is required")
+        self.method = str(spec.get("method", "PUT")).upper().strip()
+        if self.method not in ("GET", "POST", "PUT", "DELETE"):
+            raise ValueError(f"{label}: not implemented HTTP method: {self.method}")
+        url = str(spec["url"]).strip()
+        if url.startswith("/"):
+            if host is None:
+                raise ValueError(f"{label}: a relative url needs ORION_HOST")
+            url = f"http://{host}:{port}{url}"
+        headers = _parse_headers(spec.get("headers", []), label)
+        self.has_data = self.method in ("POST", "PUT")
+        data = spec.get("data")
+        if self.has_data:
+            content_type = headers.get("Content-Type")
+            if content_type not in ("application/json", "text/plain"):
+                raise ValueError(f'{label}: the Content-Type header must be "application/json" or "text/plain"')
+            if content_type == "application/json" and not isinstance(data, dict):
+                raise ValueError(f"{label}: the Content-Type is application/json, but the data is not an object")
+            if content_type == "text/plain" and (data is None or len(str(data)) == 0):
+                raise ValueError(f"{label}: the method is {self.method}, but there is no data")
+        transform = spec.get("transform", {})
+        if not isinstance(transform, dict):
+            raise ValueError(f"{label}: transform must be an object")
+        self.params = frozenset(_names(url) | _names(headers) | _names(transform)
+                                | (_names(data) if self.has_data else set()))
+        import validators
+        example = url.format_map({name: "x" for name in _names(url)})
+        # checked like the url of an inline request (main._validate_url), but
+        # validators.url also refuses hostnames like my_orion, so only a url
+        # without an http(s) scheme or a host is rejected
+        if not validators.url(example):
+            parts = urlsplit(example)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise ValueError(f"{label}: not a valid URL: {url}")
+        self.url = compile_template(url, label, _encode_url_value)
+        self.headers = compile_template(headers, label)
+        self.transform = compile_template(transform, label)
+        # a body without placeholders is serialized once
+        self.body = json.dumps(data) if self.has_data and not _names(data) else None
+        self.data = compile_template(data, label)
+
+    def render(self, params: dict, idempotency_key: str = "") -> HTTPRequest:
+        """Render the request of a device
+
+        Args:
+            params (dict): the values of the placeholders
+            idempotency_key (str): the idempotency key of the device, if any
+
+        Returns:
+            the HTTPRequest, ready to be sent
+
+        Raises:
+            ValueError: if a parameter is missing or unknown
+        """
+        if not isinstance(params, dict):
+            raise ValueError(f"Template {self.name}: params must be an object")
+        if params.keys() != self.params:
+            missing = sorted(self.params - params.keys())
+            unknown = sorted(params.keys() - self.params)
+            raise ValueError(f"Template {self.name}: missing params: {missing}, unknown params: {unknown}")
+        headers = self.headers(params)
+        data = ""
+        if self.has_data:
+            data = self.body if self.body is not None else json.dumps(self.data(params))
+            headers["Content-Length"] = str(len(data))
+        return HTTPRequest(url=self.url(params), method=self.method, headers=headers,
+                           transform=self.transform(params), data=data, idempotency_key=idempotency_key)
+
+
+def load_templates(path: str, host: str = None, port=1026) -> dict:
+    """Load and compile a template file
+
+    Args:
+        path (str): the JSON file, see the module docstring
+        host (str): Orion host for relative urls
+        port: Orion port for relative urls
+
+    Returns:
+        the compiled templates by name
+
+    Raises:
+        OSError: if the file cannot be read
+        ValueError: if the file or a template is invalid
+    """
+    with open(path, encoding="utf-8") as file:
+        spec = json.load(file)
+    if not isinstance(spec, dict) or not isinstance(spec.get("templates"), dict):
+        raise ValueError('The template file must be an object with a "templates" object')
+    compiled = {str(name): Template(str(name), template, host, port) for name, template in spec["templates"].items()}
+    logger.info(f"Compiled {len(compiled)} request templates from {path}")
+    return compiled
+
+
+def _load(config: Config.Config) -> dict:
+    """Load the templates of a configuration"""
+    path = config.get("TEMPLATES_FILE")
+    if not path:
+        return {}
+    return load_templates(path, config.get("ORION_HOST"), config.get("ORION_PORT", 1026))
+
+
+try:
+    templates = _load(Config.current())
+except (OSError, ValueError) as error:
+    raise RuntimeError(f"Critical: cannot load TEMPLATES_FILE: {error}") from error
+
+
+def render(name: str, params: dict, idempotency_key: str = "") -> HTTPRequest:
+    """Render the request of a device from a template
+
+    Args:
+        name (str): the name of the template
+        params (dict): the values of the placeholders
+        idempotency_key (str): the idempotency key of the device, if any
+
+    Returns:
+        the HTTPRequest, ready to be sent
+
+    Raises:
+        ValueError: if the template is unknown or the params do not fit it
+    """
+    template = templates.get(name)
+    if template is None:
+        raise ValueError(f"Unknown template: {name}")
+    return template.render(params, idempotency_key)
+
+
+def _prepare_reload(config: Config.Config):
+    """Compile the templates of a reloaded configuration, see Config.add_listener"""
+    try:
+        new = _load(config)
+    except OSError as error:
+        raise ValueError(f"Cannot load TEMPLATES_FILE: {error}") from error
+
+    def commit():
+        global templates
+        templates = new
+
+    return commit
+
+
+Config.add_listener(("TEMPLATES_FILE", "ORION_HOST", "ORION_PORT"), _prepare_reload)
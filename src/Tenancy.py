@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the Orion tenants of the requests
+
+Orion separates the data of the tenants by the Fiware-Service header,
+and the entities of a tenant into a hierarchy by the Fiware-ServicePath
+header. A tenant is represented by the (service, service path) tuple,
+the default tenant is ("", "/").
+
+Orion stores the service names in lowercase, so the service is
+normalized to lowercase. Every cache keyed by entity ids is
+partitioned by the tenant, so the tenants cannot see each other's data.
+"""
+
+SERVICE_HEADER = "Fiware-Service"
+SERVICE_PATH_HEADER = "Fiware-ServicePath"
+
+DEFAULT_TENANT = ("", "/")
+
+
+def _header(headers: dict, name: str):
+    """Get a header by case-insensitive name, None if it is missing"""
+    value = headers.get(name)
+    if value is not None:
+        return value
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def tenant_of(headers: dict) -> tuple:
+    """Get the tenant of a request from its headers
+
+    Args:
+        headers (dict): the request headers
+
+    Returns:
+        the (service, service path) tuple
+    """
+    if not headers:
+        return DEFAULT_TENANT
+    service = _header(headers, SERVICE_HEADER)
+    service_path = _header(headers, SERVICE_PATH_HEADER)
+    service = service.strip().lower() if service else ""
+    service_path = service_path.strip() if service_path else "/"
+    if not service_path:
+        service_path = "/"
+    return service, service_path
+
+
+def tenant_headers(tenant: tuple = None) -> dict:
+    """Construct the headers addressing a tenant in Orion
+
+    Args:
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
+
+    Returns:
+        the Fiware-Service and Fiware-ServicePath headers,
+        an empty dict for the default tenant
+    """
+    if tenant is None or tenant == DEFAULT_TENANT:
+        return {}
+    service, service_path = tenant
+    headers = {}
+    if service:
+        headers[SERVICE_HEADER] = service
+    if service_path != "/":
+        headers[SERVICE_PATH_HEADER] = service_path
+    return headers
+
+
+def has_tenant_headers(headers: dict) -> bool:
+    """Check if the headers address a tenant explicitly"""
+    return _header(headers, SERVICE_HEADER) is not None or _header(headers, SERVICE_PATH_HEADER) is not None
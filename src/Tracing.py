@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+A module for lightweight per-request tracing
+
+Every request handled by the IoT agent gets a correlation id.
+It is taken from the Fiware-Correlator header of the incoming request
+if present, otherwise a new one is generated. The correlation id is
+propagated to Orion in the Fiware-Correlator header of every request
+sent on behalf of the incoming one, including the plugin's lookups.
+
+The stages of the request (parse, validate, transform, Orion lookups,
+forward) are recorded as spans. The spans of the sampled requests are
+exported as one OTLP/JSON line per request (the format of the
+OpenTelemetry file exporter), either into a file or into the log.
+
+The current trace is kept per thread. A thread working on behalf of
+another one (for example a Pipeline sender) activates the trace of the job.
+
+Environment variables:
+TRACE_SAMPLE_RATE:
+    the fraction of the requests whose spans are exported, from 0 to 1.
+    Default: 0 (only the correlation ids are propagated)
+TRACE_FILE:
+    the file the spans are appended to.
+    Default: not set, the spans are logged at INFO level
+"""
+# Standard Library imports
+from contextlib import contextmanager
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+# custom imports
+import Config
+from Logger import getLogger
+
+logger = getLogger(__name__)
+
+SERVICE_NAME = "iotagent-http"
+CORRELATOR_HEADER = "Fiware-Correlator"
+
+TRACE_SAMPLE_RATE = min(max(Config.current().get_float("TRACE_SAMPLE_RATE", 0.0), 0.0), 1.0)
+
+TRACE_FILE = Config.get("TRACE_FILE")
+
+_local = threading.local()
+_file_lock = threading.Lock()
+
+
+class Trace:
+    """The spans of one request
+
+    Args:
+        correlation_id (str): the correlation id. Default: a new uuid
+        sampled (bool): whether the spans are exported when the trace finishes
+    """
+
+    __slots__ = ("correlation_id", "trace_id", "root_span_id", "sampled",
+                 "start_ns", "start_perf_ns", "spans", "attributes")
+
+    def __init__(self, correlation_id: str = None, sampled: bool = False):
+        self.correlation_id = correlation_id or str(uuid.uuid4())
+        self.trace_id = uuid.uuid4().hex
+        self.root_span_id = os.urandom(8).hex()
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.start_perf_ns = time.perf_counter_ns()
+        # (name, start offset ns, duration ns, attributes)
+        self.spans = []
+        self.attributes = {}
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Record the duration of a stage
+
+        Args:
+            name (str): the name of the stage
+            attributes: additional attributes of the span
+        """
+        start = time.perf_counter_ns()
+        try:
+            yield
+        except Exception as error:
+            attributes["error"] = type(error).__name__
+            raise
+        finally:
+            end = time.perf_counter_ns()
+            self.spans.append((name, start - self.start_perf_ns, end - start, attributes))
+
+    def durations(self) -> dict:
+        """Return the total duration of each stage in milliseconds"""
+        durations = {}
+        for name, _, duration, _ in self.spans:
+            durations[name] = durations.get(name, 0.0) + duration / 1e6
+        return {name: round(duration, 3) for name, duration in durations.items()}
+
+    def to_otlp(self, end_ns: int) -> dict:
+        """Return the trace in the OTLP/JSON format"""
+
+        def otlp_attributes(attributes):
+            result = []
+            for key, value in attributes.items():
+                if isinstance(value, bool):
+                    result.append({"key": key, "value": {"boolValue": value}})
+                elif isinstance(value, int):
+                    result.append({"key": key, "value": {"intValue": str(value)}})
+                elif isinstance(value, float):
+                    result.append({"key": key, "value": {"doubleValue": value}})
+                else:
+                    result.append({"key": key, "value": {"stringValue": str(value)}})
+            return result
+
+        spans = [{
+            "traceId": self.trace_id,
+            "spanId": self.root_span_id,
+            "name": "request",
+            "kind": 2,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": otlp_attributes({"correlation_id": self.correlation_id, **self.attributes}),
+        }]
+        for name, offset, duration, attributes in self.spans:
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": os.urandom(8).hex(),
+                "parentSpanId": self.root_span_id,
+                "name": name,
+                "kind": 3 if name.startswith("orion") or name == "forward" else 1,
+                "startTimeUnixNano": str(self.start_ns + offset),
+                "endTimeUnixNano": str(self.start_ns + offset + duration),
+                "attributes": otlp_attributes(attributes),
+            })
+        return {"resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+        }]}
+
+    def finish(self, **attributes):
+        """Finish the trace and export it if it is sampled
+
+        Args:
+            attributes: attributes of the request, for example the status code
+        """
+        self.attributes.update(attributes)
+        if not self.sampled:
+            return
+        line = json.dumps(self.to_otlp(time.time_ns()), separators=(",", ":"))
+        if TRACE_FILE:
+            with _file_lock:
+                with open(TRACE_FILE, "a", encoding="utf-8") as file:
+                    file.write(line + "\n")
+        else:
+            logger.info(line)
+
+
+def start_trace(correlation_id: str = None) -> Trace:
+    """Start the trace of a new request in the current thread
+
+    Args:
+        correlation_id (str): the correlation id sent by the client, if any
+
+    Returns:
+        the new Trace
+    """
+    trace = Trace(correlation_id, sampled=TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE)
+    _local.trace = trace
+    return trace
+
+
+def current():
+    """Return the trace of the current thread, None if there is none"""
+    return getattr(_local, "trace", None)
+
+
+def activate(trace):
+    """Set the trace of the current thread
+
+    Args:
+        trace (Trace): the trace to continue, or None to clear it
+    """
+    _local.trace = trace
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a span in the trace of the current thread, if there is one
+
+    Args:
+        name (str): the name of the stage
+        attributes: additional attributes of the span
+    """
+    trace = current()
+    if trace is None:
+        yield
+        return
+    with trace.span(name, **attributes):
+        yield
+
+
+def correlation_headers() -> dict:
+    """Return the headers propagating the correlation id of the current thread
+
+    Returns:
+        {"Fiware-Correlator": <correlation id>} or an empty dict
+    """
+    trace = current()
+    if trace is None:
+        return {}
+    return {CORRELATOR_HEADER: trace.correlation_id}
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+A module for the pool of processes running the plugin's transform
+
+By default the plugin's transform runs on the thread of the request,
+which suits the transforms waiting for Orion. A transform doing real
+computation (unit conversions, rules, parsing vendor formats) holds
+the GIL and slows down every other thread of the agent. If
+TRANSFORM_PROCESSES is above 0, the transforms run in that many
+worker processes instead.
+
+Each worker imports the plugin once, when it starts, and keeps it for
+its lifetime, so its caches (the entity cache, the Workstation chains)
+stay warm across the requests. The requests cross the process boundary
+as plain tuples of their fields, see encode and decode, together with
+their deadline, see Deadlines.py, and their correlation id, see Tracing.py.
+The deadline is sent as wall clock time, so the time a request waits in
+the queue of the pool counts against it.
+
+The workers are started with the "spawn" method, so they do not inherit
+the threads and locks of the agent. When the plugin is reloaded,
+the workers are replaced by new ones importing the new plugin.
+The metrics of the workers are not collected.
+
+Environment variables:
+TRANSFORM_PROCESSES:
+    the number of worker processes, 0 to run the transforms inline. Default: 0
+"""
+# Standard Library imports
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import dataclasses
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+# custom imports
+import Config
+import Deadlines
+from HTTPRequest import HTTPRequest
+from Logger import getLogger
+import Metrics
+import Tracing
+
+logger = getLogger(__name__)
+
+TRANSFORM_PROCESSES = Config.current().get_int("TRANSFORM_PROCESSES", 0, minimum=0)
+
+# the fields of an HTTPRequest, in the order of its constructor
+FIELDS = tuple(field.name for field in dataclasses.fields(HTTPRequest))
+
+
+def encode(req: HTTPRequest) -> tuple:
+    """Convert a request to a tuple of its fields, which pickles smaller and faster than the dataclass"""
+    return tuple(getattr(req, name) for name in FIELDS)
+
+
+def decode(values: tuple) -> HTTPRequest:
+    """Convert the tuple of encode back to a request"""
+    return HTTPRequest(*values)
+
+
+# the transform function of the worker process, imported by _init_worker
+_transform = None
+
+
+def _init_worker(plugin: str):
+    """Import the plugin in a new worker process
+
+    Args:
+        plugin (str): the name of the module with the transform function
+    """
+    global _transform
+    # the worker exits with the agent, even if the agent was killed
+    parent = multiprocessing.parent_process()
+    if parent is not None:
+        threading.Thread(target=_exit_with, args=(parent,), name="parent-watch", daemon=True).start()
+    module = importlib.import_module(plugin)
+    _transform = module.transform
+    # the Workstation chains prefetched by the plugin, see PLUGIN_PREFETCH
+    prefetcher = getattr(sys.modules.get(f"{plugin}.transform"), "prefetcher", None)
+    if prefetcher is not None:
+        prefetcher.join()
+
+
+def _exit_with(parent):
+    """Exit the worker process when the agent exits"""
+    parent.join()
+    os._exit(0)
+
+
+def _run(values: tuple, deadline: float = None, correlation_id: str = None) -> tuple:
+    """Transform a request in the worker process
+
+    Args:
+        values (tuple): the encoded request
+        deadline (float): its deadline, in time.time() seconds, None if it has none
+        correlation_id (str): the correlation id of its trace, None if it has none
+
+    Returns:
+        the encoded transformed request
+
+    Raises:
+        Deadlines.DeadlineExceededError: if the deadline passed while the request was queued
+    """
+    if deadline is not None:
+        budget = deadline - time.time()
+        if budget <= 0:
+            raise Deadlines.DeadlineExceededError("The deadline passed before a worker took the transform")
+        Deadlines.start(budget)
+    if correlation_id is not None:
+        # the spans of the worker are not exported, the agent records the transform span
+        Tracing.activate(Tracing.Trace(correlation_id))
+    try:
+        return encode(_transform(decode(values)))
+    finally:
+        Deadlines.activate(None)
+        Tracing.activate(None)
+
+
+def _ping() -> int:
+    """Return the process id of a worker"""
+    return os.getpid()
+
+
+class TransformPool:
+    """Runs the plugin's transform in a pool of worker processes
+
+    Args:
+        processes (int): the number of worker processes
+        plugin (str): the name of the module with the transform function
+    """
+
+    def __init__(self, processes: int, plugin: str = "plugin"):
+        self.processes = processes
+        self.plugin = plugin
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        Metrics.set_gauge("transform_pool_processes", processes)
+
+    def _new_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                                      initializer=_init_worker, initargs=(self.plugin,))
+
+    def warm_up(self):
+        """Start the worker processes and wait until they imported the plugin"""
+        with self._lock:
+            executor = self._executor
+        pids = {future.result() for future in [executor.submit(_ping) for _ in range(self.processes)]}
+        logger.info(f"Transform pool ready, {len(pids)} of {self.processes} worker processes started")
+
+    def transform(self, req: HTTPRequest) -> HTTPRequest:
+        """Transform a request in a worker process
+
+        Args:
+            req (HTTPRequest): the request to transform
+
+        Returns:
+            the transformed request
+
+        Raises:
+            Deadlines.DeadlineExceededError: if the deadline of the request passed
+            RuntimeError: if the worker process died
+            the errors of the transform
+        """
+        budget = Deadlines.remaining()
+        deadline = None if budget is None else time.time() + budget
+        trace = Tracing.current()
+        with self._lock:
+            executor = self._executor
+        future = executor.submit(_run, encode(req), deadline, None if trace is None else trace.correlation_id)
+        Metrics.inc("transform_pool_tasks_total")
+        try:
+            return decode(future.result(timeout=budget))
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise Deadlines.DeadlineExceededError("The transform did not finish before the deadline") from None
+        except BrokenProcessPool as error:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._new_executor()
+            logger.error(f"A transform worker process died, the workers are restarted: {error}")
+            raise RuntimeError(f"A transform worker process died: {error}") from error
+
+    def restart(self):
+        """Replace the worker processes, so that they import the plugin again
+
+        The transforms in flight finish in the old workers.
+        """
+        with self._lock:
+            old, self._executor = self._executor, self._new_executor()
+        old.shutdown(wait=False)
+
+    def close(self):
+        """Stop the worker processes"""
+        with self._lock:
+            executor = self._executor
+        executor.shutdown(wait=True, cancel_futures=True)
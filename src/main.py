@@ -15,22 +15,53 @@ python main.py
 """
 
 # Standard Library imports
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import dataclasses
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import importlib
+import io
 import json
-import os
+import logging
+import re
+import signal
 import sys
-
-# PyPI imports
-import requests
-import validators
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
 
 # custom imports
-from Logger import getLogger
+import Aggregation
+import Capture
+import Codecs
+import Compression
+import Concurrency
+import Config
+import Deadlines
+from Logger import getLogger, getAccessLogger
 from HTTPRequest import HTTPRequest
+import Health
+from IdempotencyStore import IdempotencyStore
+import Metrics
+import Priority
+import Profiler
+from SegmentLog import SegmentLog
+import Sessions
+import Sharding
+import Stream
+import Templates
+import Tenancy
+import Tracing
+import TransformPool
+from Pipeline import Pipeline, QueueFullError, QUEUE_FULL_POLICIES
+from StoreAndForward import StoreAndForward
 
 logger = getLogger(__name__)
+access_logger = getAccessLogger()
+
+# the id of the target entity in an Orion URL
+ENTITY_ID_PATTERN = re.compile(r'/v2/entities/([^/?#]+)')
 
-PORT = os.environ.get("PORT")
+PORT = Config.get("PORT")
 try:
     PORT = int(PORT)
     logger.info(f"Using port: {PORT}")
@@ -38,7 +69,7 @@ except:
     PORT = 4315
     logger.warning(f"Failed to convert env var PORT to int. Using default port: {PORT}")
 
-USE_PLUGIN = os.environ.get("USE_PLUGIN")
+USE_PLUGIN = Config.get("USE_PLUGIN")
 logger.debug(f"USE_PLUGIN: {USE_PLUGIN}")
 if USE_PLUGIN is None:
     USE_PLUGIN = False
@@ -48,27 +79,455 @@ else:
     USE_PLUGIN = False
 logger.debug(f"USE_PLUGIN: {USE_PLUGIN}")
 
-"""
-A function for loading the plugin.transform module
-
-Returns:
-    plugin.transform if 
-        - USE_PLUGIN environment variable is true (case insensitive) and
-        - the plugin.transform module can be imported
-    None otherwise
-"""
-if not USE_PLUGIN:
-    transform = None
+SENDER_THREADS = Config.get("SENDER_THREADS")
+try:
+    SENDER_THREADS = int(SENDER_THREADS)
+    if SENDER_THREADS < 0:
+        raise ValueError
+except (TypeError, ValueError):
+    SENDER_THREADS = 1
+logger.debug(f"SENDER_THREADS: {SENDER_THREADS}")
+
+QUEUE_SIZE = Config.get("QUEUE_SIZE")
+try:
+    QUEUE_SIZE = int(QUEUE_SIZE)
+    if QUEUE_SIZE < 1:
+        raise ValueError
+except (TypeError, ValueError):
+    QUEUE_SIZE = 100
+logger.debug(f"QUEUE_SIZE: {QUEUE_SIZE}")
+
+QUEUE_FULL_POLICY = Config.get("QUEUE_FULL_POLICY")
+if QUEUE_FULL_POLICY is None or QUEUE_FULL_POLICY.lower() not in QUEUE_FULL_POLICIES:
+    QUEUE_FULL_POLICY = "block"
 else:
+    QUEUE_FULL_POLICY = QUEUE_FULL_POLICY.lower()
+logger.debug(f"QUEUE_FULL_POLICY: {QUEUE_FULL_POLICY}")
+
+QUEUE_PUT_TIMEOUT = Config.get("QUEUE_PUT_TIMEOUT")
+try:
+    QUEUE_PUT_TIMEOUT = float(QUEUE_PUT_TIMEOUT)
+except (TypeError, ValueError):
+    QUEUE_PUT_TIMEOUT = 5.0
+
+# the maximum number of seconds a handler waits for its queued request to be sent
+QUEUE_RESULT_TIMEOUT = Config.get("QUEUE_RESULT_TIMEOUT")
+try:
+    QUEUE_RESULT_TIMEOUT = float(QUEUE_RESULT_TIMEOUT)
+    if QUEUE_RESULT_TIMEOUT <= 0:
+        raise ValueError
+except (TypeError, ValueError):
+    QUEUE_RESULT_TIMEOUT = 30.0
+
+# the maximum number of requests handled at once, see BoundedThreadingHTTPServer
+HANDLER_THREADS = Config.get("HANDLER_THREADS")
+try:
+    HANDLER_THREADS = int(HANDLER_THREADS)
+    if HANDLER_THREADS < 1:
+        raise ValueError
+except (TypeError, ValueError):
+    HANDLER_THREADS = 64
+
+# the senders of the high priority requests only, see Priority.py
+HIGH_PRIORITY_SENDERS = Config.get("HIGH_PRIORITY_SENDERS")
+try:
+    HIGH_PRIORITY_SENDERS = int(HIGH_PRIORITY_SENDERS)
+    if HIGH_PRIORITY_SENDERS < 0:
+        raise ValueError
+except (TypeError, ValueError):
+    HIGH_PRIORITY_SENDERS = 1
+
+HIGH_PRIORITY_QUEUE_SIZE = Config.get("HIGH_PRIORITY_QUEUE_SIZE")
+try:
+    HIGH_PRIORITY_QUEUE_SIZE = int(HIGH_PRIORITY_QUEUE_SIZE)
+    if HIGH_PRIORITY_QUEUE_SIZE < 1:
+        raise ValueError
+except (TypeError, ValueError):
+    HIGH_PRIORITY_QUEUE_SIZE = QUEUE_SIZE
+
+# the admin endpoints (/admin/...) are disabled if ADMIN_TOKEN is not set
+ADMIN_TOKEN = Config.get("ADMIN_TOKEN")
+if not ADMIN_TOKEN:
+    ADMIN_TOKEN = None
+    logger.debug("ADMIN_TOKEN is not set, admin endpoints are disabled")
+
+PROFILE_DIR = Config.get("PROFILE_DIR")
+if PROFILE_DIR is None:
+    PROFILE_DIR = "/tmp"
+
+PROFILE_SECONDS = Config.get("PROFILE_SECONDS")
+try:
+    PROFILE_SECONDS = float(PROFILE_SECONDS)
+except (TypeError, ValueError):
+    PROFILE_SECONDS = 10.0
+
+# the agent is not ready if the pipeline queue is filled beyond this fraction
+READY_MAX_QUEUE_FILL = Config.get("READY_MAX_QUEUE_FILL")
+try:
+    READY_MAX_QUEUE_FILL = float(READY_MAX_QUEUE_FILL)
+except (TypeError, ValueError):
+    READY_MAX_QUEUE_FILL = 0.9
+
+IDEMPOTENCY_TTL = Config.get("IDEMPOTENCY_TTL")
+try:
+    IDEMPOTENCY_TTL = float(IDEMPOTENCY_TTL)
+except (TypeError, ValueError):
+    IDEMPOTENCY_TTL = 300.0
+
+IDEMPOTENCY_MAX_KEYS = Config.get("IDEMPOTENCY_MAX_KEYS")
+try:
+    IDEMPOTENCY_MAX_KEYS = int(IDEMPOTENCY_MAX_KEYS)
+except (TypeError, ValueError):
+    IDEMPOTENCY_MAX_KEYS = 10000
+
+# the write requests that fail to connect to Orion are buffered
+# in this directory and replayed later. Not set: they fail with 503
+BUFFER_DIR = Config.get("BUFFER_DIR")
+if not BUFFER_DIR:
+    BUFFER_DIR = None
+
+BUFFER_SEGMENT_BYTES = Config.get("BUFFER_SEGMENT_BYTES")
+try:
+    BUFFER_SEGMENT_BYTES = int(BUFFER_SEGMENT_BYTES)
+except (TypeError, ValueError):
+    BUFFER_SEGMENT_BYTES = 16 * 1024 * 1024
+
+BUFFER_MAX_BYTES = Config.get("BUFFER_MAX_BYTES")
+try:
+    BUFFER_MAX_BYTES = int(BUFFER_MAX_BYTES)
+except (TypeError, ValueError):
+    BUFFER_MAX_BYTES = 1024 * 1024 * 1024
+
+BUFFER_FSYNC = Config.get("BUFFER_FSYNC")
+BUFFER_FSYNC = BUFFER_FSYNC is None or BUFFER_FSYNC.lower() != "false"
+
+BUFFER_REPLAY_RATE = Config.get("BUFFER_REPLAY_RATE")
+try:
+    BUFFER_REPLAY_RATE = float(BUFFER_REPLAY_RATE)
+except (TypeError, ValueError):
+    BUFFER_REPLAY_RATE = 50.0
+
+BUFFER_RETRY_INTERVAL = Config.get("BUFFER_RETRY_INTERVAL")
+try:
+    BUFFER_RETRY_INTERVAL = float(BUFFER_RETRY_INTERVAL)
+except (TypeError, ValueError):
+    BUFFER_RETRY_INTERVAL = 5.0
+
+# the recently completed requests with an idempotency key
+idempotency_store = IdempotencyStore(ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS)
+
+# the pipeline between the request handlers and the senders,
+# created in run(). If None, the handlers send the requests themselves.
+pipeline = None
+
+# the buffer of the writes Orion could not receive, created in run() if BUFFER_DIR is set
+store_and_forward = None
+BUFFERED_RESPONSE = b'Orion is unavailable, the request is buffered and will be forwarded later'
+
+# the background probe of the Orion brokers, created in run()
+orion_probe = None
+
+# the UDP and TCP listener, created in run() if STREAM_UDP_PORT or STREAM_TCP_PORT is set
+stream_listener = None
+
+# the aggregation of the sensor values, created in run() if AGGREGATE_ATTRIBUTES is set
+aggregator = None
+AGGREGATED_RESPONSE = b'Aggregated, the window is forwarded when it ends'
+
+# the capture of the requests of the IoT devices, created in run() if CAPTURE_DIR is set
+capture = None
+
+# the worker processes of the plugin's transform, created in run()
+# if TRANSFORM_PROCESSES is above 0 and the plugin is used, or by the reload
+# enabling the plugin. If None, the transforms run inline.
+transform_pool = None
+
+# the modules imported again when the plugin is reloaded. Orion is kept,
+# with its entity cache and its connections
+PLUGIN_RELOADED_MODULES = ("plugin.rules", "plugin.transform")
+
+
+def _import_plugin():
+    """Import the plugin.transform function
+
+    Returns:
+        the transform function
+
+    Raises:
+        the errors of the import of the plugin
+    """
+    from plugin import transform
+    return transform
+
+
+def _import_fresh_plugin():
+    """Import new copies of PLUGIN_RELOADED_MODULES without putting them in use
+
+    The import needs the new modules in sys.modules, the old ones are put
+    back right after it. Until install is called, the requests keep using
+    the old copies, so a reload failing in another setting changes nothing.
+
+    Returns:
+        (transform, install): the new transform function and a function
+        without arguments putting the new modules in place of the old ones.
+        install keeps the Workstation chains seen so far.
+
+    Raises:
+        the errors of the import of the plugin
+    """
+    if "plugin.transform" not in sys.modules:
+        # nothing to replace, the plugin was never imported
+        return _import_plugin(), lambda: None
+    package = sys.modules["plugin"]
+    saved = {name: sys.modules.pop(name) for name in PLUGIN_RELOADED_MODULES if name in sys.modules}
+    attributes = {name: vars(package).pop(name.rpartition('.')[2], None) for name in PLUGIN_RELOADED_MODULES}
+    try:
+        module = importlib.import_module("plugin.transform")
+    finally:
+        fresh = {name: sys.modules.pop(name) for name in PLUGIN_RELOADED_MODULES if name in sys.modules}
+        sys.modules.update(saved)
+        for name, value in attributes.items():
+            setattr(package, name.rpartition('.')[2], value)
+
+    def install():
+        sys.modules.update(fresh)
+        for name, new_module in fresh.items():
+            setattr(package, name.rpartition('.')[2], new_module)
+        old_module = saved["plugin.transform"]
+        with old_module._chains_lock:
+            module.likely_chain.update(old_module.likely_chain)
+        # plugin/__init__.py exports the function, not the module
+        package.transform = module.transform
+
+    return module.transform, install
+
+
+def _load_plugin(use_plugin: bool):
+    """A function for loading the plugin.transform module
+
+    Returns:
+        plugin.transform if 
+            - use_plugin is true and
+            - the plugin.transform module can be imported
+        None otherwise
+    """
+    global plugin_error
+    plugin_error = None
+    if not use_plugin:
+        return None
     try:
-        from plugin import transform
+        plugin_transform = _import_plugin()
         logger.info("Transform function imported from plugin")
+        return plugin_transform
     except ModuleNotFoundError:
         logger.info("No plugin found")
-        transform = None
-    except (SyntaxError, IndentationError, ImportError):
-        logger.error("Failed to import transform function from plugin")
-        transform = None
+        plugin_error = "No plugin found"
+    except (SyntaxError, IndentationError, ImportError, RuntimeError) as error:
+        logger.error(f"Failed to import transform function from plugin: {error}")
+        plugin_error = f"{type(error).__name__}: {error}"
+    return None
+
+
+# the plugin is imported by the first request or by warm_up, not at startup
+transform = None
+# why the plugin is not used although USE_PLUGIN is true, None if it is loaded
+plugin_error = None
+_plugin_loaded = False
+_plugin_lock = threading.Lock()
+
+
+def _get_transform():
+    """Return the transform function of the plugin, importing it on first use
+
+    Returns:
+        the transform function, None if the plugin is not used
+    """
+    global transform, _plugin_loaded
+    if not _plugin_loaded:
+        with _plugin_lock:
+            if not _plugin_loaded:
+                transform = _load_plugin(USE_PLUGIN)
+                _plugin_loaded = True
+    return transform
+
+
+def _prepare_plugin_reload(config: Config.Config):
+    """Re-import the plugin, see Config.add_listener
+
+    Raises:
+        ValueError: if the plugin cannot be imported
+    """
+    use_plugin = config.get_bool("USE_PLUGIN", False)
+    new_transform, install = None, None
+    if use_plugin:
+        try:
+            new_transform, install = _import_fresh_plugin()
+        except Exception as error:
+            raise ValueError(f"Failed to import the plugin: {type(error).__name__}: {error}") from error
+
+    def commit():
+        global USE_PLUGIN, transform, _plugin_loaded, plugin_error, transform_pool
+        with _plugin_lock:
+            if install is not None:
+                install()
+            USE_PLUGIN, transform, _plugin_loaded, plugin_error = use_plugin, new_transform, True, None
+        if transform_pool is not None:
+            transform_pool.restart()
+        elif use_plugin and TransformPool.TRANSFORM_PROCESSES > 0:
+            # the plugin was disabled at startup, so there is no pool yet
+            transform_pool = TransformPool.TransformPool(TransformPool.TRANSFORM_PROCESSES)
+            threading.Thread(target=transform_pool.warm_up, name='transform-pool-warm-up', daemon=True).start()
+            logger.info(f'The transforms run in {TransformPool.TRANSFORM_PROCESSES} worker processes')
+        logger.info(f"Plugin {'reloaded' if use_plugin else 'disabled'}")
+
+    return commit
+
+
+def _prepare_admin_reload(config: Config.Config):
+    """Change the admin token, see Config.add_listener"""
+    admin_token = config.get("ADMIN_TOKEN") or None
+
+    def commit():
+        global ADMIN_TOKEN
+        ADMIN_TOKEN = admin_token
+
+    return commit
+
+
+Config.add_listener(("USE_PLUGIN", "TRANSFORM_RULES", "PLUGIN_PREFETCH"), _prepare_plugin_reload)
+Config.add_listener(("ADMIN_TOKEN",), _prepare_admin_reload)
+
+
+def reload_config() -> dict:
+    """Reload the configuration, see Config.py
+
+    Returns:
+        {"changed": [the changed settings], "restart_required": [the changed
+        settings that are applied at the next restart]}
+
+    Raises:
+        OSError: if CONFIG_FILE cannot be read
+        ValueError: if the new configuration is invalid, the old one stays in effect
+    """
+    try:
+        changed = Config.reload()
+    except (OSError, ValueError) as error:
+        logger.error(f"Configuration reload failed, the old configuration stays in effect: {error}")
+        Metrics.inc('config_reload_failures_total')
+        raise
+    restart_required = [name for name in changed if not Config.is_reloadable(name)]
+    logger.info(f"Configuration reloaded, changed: {changed}")
+    if restart_required:
+        logger.warning(f"These settings are applied at the next restart: {restart_required}")
+    Metrics.inc('config_reloads_total')
+    return {'changed': changed, 'restart_required': restart_required}
+
+
+def _reload_on_signal():
+    """Reload the configuration, logging the errors"""
+    try:
+        reload_config()
+    except (OSError, ValueError):
+        pass
+
+
+# set when the listener is bound and warm_up is done
+ready = threading.Event()
+
+
+def warm_up():
+    """Import the modules and load the plugin before the agent is ready
+
+    The listener accepts requests at once. The first requests may wait
+    for the imports, so the load balancer should send traffic
+    only after GET /ready returns 200.
+    """
+    started = time.perf_counter()
+    # the validators, requests, cbor2 and msgpack modules are imported lazily
+    import validators  # noqa: F401
+    logger.info(f'Binary encodings: {Codecs.available() or "none"}')
+    orion_host = Config.get('ORION_HOST')
+    if orion_host:
+        Sessions.get_session(f"http://{orion_host}:{Config.get('ORION_PORT', '1026')}")
+    if _get_transform() is not None and transform_pool is not None:
+        transform_pool.warm_up()
+    # the Workstation chains prefetched by the plugin, see PLUGIN_PREFETCH
+    prefetcher = getattr(sys.modules.get('plugin.transform'), 'prefetcher', None)
+    if prefetcher is not None:
+        prefetcher.join()
+    ready.set()
+    logger.info(f'Ready, warm-up took {time.perf_counter() - started:.3f} s')
+
+
+def _probe_targets() -> list:
+    """Return the "host:port" of every Orion the agent sends requests to"""
+    targets = []
+    orion_host = Config.get('ORION_HOST')
+    if orion_host:
+        targets.append(f"{orion_host}:{Config.get('ORION_PORT', '1026')}")
+    router = Sharding.router
+    if router is not None:
+        targets.extend(router.shards + list(router.types.values()) + list(router.pins.values()))
+    orion = sys.modules.get('plugin.Orion')
+    if orion is not None:
+        targets.extend(f'{host}:{port}' for host, port in orion.ORION_TENANTS.values())
+    return list(dict.fromkeys(targets))
+
+
+def liveness() -> tuple:
+    """Check if the agent is alive, a failing agent should be restarted
+
+    Returns:
+        (alive, the checks as a dict)
+    """
+    checks = {'senders': pipeline.alive() if pipeline is not None else None}
+    return checks['senders'] is not False, checks
+
+
+def readiness() -> tuple:
+    """Check if the agent should receive traffic
+
+    The agent is ready if the warm-up is done, the plugin is loaded
+    if USE_PLUGIN is true, the pipeline queue is not nearly full and
+    the breakers of the Orion brokers are closed. The Orion brokers
+    are probed in the background, see Health.py.
+
+    Returns:
+        (ready, the checks as a dict)
+    """
+    checks = {'warm_up': ready.is_set()}
+    failures = [] if checks['warm_up'] else ['warm_up']
+    if USE_PLUGIN:
+        checks['plugin'] = 'loaded' if transform is not None else (plugin_error or 'loading')
+        if transform is None:
+            failures.append('plugin')
+    if pipeline is not None:
+        checks['queue'] = {'depth': pipeline.depth(), 'size': pipeline.size()}
+        if pipeline.depth() >= READY_MAX_QUEUE_FILL * pipeline.size():
+            failures.append('queue')
+    if orion_probe is not None:
+        checks['orion'] = orion_probe.status()
+        if not orion_probe.healthy():
+            failures.append('orion')
+    if store_and_forward is not None:
+        checks['buffer'] = {'backlog': store_and_forward.backlog()}
+    checks['failures'] = failures
+    return not failures, checks
+
+
+class _CountingWriter:
+    """Wraps the output stream of a connection and counts the bytes written"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes_written = 0
+
+    def write(self, data: bytes) -> int:
+        self.bytes_written += len(data)
+        return self._stream.write(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
 
 
 class IoTAgent(BaseHTTPRequestHandler):
@@ -85,18 +544,79 @@ class IoTAgent(BaseHTTPRequestHandler):
     See the README for a more in-depth explanation.
     """
 
-    def _set_response(self, status_code: int):
+    def setup(self):
+        """Set up the connection, counting the bytes sent for the access log"""
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+
+    def log_message(self, format: str, *args):
+        """Log the messages of BaseHTTPRequestHandler at debug level
+
+        BaseHTTPRequestHandler writes every request to stderr by default,
+        the access log replaces that
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _log_access(self, start: float, req: HTTPRequest = None):
+        """Write one JSON line about the handled request into the access log
+
+        Args:
+            start (float): time.perf_counter() when the request arrived
+            req (HTTPRequest): the request sent to Orion, if any
+        """
+        if access_logger.disabled:
+            return
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'client': self.client_address[0],
+            'method': self.command,
+            'path': self.path,
+            'status': getattr(self, '_status_code', 0),
+            'bytes': self.wfile.bytes_written if isinstance(self.wfile, _CountingWriter) else 0,
+            'duration_ms': round((time.perf_counter() - start) * 1e3, 3),
+        }
+        if req is not None:
+            entry['orion_method'] = req.method
+            match = ENTITY_ID_PATTERN.search(req.url)
+            entry['target'] = match.group(1) if match else req.url
+            service, service_path = Tenancy.tenant_of(req.headers)
+            if service or service_path != '/':
+                entry['tenant'] = f'{service}{service_path}'
+        trace = Tracing.current()
+        if trace is not None:
+            entry['correlation_id'] = trace.correlation_id
+            entry['stages_ms'] = trace.durations()
+        access_logger.info(json.dumps(entry, separators=(',', ':')))
+
+    def send_response(self, code: int, message: str = None):
+        """Send the response line, remembering the status code for the trace"""
+        self._status_code = code
+        super().send_response(code, message)
+
+    def _set_response(self, status_code: int, content_encoding: str = None):
         """Set response based on the status_code of the HTTP Request
 
         Args:
             status_code (int): HTTP status code resulting after the HTTP Request
                 is sent to Orion
+            content_encoding (str): the encoding of a compressed body, see Compression.py
         """
-        logger.info(f"_set_response: status_code == {status_code}")
+        logger.debug("_set_response: status_code == %s", status_code)
         self.send_response(status_code)
         self.send_header("Content-type", "text/plain")
+        if content_encoding is not None:
+            self.send_header("Content-Encoding", content_encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self._send_correlation_header()
         self.end_headers()
 
+    def _send_correlation_header(self):
+        """Send the correlation id of the request back to the client"""
+        trace = Tracing.current()
+        if trace is not None:
+            self.send_header(Tracing.CORRELATOR_HEADER, trace.correlation_id)
+
     def _handle_bad_request(self, error: Exception):
         """A function for handling bad requests 
 
@@ -108,6 +628,19 @@ class IoTAgent(BaseHTTPRequestHandler):
         self._set_response(status_code=400)
         self.wfile.write(msg.encode('utf-8'))
 
+    def _handle_unsupported_media_type(self, error: Exception):
+        """A function for handling requests in an encoding that is not supported
+
+        It is invoked when a Codecs.UnsupportedMediaTypeError is raised
+
+        Args:
+            error (Exception): the error raised
+        """
+        msg = f'Unsupported media type.\n{error}'
+        logger.error(msg)
+        self._set_response(415)
+        self.wfile.write(msg.encode('utf-8'))
+
     def _handle_connection_error(self, error: Exception):
         """A function for handling connection errors
 
@@ -121,6 +654,68 @@ class IoTAgent(BaseHTTPRequestHandler):
         self._set_response(503)
         self.wfile.write(msg.encode('utf-8'))
 
+    def _handle_timeout(self, error: Exception):
+        """A function for handling requests that were not done before their deadline
+
+        It is invoked when a requests.exceptions.Timeout
+        or a Deadlines.DeadlineExceededError is raised
+
+        Args:
+            error (Exception): the error raised
+        """
+        msg = f'The request timed out.\n{type(error).__name__}\nTraceback:\n{error}'
+        logger.error(msg)
+        self._set_response(504)
+        self.wfile.write(msg.encode('utf-8'))
+
+    def _buffer_request(self, req: HTTPRequest, error: Exception = None):
+        """Store a write request to forward it to Orion later
+
+        Responds with 202 Accepted, or with 503 if the request
+        cannot be written to the disk. The 202 response is kept in
+        _buffered_response, so that _process_request stores it
+        for the idempotency key of the request.
+
+        Args:
+            req (HTTPRequest): the request to buffer
+            error (Exception): the connection error, if the request failed
+
+        Returns:
+            (status_code, body) of the response, None if the request was not buffered
+        """
+        try:
+            with Tracing.span('buffer'):
+                store_and_forward.store(req)
+        except OSError as buffer_error:
+            logger.error(f'Failed to buffer the request: {buffer_error}')
+            self._handle_connection_error(error if error is not None else buffer_error)
+            return None
+        if error is not None:
+            logger.warning(f'Orion is unavailable, request buffered: {type(error).__name__}')
+        self._set_response(202)
+        self.wfile.write(BUFFERED_RESPONSE)
+        self._buffered_response = (202, BUFFERED_RESPONSE)
+        return self._buffered_response
+
+    def _handle_overload(self, error: Exception):
+        """A function for handling a full pipeline queue
+
+        It is invoked when a Pipeline.QueueFullError is raised
+        or the request was not sent in QUEUE_RESULT_TIMEOUT seconds,
+        or a Concurrency.ConcurrencyLimitError is raised
+
+        Args:
+            error (Exception): the error raised
+        """
+        msg = f'The IoT agent is overloaded, try again later.\n{error}'
+        logger.warning(msg)
+        self.send_response(503)
+        self.send_header("Content-type", "text/plain")
+        self.send_header("Retry-After", "1")
+        self._send_correlation_header()
+        self.end_headers()
+        self.wfile.write(msg.encode('utf-8'))
+
     def _clean_keys(self, parsed_data: dict):
         """Clean keys of the parsed request 
 
@@ -230,13 +825,13 @@ class IoTAgent(BaseHTTPRequestHandler):
     def _validate_url(self, parsed_data: dict):
         """Validate url of the parsed request
 
-        Raises: 
-            validators.ValidationFailure 
-                if the parsed_data["url"] field is not valid
+        validators.url returns a falsy ValidationError instead of raising,
+        so an invalid url is only rejected when it is sent
 
         Args:
             parsed_data (dict): decoded parsed request 
         """
+        import validators
         validators.url(parsed_data['url'])
 
     def _validate_content_type(self, parsed_data: dict, headers: dict):
@@ -277,12 +872,14 @@ class IoTAgent(BaseHTTPRequestHandler):
         Returns:
             req (HTTPRequest)
         """
-        logger.debug(f'Parsed data:\n{parsed_data}')
+        logger.debug('Parsed data: %s', parsed_data)
+        idempotency_key = str(parsed_data.get('idempotency_key', ''))
         if parsed_data['method'] in ('GET', 'DELETE'):
             req = HTTPRequest(url=parsed_data['url'],
                               transform=parsed_data['transform'] if "transform" in parsed_data else {},
                               method=parsed_data['method'],
-                              headers=headers)
+                              headers=headers,
+                              idempotency_key=idempotency_key)
             return req
         elif parsed_data['method'] in ('POST', 'PUT'):
             data = json.dumps(parsed_data['data'])
@@ -291,7 +888,8 @@ class IoTAgent(BaseHTTPRequestHandler):
                               transform= parsed_data['transform'] if "transform" in parsed_data else {},
                               method=parsed_data['method'],
                               headers=headers,
-                              data=data)
+                              data=data,
+                              idempotency_key=idempotency_key)
             return req
 
     def _apply_plugin_if_present(self, req: HTTPRequest) -> HTTPRequest:
@@ -300,77 +898,237 @@ class IoTAgent(BaseHTTPRequestHandler):
         If the plugin is used, transform is plugin.transform,
         if the plugin is not used, transform is None
         The plugin is not a part of the IoTAgent
+        If there is a transform_pool, the transform runs in its worker processes
 
         Args:
             req (HTTPRequest): request to transform 
 
         Returns:
             req (HTTPRequest)
+
+        Raises:
+            Deadlines.DeadlineExceededError: if the deadline of the request
+                passed before or during the transform
         """
-        logger.debug(f"transform: {transform}")
+        transform = _get_transform()
+        logger.debug("transform: %s", transform)
         if transform is not None:
-            req = transform(req)
-            logger.info(f"Request transformed: {req}")
+            priority = req.priority
+            Deadlines.check()
+            with Tracing.span('transform'):
+                try:
+                    req = transform(req) if transform_pool is None else transform_pool.transform(req)
+                except Exception as error:
+                    # the plugin wraps the timeouts of its lookups in its own errors
+                    if Deadlines.expired():
+                        raise Deadlines.DeadlineExceededError(
+                            f'The deadline of the request passed during the transform: {error}') from error
+                    raise
+            if req.priority == Priority.NORMAL:
+                # a plugin building a new request keeps the priority class
+                req.priority = priority
+            logger.debug("Request transformed: %s", req)
         return req
 
-    def _send_request_to_broker(self, req: HTTPRequest) -> requests.Response:
+    @staticmethod
+    def _to_shard(req: HTTPRequest, shard: str, data: str = None) -> HTTPRequest:
+        """Copy a request, addressing another shard
+
+        Args:
+            req (HTTPRequest): the request
+            shard (str): the "host:port" of the shard
+            data (str): the new body. Default: the body of req
+
+        Returns:
+            the copied HTTPRequest
+        """
+        url = urlsplit(req.url)._replace(netloc=shard).geturl()
+        if data is None:
+            return dataclasses.replace(req, url=url)
+        headers = {**req.headers, 'Content-Length': str(len(data))}
+        return dataclasses.replace(req, url=url, headers=headers, data=data)
+
+    @staticmethod
+    def _shard_requests(req: HTTPRequest) -> list:
+        """Route a request to the shards of its entities
+
+        Only the requests addressing one of the shards are routed.
+        A request about an entity, including the creation of an entity,
+        goes to the shard of the entity. A batch update is split
+        into one update per shard. Other requests are not changed.
+
+        Args:
+            req (HTTPRequest): the request
+
+        Returns:
+            the list of requests to send
+        """
+        if not Sharding.enabled():
+            return [req]
+        url = urlsplit(req.url)
+        if not Sharding.is_shard(url.netloc):
+            return [req]
+        match = ENTITY_ID_PATTERN.search(url.path)
+        if match:
+            return [IoTAgent._to_shard(req, Sharding.shard_for(unquote(match.group(1))))]
+        if req.method != 'POST' or req.headers.get('Content-Type') != 'application/json':
+            return [req]
+        path = url.path.rstrip('/')
+        body = json.loads(req.data)
+        if path == '/v2/entities' and isinstance(body, dict) and isinstance(body.get('id'), str):
+            return [IoTAgent._to_shard(req, Sharding.shard_for(body['id']))]
+        if path == '/v2/op/update' and isinstance(body, dict) and isinstance(body.get('entities'), list):
+            groups = {}
+            for entity in body['entities']:
+                groups.setdefault(Sharding.shard_for(str(entity.get('id', ''))), []).append(entity)
+            if len(groups) > 1:
+                Metrics.inc('orion_shard_split_requests_total')
+            return [IoTAgent._to_shard(req, shard, json.dumps({**body, 'entities': entities}))
+                    for shard, entities in groups.items()]
+        return [req]
+
+    @staticmethod
+    def _send_request_to_broker(req: HTTPRequest):
         """Manage sending the HTTPRequest to the Orion broker
 
+        If the entities are sharded, the request is routed to their shards,
+        see _shard_requests. If it was split, the response with the
+        highest status code is returned.
+
         Args:
             req (HTTPRequest): request to send 
 
         Returns:
             res (requests response object): Orion response
         """
-        if req.method == 'GET':
-            res = requests.get(url=req.url, headers=req.headers)
-        elif req.method == 'POST':
-            if req.headers['Content-Type'] == 'text/plain':
-                res = requests.post(url=req.url, headers=req.headers, data=req.data)
-            if req.headers['Content-Type'] == 'application/json':
-                res = requests.post(url=req.url, headers=req.headers, json=json.loads(req.data))
-        elif req.method == 'PUT':
-            if req.headers['Content-Type'] == 'text/plain':
-                res = requests.put(url=req.url, headers=req.headers, data=req.data)
-            if req.headers['Content-Type'] == 'application/json':
-                res = requests.put(url=req.url, headers=req.headers, json=json.loads(req.data))
-        elif req.method == 'DELETE':
-            res = requests.delete(url=req.url, headers=req.headers)
-        res.close()
+        parts = IoTAgent._shard_requests(req)
+        if len(parts) == 1:
+            return IoTAgent._send_to_target(parts[0])
+        return max((IoTAgent._send_to_target(part) for part in parts), key=lambda res: res.status_code)
+
+    @staticmethod
+    def _send_to_target(req: HTTPRequest):
+        """Send the HTTPRequest to the host in its URL
+
+        If ORION_COMPRESSION is set, the large request bodies are compressed,
+        see Compression.py
+
+        Args:
+            req (HTTPRequest): request to send
+
+        Returns:
+            res (requests response object): Orion response
+        """
+        headers = req.headers
+        if Tracing.CORRELATOR_HEADER not in headers:
+            headers = {**headers, **Tracing.correlation_headers()}
+        encoding = None
+        if Compression.ORION_COMPRESSION is not None and req.method in ('POST', 'PUT'):
+            body, encoding = Compression.compress_request(req.data.encode('utf-8'))
+        # the connections to each target are pooled, see Sessions.py
+        session = Sessions.get_session(req.url)
+        with Tracing.span('forward', method=req.method, url=req.url):
+            if encoding is not None:
+                # the body is sent as it is, JSON is not serialized again
+                res = session.request(req.method, url=req.url, headers={**headers, 'Content-Encoding': encoding},
+                                      data=body)
+            elif req.method == 'GET':
+                res = session.get(url=req.url, headers=headers)
+            elif req.method == 'POST':
+                if req.headers['Content-Type'] == 'text/plain':
+                    res = session.post(url=req.url, headers=headers, data=req.data)
+                if req.headers['Content-Type'] == 'application/json':
+                    res = session.post(url=req.url, headers=headers, json=json.loads(req.data))
+            elif req.method == 'PUT':
+                if req.headers['Content-Type'] == 'text/plain':
+                    res = session.put(url=req.url, headers=headers, data=req.data)
+                if req.headers['Content-Type'] == 'application/json':
+                    res = session.put(url=req.url, headers=headers, json=json.loads(req.data))
+            elif req.method == 'DELETE':
+                res = session.delete(url=req.url, headers=headers)
+            res.close()
         return res
 
-    def _prepare_request(self, post_data: str) -> HTTPRequest:
+    def _forward(self, req: HTTPRequest):
+        """Send the request through the pipeline if there is one
+
+        Args:
+            req (HTTPRequest): request to send
+
+        Returns:
+            res (requests response object): Orion response
+
+        Raises:
+            QueueFullError: if the pipeline queue is full
+            TimeoutError: if the request was not sent in QUEUE_RESULT_TIMEOUT seconds,
+                then it is cancelled
+            Deadlines.DeadlineExceededError: if the request was not sent before its deadline,
+                then it is cancelled
+            the errors of _send_request_to_broker
+        """
+        if pipeline is None:
+            return self._send_request_to_broker(req)
+        job = pipeline.submit(req, req.priority)
+        left = Deadlines.remaining()
+        try:
+            return job.result(timeout=QUEUE_RESULT_TIMEOUT if left is None else max(min(left, QUEUE_RESULT_TIMEOUT), 0))
+        except TimeoutError:
+            job.cancel()
+            if Deadlines.expired():
+                raise Deadlines.DeadlineExceededError('The request was not sent before its deadline') from None
+            raise
+
+    def _prepare_request(self, post_data: bytes, content_type: str = None) -> HTTPRequest:
         """Prepare request from post_data 
 
         Raises:
+            Codecs.UnsupportedMediaTypeError:
+                if the package decoding the content_type is not installed
             ValueError:
-                if the post_data does not contain a dictionary
+                if the post_data does not contain a dictionary,
+                or the template is unknown or the params do not fit it, see Templates.py,
+                or the priority or the timeout is invalid
             KeyError:
                 if the decoded JSON does not contain the key "method"
             Other errors according to the subfunctions used
 
         Args:
-            post_data (str): post_data in bytestring
+            post_data (bytes): post_data in bytestring
+            content_type (str): the Content-Type of the post_data, see Codecs.py.
+                Default: JSON
 
         Returns:
             req (HTTPRequest): consctucted HTTPRequest
         """
-        parsed_data = json.loads(post_data)
-        if type(parsed_data) is not dict:
-            raise ValueError(f'The sent data does not contain a json:\n{parsed_data}')
-        parsed_data = self._clean_keys(parsed_data)
-        if 'method' not in parsed_data.keys():
-            raise KeyError(f'The decoded json:{parsed_data} does not include the key: "method"')
-        parsed_data['method'] = parsed_data['method'].upper().strip()
-        self._validate_method(parsed_data)
-        self._validate_mandatory_keys(parsed_data)
-        parsed_data['url'] = parsed_data['url'].strip()
-        self._validate_url(parsed_data)
-        self._validate_headers(parsed_data)
-        headers = self._extract_headers(parsed_data)
-        if parsed_data['method'] in ('POST', 'PUT'):
-            self._validate_content_type(parsed_data, headers)
-        req = self._construct_request(parsed_data, headers)
+        with Tracing.span('parse'):
+            parsed_data = Codecs.decode(post_data, content_type)
+            if type(parsed_data) is not dict or not all(type(key) is str for key in parsed_data):
+                raise ValueError(f'The sent data does not contain a json:\n{parsed_data}')
+            parsed_data = self._clean_keys(parsed_data)
+            if 'timeout' in parsed_data:
+                Deadlines.set_timeout(parsed_data['timeout'])
+        if 'template' in parsed_data:
+            # templates are validated when they are loaded
+            with Tracing.span('render'):
+                req = Templates.render(str(parsed_data['template']), parsed_data.get('params', {}),
+                                       idempotency_key=str(parsed_data.get('idempotency_key', '')))
+                req.priority = Priority.classify(req, parsed_data.get('priority'), str(parsed_data['template']))
+            Metrics.inc('templates_rendered_total')
+            return req
+        with Tracing.span('validate'):
+            if 'method' not in parsed_data.keys():
+                raise KeyError(f'The decoded json:{parsed_data} does not include the key: "method"')
+            parsed_data['method'] = parsed_data['method'].upper().strip()
+            self._validate_method(parsed_data)
+            self._validate_mandatory_keys(parsed_data)
+            parsed_data['url'] = parsed_data['url'].strip()
+            self._validate_url(parsed_data)
+            self._validate_headers(parsed_data)
+            headers = self._extract_headers(parsed_data)
+            if parsed_data['method'] in ('POST', 'PUT'):
+                self._validate_content_type(parsed_data, headers)
+            req = self._construct_request(parsed_data, headers)
+            req.priority = Priority.classify(req, parsed_data.get('priority'))
         return req
 
     def _manage_send_request_to_broker(self, req: HTTPRequest):
@@ -382,62 +1140,529 @@ class IoTAgent(BaseHTTPRequestHandler):
 
         Args:
             req (HTTPRequest): request to send
+
+        Returns:
+            res (requests response object): Orion response, None if the request failed
         """
+        import requests
+        buffered = store_and_forward is not None and req.method != 'GET'
+        if buffered and store_and_forward.backlog() > 0:
+            # keep the order of the writes behind the buffered ones
+            self._buffer_request(req)
+            return None
         try:
-            res = self._send_request_to_broker(req)
+            res = self._forward(req)
+        except (QueueFullError, TimeoutError, Concurrency.ConcurrencyLimitError) as error:
+            # Orion is saturated, buffering the request would only add to its load
+            self._handle_overload(error)
         except requests.exceptions.InvalidSchema as error:
             self._handle_bad_request(error)
         except requests.exceptions.ConnectionError as error:
-            self._handle_connection_error(error)
+            if buffered:
+                self._buffer_request(req, error)
+            else:
+                self._handle_connection_error(error)
+        except (requests.exceptions.Timeout, Deadlines.DeadlineExceededError) as error:
+            # the request may have reached Orion, so it is not buffered
+            self._handle_timeout(error)
         else:
-            logger.info(f'Orion response:\n{res}')
-            self._set_response(res.status_code)
-            self.wfile.write(f'{res.content}'.encode('utf-8'))
+            logger.debug('Orion response: %s', res)
+            body, encoding = Compression.compress_response(f'{res.content}'.encode('utf-8'),
+                                                           self.headers.get('Accept-Encoding'))
+            self._set_response(res.status_code, encoding)
+            self.wfile.write(body)
+            return res
+        return None
 
-    def do_GET(self):
-        """HTTP GET functionality, provide healthcheck"""
-        logger.info("GET request,\nPath: %s\nHeaders:\n%s\n", str(self.path), str(self.headers))
-        self._set_response(200)
-        self.wfile.write(f'iotagent-http running.\nPython version: {sys.version}\nvalidators version: {validators.__version__}'.encode('utf-8'))
+    def _replay_response(self, response: tuple):
+        """Return the stored response of a duplicate request
 
-    def do_POST(self):
-        """ Manage HTTP POST functionality 
+        Args:
+            response (tuple): (status_code, body) of the first request
+        """
+        status_code, body = response
+        logger.debug('Duplicate request, returning the stored response')
+        Metrics.inc('idempotent_replays_total')
+        self.send_response(status_code)
+        self.send_header("Content-type", "text/plain")
+        self.send_header("Idempotent-Replayed", "true")
+        self._send_correlation_header()
+        self.end_headers()
+        self.wfile.write(body)
 
-        Recieve HTTP requests from the IoT devices using HTTP POST
-        The requests are then parsed, decoded, sent to the Orion broker,
-        then the response is sent back to the IoT agent"""
-        # Get the size of data
-        content_length = int(self.headers['Content-Length'])
-        # Gets the data itself
-        post_data = self.rfile.read(content_length)
-        logger.info('POST request,\nPath: %s\nHeaders:\n%s\n\nBody:\n%s\n',
-                    str(self.path), str(self.headers), post_data.decode('utf-8'))
+    def _transform_and_send(self, req: HTTPRequest) -> tuple:
+        """Apply the plugin and send the request to the broker
+
+        Args:
+            req (HTTPRequest): the decoded request
+
+        Returns:
+            (the request sent to Orion, the Orion response, None if the request failed)
+        """
+        try:
+            req = self._apply_plugin_if_present(req)
+        except Deadlines.DeadlineExceededError as error:
+            self._handle_timeout(error)
+            return req, None
+        return req, self._manage_send_request_to_broker(req)
+
+    def _process_request(self, req: HTTPRequest) -> HTTPRequest:
+        """Apply the plugin and send the request, once per idempotency key
+
+        Args:
+            req (HTTPRequest): the decoded request
+
+        Returns:
+            req (HTTPRequest): the request sent to Orion
+        """
+        if not req.idempotency_key:
+            req, _ = self._transform_and_send(req)
+            return req
+        key = self._idempotency_key(req)
+        stored = idempotency_store.begin(key)
+        if stored is not None:
+            self._replay_response(stored)
+            return req
+        res = None
+        self._buffered_response = None
+        try:
+            req, res = self._transform_and_send(req)
+        finally:
+            # server errors are not stored, so that the retries can succeed
+            if res is not None and res.status_code < 500:
+                idempotency_store.complete(key, (res.status_code, f'{res.content}'.encode('utf-8')))
+            elif self._buffered_response is not None:
+                # a retry during the outage must not be buffered and applied twice
+                idempotency_store.complete(key, self._buffered_response)
+            else:
+                idempotency_store.abort(key)
+        return req
+
+    @staticmethod
+    def _idempotency_key(req: HTTPRequest) -> tuple:
+        """Return the key of a request in the idempotency store"""
+        # the same key of two tenants belongs to different requests
+        return (req.idempotency_key, Tenancy.tenant_of(req.headers), req.method, req.url)
+
+    def _aggregate(self, req: HTTPRequest) -> bool:
+        """Add a reading to its aggregation window, once per idempotency key
+
+        A retried reading is answered with the stored response,
+        so it is not counted twice in the window.
+
+        Args:
+            req (HTTPRequest): the decoded request
+
+        Returns:
+            True if the IoT device got its response, False if the request is not aggregated
+        """
+        key = self._idempotency_key(req) if req.idempotency_key else None
+        if key is not None:
+            stored = idempotency_store.begin(key)
+            if stored is not None:
+                self._replay_response(stored)
+                return True
+        aggregated = False
+        try:
+            aggregated = aggregator.add(req)
+        finally:
+            if key is not None and aggregated:
+                idempotency_store.complete(key, (202, AGGREGATED_RESPONSE))
+            elif key is not None:
+                # the request is forwarded, _process_request stores its response
+                idempotency_store.abort(key)
+        if aggregated:
+            self._set_response(202)
+            self.wfile.write(AGGREGATED_RESPONSE)
+        return aggregated
+
+    def _handle_post_data(self, post_data: bytes, content_type: str = None) -> HTTPRequest:
+        """Decode, transform and send a request, and respond to the IoT device
+
+        Args:
+            post_data (bytes): the request of the IoT device
+            content_type (str): its encoding, see Codecs.py
 
+        Returns:
+            req (HTTPRequest): the request sent to Orion, None if it could not be decoded
+        """
         try:
-            req = self._prepare_request(post_data)
+            req = self._prepare_request(post_data, content_type)
+        except Codecs.UnsupportedMediaTypeError as error:
+            self._handle_unsupported_media_type(error)
         except (ValueError,
                 KeyError,
                 IndexError,
+                TypeError,
                 NotImplementedError,
-                validators.ValidationFailure,
-                json.JSONDecodeError,
-                requests.exceptions.InvalidSchema) as error:
+                json.JSONDecodeError) as error:
             self._handle_bad_request(error)
         else:
-            logger.info(f'Request decoded:\n{req}')
-            req = self._apply_plugin_if_present(req)
-            self._manage_send_request_to_broker(req)
+            logger.debug('Request decoded: %s', req)
+            self._apply_tenant_headers(req)
+            if aggregator is not None and self._aggregate(req):
+                return req
+            return self._process_request(req)
+        return None
+
+    def _apply_tenant_headers(self, req: HTTPRequest):
+        """Take the tenant from the HTTP headers of the device
 
+        A device may address its tenant either in the headers of the
+        wrapped request or in the headers of its own HTTP request.
+        The headers of the wrapped request take precedence.
 
-def run(server_class=HTTPServer, handler_class=IoTAgent):
+        Args:
+            req (HTTPRequest): the decoded request, updated in place
+        """
+        if Tenancy.has_tenant_headers(req.headers):
+            return
+        for name in (Tenancy.SERVICE_HEADER, Tenancy.SERVICE_PATH_HEADER):
+            value = self.headers.get(name)
+            if value is not None:
+                req.headers[name] = value
+
+    def _is_admin(self) -> bool:
+        """Check the admin token of the request
+
+        Returns:
+            True if admin endpoints are enabled and the
+            X-Admin-Token header contains the ADMIN_TOKEN
+        """
+        if ADMIN_TOKEN is None:
+            return False
+        token = self.headers.get('X-Admin-Token', '')
+        return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+    def _handle_profile(self, query: dict):
+        """Capture a profile of the running agent and return it
+
+        Query parameters:
+            seconds: the length of the capture. Default: PROFILE_SECONDS
+            format: "collapsed" (default) for flame graph tools or "text"
+
+        Args:
+            query (dict): the parsed query string
+        """
+        try:
+            seconds = float(query.get('seconds', [PROFILE_SECONDS])[0])
+        except ValueError:
+            self._set_response(400)
+            self.wfile.write(b'seconds must be a number')
+            return
+        try:
+            stacks = Profiler.sample(seconds)
+        except Profiler.ProfilerBusyError as error:
+            self._set_response(409)
+            self.wfile.write(f'{error}'.encode('utf-8'))
+            return
+        if query.get('format', ['collapsed'])[0] == 'text':
+            body = Profiler.top(stacks)
+        else:
+            body = Profiler.collapsed(stacks)
+        self._set_response(200)
+        self.wfile.write(body.encode('utf-8'))
+
+    def _handle_shards(self, query: dict, body: bytes = None):
+        """Show the shards, or move an entity to another shard
+
+        GET returns the shards, the shards of the entity types and
+        the pinned entities as JSON, or the shard of the entity
+        in the "entity" query parameter.
+        POST with {"entity": <id>, "shard": "host:port"} pins the entity
+        to the shard, {"entity": <id>, "shard": null} removes the pin.
+        Only the cached entries of the moved entity are dropped,
+        its data must be migrated to the new shard separately.
+
+        Args:
+            query (dict): the parsed query string
+            body (bytes): the body of a POST request, None for GET
+        """
+        if body is None:
+            if 'entity' in query:
+                entity_id = query['entity'][0]
+                result = {'entity': entity_id, 'shard': Sharding.shard_for(entity_id)}
+            else:
+                router = Sharding.router
+                result = router.to_dict() if router is not None else {'shards': []}
+            self._set_response(200)
+            self.wfile.write(json.dumps(result).encode('utf-8'))
+            return
+        try:
+            move = json.loads(body)
+            if not isinstance(move, dict) or not isinstance(move.get('entity'), str):
+                raise ValueError('The body must be {"entity": <id>, "shard": "host:port" or null}')
+            Sharding.pin(move['entity'], move.get('shard'))
+        except ValueError as error:
+            self._set_response(400)
+            self.wfile.write(f'{error}'.encode('utf-8'))
+            return
+        except RuntimeError as error:
+            self._set_response(409)
+            self.wfile.write(f'{error}'.encode('utf-8'))
+            return
+        except OSError as error:
+            logger.error(f'Failed to save the shard pins: {error}')
+            self._set_response(500)
+            self.wfile.write(f'The pin was not saved: {error}'.encode('utf-8'))
+            return
+        self._set_response(200)
+        self.wfile.write(json.dumps({'entity': move['entity'], 'shard': Sharding.shard_for(move['entity'])}).encode('utf-8'))
+
+    def _handle_reload(self):
+        """Reload the configuration, see Config.py
+
+        Responds with the changed settings as JSON, or with 400
+        if the new configuration is invalid and the old one stays in effect.
+        """
+        try:
+            result = reload_config()
+        except (OSError, ValueError) as error:
+            self._set_response(400)
+            self.wfile.write(f'Configuration reload failed, the old configuration stays in effect:\n{error}'.encode('utf-8'))
+            return
+        self._set_response(200)
+        self.wfile.write(json.dumps(result).encode('utf-8'))
+
+    def _handle_admin(self, path: str, query: dict, body: bytes = None):
+        """Route the admin endpoints
+
+        Args:
+            path (str): the path of the request
+            query (dict): the parsed query string
+            body (bytes): the body of a POST request, None for GET
+        """
+        if not self._is_admin():
+            self._set_response(403)
+            self.wfile.write(b'Forbidden')
+            return
+        if path == '/admin/profile' and body is None:
+            self._handle_profile(query)
+        elif path == '/admin/shards':
+            self._handle_shards(query, body)
+        elif path == '/admin/reload' and body is not None:
+            self._handle_reload()
+        else:
+            self._set_response(404)
+            self.wfile.write(f'Unknown admin endpoint: {path}'.encode('utf-8'))
+
+    def do_GET(self):
+        """HTTP GET functionality, provide healthcheck, metrics and admin endpoints"""
+        start = time.perf_counter()
+        logger.debug("GET request, path: %s, headers: %s", self.path, dict(self.headers))
+        try:
+            url = urlsplit(self.path)
+            if url.path.startswith('/admin/'):
+                self._handle_admin(url.path, parse_qs(url.query))
+                return
+            if url.path in ('/live', '/ready'):
+                ok, checks = liveness() if url.path == '/live' else readiness()
+                self._set_response(200 if ok else 503)
+                self.wfile.write(json.dumps(checks).encode('utf-8'))
+                return
+            if self.path == "/metrics":
+                self._set_response(200)
+                self.wfile.write(Metrics.render().encode('utf-8'))
+                return
+            import validators
+            self._set_response(200)
+            self.wfile.write(f'iotagent-http running.\nPython version: {sys.version}\nvalidators version: {validators.__version__}'.encode('utf-8'))
+        finally:
+            self._log_access(start)
+
+    def do_POST(self):
+        """ Manage HTTP POST functionality 
+
+        Recieve HTTP requests from the IoT devices using HTTP POST
+        The requests are then parsed, decoded, sent to the Orion broker,
+        then the response is sent back to the IoT agent"""
+        start = time.perf_counter()
+        trace = Tracing.start_trace(self.headers.get(Tracing.CORRELATOR_HEADER))
+        Deadlines.start()
+        req = None
+        try:
+            # Get the size of data
+            content_length = int(self.headers['Content-Length'])
+            # Gets the data itself
+            post_data = self.rfile.read(content_length)
+            logger.debug('POST request, path: %s, headers: %s, body: %r',
+                         self.path, dict(self.headers), post_data)
+            url = urlsplit(self.path)
+            if url.path.startswith('/admin/'):
+                self._handle_admin(url.path, parse_qs(url.query), post_data)
+                return
+            if capture is not None:
+                capture.record(post_data, self.headers)
+
+            req = self._handle_post_data(post_data, self.headers.get('Content-Type'))
+        finally:
+            trace.finish(client=self.client_address[0], path=self.path,
+                         status=getattr(self, '_status_code', 0))
+            self._log_access(start, req)
+            Tracing.activate(None)
+            Deadlines.activate(None)
+
+
+class _StreamMessage(IoTAgent):
+    """Handles a request of the stream listener like a POST request, see Stream.py
+
+    There is no HTTP connection: the response is discarded,
+    only its status code is kept for the ack.
+    """
+
+    def __init__(self):
+        self.headers = {}
+        self.wfile = io.BytesIO()
+        self._status_code = 0
+
+    def send_response(self, code: int, message: str = None):
+        self._status_code = code
+
+    def send_header(self, keyword: str, value: str):
+        pass
+
+    def end_headers(self):
+        pass
+
+
+def send_aggregate(req: HTTPRequest):
+    """Send the aggregated update of a window like a decoded request, see Aggregation.py
+
+    Args:
+        req (HTTPRequest): the aggregated update
+    """
+    message = _StreamMessage()
+    trace = Tracing.start_trace()
+    Deadlines.start()
+    try:
+        message._process_request(req)
+    finally:
+        trace.finish(client='aggregation', status=message._status_code)
+        Tracing.activate(None)
+        Deadlines.activate(None)
+    if message._status_code >= 400:
+        logger.warning(f'The aggregated update of {req.url} failed with status code {message._status_code}')
+
+
+def process_stream_message(payload: bytes, content_type: str) -> tuple:
+    """Process a request of the stream listener
+
+    Args:
+        payload (bytes): the request of the IoT device
+        content_type (str): its encoding, see Codecs.py
+
+    Returns:
+        (the status code of the response, the idempotency key of the request)
+    """
+    message = _StreamMessage()
+    trace = Tracing.start_trace()
+    Deadlines.start()
+    req = None
+    try:
+        req = message._handle_post_data(payload, content_type)
+    finally:
+        trace.finish(client='stream', status=message._status_code)
+        Tracing.activate(None)
+        Deadlines.activate(None)
+    return message._status_code, req.idempotency_key if req is not None else ''
+
+
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    """A ThreadingHTTPServer with at most max_threads handler threads
+
+    If every thread is busy, the server stops accepting connections,
+    the new connections wait in the listen backlog. So a stalled Orion
+    cannot pile up handler threads.
+
+    Args:
+        server_address (tuple): the (host, port) to listen on
+        handler_class: the request handler class
+        max_threads (int): the maximum number of handler threads
+    """
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_threads: int = HANDLER_THREADS):
+        self._slots = threading.BoundedSemaphore(max_threads)
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+
+def run(server_class=BoundedThreadingHTTPServer, handler_class=IoTAgent):
+    global pipeline, store_and_forward, orion_probe, stream_listener, aggregator, transform_pool, capture
+    if SENDER_THREADS > 0:
+        pipeline = Pipeline(send=handler_class._send_request_to_broker,
+                            queue_size=QUEUE_SIZE,
+                            senders=SENDER_THREADS,
+                            full_policy=QUEUE_FULL_POLICY,
+                            put_timeout=QUEUE_PUT_TIMEOUT,
+                            high_senders=HIGH_PRIORITY_SENDERS,
+                            high_queue_size=HIGH_PRIORITY_QUEUE_SIZE)
+        pipeline.start()
+        logger.info(f'Pipeline started: {SENDER_THREADS} senders, queue size: {QUEUE_SIZE}, queue-full policy: {QUEUE_FULL_POLICY}, '
+                    f'high priority senders: {HIGH_PRIORITY_SENDERS}')
+    if BUFFER_DIR is not None:
+        log = SegmentLog(BUFFER_DIR, segment_bytes=BUFFER_SEGMENT_BYTES, fsync=BUFFER_FSYNC, max_bytes=BUFFER_MAX_BYTES)
+        store_and_forward = StoreAndForward(log,
+                                            send=handler_class._send_request_to_broker,
+                                            rate=BUFFER_REPLAY_RATE,
+                                            retry_interval=BUFFER_RETRY_INTERVAL)
+        store_and_forward.start()
+        logger.info(f'Store-and-forward buffer in {BUFFER_DIR}, {len(log)} buffered requests')
+    if Capture.CAPTURE_DIR is not None:
+        capture = Capture.Capture(Capture.CAPTURE_DIR)
+        logger.info(f'Capturing the requests in {Capture.CAPTURE_DIR}, at most {Capture.CAPTURE_MAX_BYTES} bytes')
+    if TransformPool.TRANSFORM_PROCESSES > 0 and USE_PLUGIN:
+        transform_pool = TransformPool.TransformPool(TransformPool.TRANSFORM_PROCESSES)
+        logger.info(f'The transforms run in {TransformPool.TRANSFORM_PROCESSES} worker processes')
+    if Aggregation.AGGREGATE_ATTRIBUTES:
+        aggregator = Aggregation.Aggregator(Aggregation.AGGREGATE_ATTRIBUTES, send=send_aggregate)
+        aggregator.start()
+        logger.info(f'Aggregated attributes: {Aggregation.AGGREGATE_ATTRIBUTES}')
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <pid> writes a profile of PROFILE_SECONDS into PROFILE_DIR
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+            target=Profiler.capture_to_file, args=(PROFILE_SECONDS, PROFILE_DIR, logger), daemon=True).start())
+    if hasattr(signal, 'SIGHUP'):
+        # kill -HUP <pid> reloads the configuration, see Config.py
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+            target=_reload_on_signal, name='config-reload', daemon=True).start())
     server_address = ('', PORT)
     http_service = server_class(server_address, handler_class)
     logger.info(f'Starting PLC IoT agent on port {PORT}...')
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    orion_probe = Health.OrionProbe(_probe_targets)
+    orion_probe.start()
+    if Stream.STREAM_UDP_PORT is not None or Stream.STREAM_TCP_PORT is not None:
+        stream_listener = Stream.StreamListener(process_stream_message)
+        stream_listener.start()
     try:
         http_service.serve_forever()
     except KeyboardInterrupt:
         pass
     http_service.server_close()
+    if stream_listener is not None:
+        stream_listener.close()
+    if aggregator is not None:
+        aggregator.flush(everything=True)
+    if store_and_forward is not None:
+        store_and_forward.log.close()
+    if transform_pool is not None:
+        transform_pool.close()
+    if capture is not None:
+        capture.close()
     logger.info('KeyboardInterrupt. Stopping PLC IoT agent...')
 
 
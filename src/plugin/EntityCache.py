@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""The EntityCache class
+
+A small thread-safe cache of Orion entities in keyValues representation.
+The entries expire after a time-to-live and the least recently used
+entries are evicted if the cache is full.
+"""
+# Standard Library imports
+from collections import OrderedDict
+import threading
+import time
+
+
+class EntityCache:
+    """A thread-safe TTL and LRU cache of Orion entities
+
+    The keys are the entity ids, or any hashable key identifying
+    the entity, for example (tenant, entity id). The values are the attributes
+    of the entity in keyValues representation. An entry may contain
+    only some attributes of the entity if the entity was downloaded
+    with an attribute projection. The entry remembers which attributes
+    were requested, so an attribute the entity does not have
+    is not downloaded again and again.
+
+    Args:
+        ttl (float): the number of seconds an entry is valid for.
+            A ttl of 0 disables the cache.
+        max_size (int): the maximum number of cached entities
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, entity_id: str, attrs: list):
+        """Get the cached attributes of an entity
+
+        Args:
+            entity_id (str): the Orion entity id
+            attrs (list): the attributes that must be present in the entry
+
+        Returns:
+            the cached attributes (dict) if the entry is valid
+            and contains all attrs, None otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(entity_id)
+            if entry is None:
+                return None
+            expires_at, values, requested = entry
+            if expires_at < time.monotonic():
+                del self._entries[entity_id]
+                return None
+            if not requested.issuperset(attrs):
+                return None
+            self._entries.move_to_end(entity_id)
+            return values
+
+    def put(self, entity_id: str, values: dict, attrs: list = None):
+        """Cache the attributes of an entity
+
+        If there is a valid entry for the entity,
+        the new attributes are merged into it.
+
+        Args:
+            entity_id (str): the Orion entity id
+            values (dict): attributes in keyValues representation
+            attrs (list): the attributes that were requested.
+                Default: the keys of values
+        """
+        if self.ttl <= 0:
+            return
+        requested = frozenset(values if attrs is None else attrs)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(entity_id)
+            if entry is not None and entry[0] >= now:
+                # keep the expiry of the older attributes
+                expires_at, old_values, old_requested = entry
+                values = {**old_values, **values}
+                requested = requested | old_requested
+            else:
+                expires_at = now + self.ttl
+            self._entries[entity_id] = (expires_at, values, requested)
+            self._entries.move_to_end(entity_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, entity_id: str):
+        """Remove an entity from the cache
+
+        Args:
+            entity_id (str): the Orion entity id
+        """
+        with self._lock:
+            self._entries.pop(entity_id, None)
+
+    def invalidate_where(self, predicate) -> int:
+        """Remove the entities whose key matches a condition
+
+        Args:
+            predicate: a function that takes a key and returns True to remove it
+
+        Returns:
+            the number of removed entities
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def resize(self, ttl: float, max_size: int):
+        """Change the time-to-live and the maximum size, keeping the entries
+
+        The entries keep their expiry, the least recently used
+        entries are evicted if the cache is too large.
+        A ttl of 0 disables the cache and removes every entry.
+
+        Args:
+            ttl (float): the number of seconds a new entry is valid for
+            max_size (int): the maximum number of cached entities
+        """
+        with self._lock:
+            self.ttl = ttl
+            self.max_size = max_size
+            if ttl <= 0:
+                self._entries.clear()
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def keys(self) -> list:
+        """Return the keys of the cached entities"""
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        """Remove all entities from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -4,15 +4,43 @@ A set of modules for interacting with the Orion broker
 
 The Orion host and port are read from the environment variables
 
+Every request is recorded as a span of the current trace and carries
+its correlation id in the Fiware-Correlator header, see Tracing.py
+
+The functions take an optional tenant, the (service, service path)
+tuple of Tenancy.py. The requests of a tenant carry its Fiware-Service
+and Fiware-ServicePath headers and are sent to the Orion of its service
+(ORION_TENANTS), through the pooled connections of Sessions.py.
+The cached entities are partitioned by tenant.
+
+If the entities are sharded over several Orion instances (Sharding.py),
+the requests about an entity go to its shard, the batch queries and
+updates are split by shard and the listings are merged from all shards.
+When entities move to another shard, only their cache entries are dropped.
+
 Environment variables:
     ORION_HOST: the URL of the Orion broker
     ORION_PORT: the port of the Orion broker
+    ORION_PAGE_SIZE: the number of entities requested per page
+        when listing entities. Default: 1000 (Orion's maximum)
+    ORION_CACHE_TTL: the number of seconds the entities looked up
+        by the plugin are cached for. 0 disables the cache. Default: 5
+    ORION_CACHE_SIZE: the maximum number of cached entities. Default: 10000
+    ORION_TENANTS: the Orion instances of the services that are not
+        served by ORION_HOST, for example "line1=orion-a:1026,line2=orion-b".
+        Default: every service is served by ORION_HOST
+
+All of them are applied when the configuration is reloaded, see
+Config.py. The cache keeps its entries, except those of the tenants
+whose Orion changed.
 
 Raises:
-    RuntimeError: if the Orion_HOST is not set
+    RuntimeError: if the Orion_HOST is not set or ORION_TENANTS is invalid
 """
 # Standard Library imports
-import os
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+import json
 
 # PyPI packages
 import requests
@@ -20,15 +48,22 @@ import requests
 # Custom imports
 # from modules.log_it import log_it
 from Logger import getLogger
+import Config
+import Deadlines
+import Sessions
+import Sharding
+import Tenancy
+import Tracing
+from .EntityCache import EntityCache
 
 logger_Orion = getLogger(__name__)
 
-# environment variables
-ORION_HOST = os.environ.get("ORION_HOST")
+# environment variables, see Config.py
+ORION_HOST = Config.get("ORION_HOST")
 if ORION_HOST is None:
     raise RuntimeError("Critical: ORION_HOST environment variable is not set")
 
-ORION_PORT = os.environ.get("ORION_PORT")
+ORION_PORT = Config.get("ORION_PORT")
 if ORION_PORT is None:
     default_port = 1026
     logger_Orion.warning(
@@ -37,11 +72,65 @@ if ORION_PORT is None:
     ORION_PORT = default_port
 
 
-def getRequest(url: str):
+def _pageSize(config: Config.Config) -> int:
+    """Return the ORION_PAGE_SIZE of a configuration"""
+    page_size = config.get_int("ORION_PAGE_SIZE", 1000)
+    return page_size if 0 < page_size <= 1000 else 1000
+
+
+ORION_PAGE_SIZE = _pageSize(Config.current())
+ORION_CACHE_TTL = Config.current().get_float("ORION_CACHE_TTL", 5.0)
+ORION_CACHE_SIZE = Config.current().get_int("ORION_CACHE_SIZE", 10000)
+
+
+# the size of the chunks read from a streamed response
+CHUNK_SIZE = 64 * 1024
+
+# the maximum number of batch queries sent at the same time
+MAX_CONCURRENT_QUERIES = 4
+
+# the entities looked up by the plugin, shared by all lookups,
+# keyed by (tenant, entity id)
+cache = EntityCache(ttl=ORION_CACHE_TTL, max_size=ORION_CACHE_SIZE)
+
+
+def _parseTenants(value: str) -> dict:
+    """Parse the ORION_TENANTS environment variable
+
+    Args:
+        value (str): "service=host:port,service=host:port", the port defaults to 1026
+
+    Returns:
+        a dict of (host, port) by lowercase service name
+
+    Raises:
+        RuntimeError: if an entry is invalid
+    """
+    targets = {}
+    for item in value.split(","):
+        service, separator, address = item.partition("=")
+        host, _, port = address.strip().partition(":")
+        if not separator or not service.strip() or not host:
+            raise RuntimeError(f"Critical: invalid ORION_TENANTS entry: {item}, use service=host:port")
+        try:
+            targets[service.strip().lower()] = (host, int(port) if port else 1026)
+        except ValueError as error:
+            raise RuntimeError(f"Critical: invalid port in ORION_TENANTS entry: {item}") from error
+    return targets
+
+
+ORION_TENANTS = Config.get("ORION_TENANTS")
+ORION_TENANTS = _parseTenants(ORION_TENANTS) if ORION_TENANTS else {}
+
+
+def getRequest(url: str, params: dict = None, headers: dict = None, tenant: tuple = None):
     """Send a GET request to Orion
 
     Args:
         url (str): any Orion that is suitable for GET requests
+        params (dict): query parameters. Default: no parameters
+        headers (dict): request headers. Default: no extra headers
+        tenant (tuple): the (service, service path) of the request. Default: the default tenant
 
     Returns:
         the response status code and the json
@@ -51,38 +140,401 @@ def getRequest(url: str):
         ValueError: if the json parsing fails
     """
     try:
-        response = requests.get(url)
-        response.close()
+        with Tracing.span("orion.get", url=url):
+            response = Sessions.get_session(url).get(url, params=params, headers=_headers(headers, tenant))
+            response.close()
     except Exception as error:
         raise RuntimeError(f"Get request failed to URL: {url}") from error
 
     else:
         try:
-            response.json()
+            json_ = response.json()
         except requests.exceptions.JSONDecodeError as error:
             raise ValueError(
                 f"The JSON could not be decoded after GET request to {url}. Response:\n{response}"
             ) from error
-        return response.status_code, response.json()
+        return response.status_code, json_
+
+
+def _headers(headers: dict = None, tenant: tuple = None) -> dict:
+    """Add the correlation id of the current trace and the tenant to the headers
+
+    Args:
+        headers (dict): request headers. Default: no extra headers
+        tenant (tuple): the (service, service path) of the request. Default: the default tenant
+
+    Returns:
+        the headers with the Fiware-Correlator header if there is a current trace
+        and the Fiware-Service and Fiware-ServicePath headers of the tenant
+    """
+    common = {**Tracing.correlation_headers(), **Tenancy.tenant_headers(tenant)}
+    if headers is None:
+        return common
+    return {**common, **headers}
+
+
+def _isSharded(tenant: tuple = None) -> bool:
+    """Check if the entities of a tenant are sharded
+
+    The services with their own Orion in ORION_TENANTS are not sharded.
+    """
+    return Sharding.enabled() and (tenant is None or tenant[0] not in ORION_TENANTS)
+
+
+def _splitAddress(address: str):
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def target(tenant: tuple = None, entity_id: str = None):
+    """Get the Orion instance of a tenant or of an entity
+
+    Args:
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
+        entity_id (str): the entity, if the entities are sharded,
+            its shard is returned. Default: no entity
+
+    Returns:
+        (host, port) of the Orion serving the entity or the service of the tenant
+    """
+    if tenant is not None and tenant[0] in ORION_TENANTS:
+        return ORION_TENANTS[tenant[0]]
+    if entity_id is not None:
+        shard = Sharding.shard_for(entity_id)
+        if shard is not None:
+            return _splitAddress(shard)
+    return ORION_HOST, ORION_PORT
+
+
+def _allTargets(tenant: tuple = None, entity_type: str = None) -> list:
+    """Get every Orion instance holding entities of a tenant
+
+    Args:
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
+        entity_type (str): only the shards of this entity type. Default: all types
+
+    Returns:
+        a list of (host, port)
+    """
+    if not _isSharded(tenant):
+        return [target(tenant)]
+    router = Sharding.router
+    if entity_type is not None and entity_type in router.types:
+        addresses = [router.types[entity_type]]
+    else:
+        addresses = list(dict.fromkeys(router.shards + list(router.types.values()) + list(router.pins.values())))
+    return [_splitAddress(address) for address in addresses]
+
+
+def _groupByTarget(object_ids: list, tenant: tuple = None) -> dict:
+    """Group entity ids by their Orion instance
+
+    Returns:
+        a dict of the lists of ids by (host, port)
+    """
+    if not _isSharded(tenant):
+        return {target(tenant): list(object_ids)} if object_ids else {}
+    groups = {}
+    for object_id in object_ids:
+        groups.setdefault(target(tenant, object_id), []).append(object_id)
+    return groups
+
+
+def baseUrl(tenant: tuple = None, entity_id: str = None) -> str:
+    """Get the base URL of the Orion instance of a tenant or of an entity
+
+    Args:
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
+        entity_id (str): the entity, see target. Default: no entity
+
+    Returns:
+        "http://host:port" of the Orion serving the entity or the service of the tenant
+    """
+    host, port = target(tenant, entity_id)
+    return f"http://{host}:{port}"
+
+
+def _url(path: str, host: str = None, port: int = None, tenant: tuple = None, entity_id: str = None) -> str:
+    """Construct an Orion URL, the host and port default to the Orion of the entity or the tenant"""
+    default_host, default_port = target(tenant, entity_id)
+    return f"http://{host or default_host}:{port or default_port}{path}"
+
+
+def _onShardMove(moved):
+    """Drop the cached entities that moved to another shard
+
+    Args:
+        moved: a function that takes an entity id and returns True if it moved
+    """
+    dropped = cache.invalidate_where(lambda key: moved(key[1]))
+    logger_Orion.info(f"Dropped {dropped} cached entities after a shard move")
+
+
+Sharding.add_listener(_onShardMove)
+
+
+def _serviceTarget(service: str):
+    """Get the Orion of a service, None if its entities are sharded"""
+    tenant = (service, "/")
+    return None if _isSharded(tenant) else target(tenant)
+
+
+def _prepareReload(config: Config.Config):
+    """Check the Orion settings of a reloaded configuration, see Config.add_listener
+
+    Raises:
+        ValueError: if ORION_HOST is not set or ORION_TENANTS is invalid
+    """
+    host = config.get("ORION_HOST")
+    if host is None:
+        raise ValueError("ORION_HOST is not set")
+    port = config.get("ORION_PORT", 1026)
+    try:
+        tenants = _parseTenants(config.get("ORION_TENANTS")) if config.get("ORION_TENANTS") else {}
+    except RuntimeError as error:
+        raise ValueError(str(error)) from error
+    page_size = _pageSize(config)
+    cache_ttl = config.get_float("ORION_CACHE_TTL", 5.0)
+    cache_size = config.get_int("ORION_CACHE_SIZE", 10000)
+
+    def commit():
+        global ORION_HOST, ORION_PORT, ORION_TENANTS, ORION_PAGE_SIZE
+        services = {key[0][0] for key in cache.keys()}
+        old = {service: _serviceTarget(service) for service in services}
+        ORION_HOST, ORION_PORT, ORION_TENANTS, ORION_PAGE_SIZE = host, port, tenants, page_size
+        cache.resize(cache_ttl, cache_size)
+        moved = {service for service in services if _serviceTarget(service) != old[service]}
+        if moved:
+            dropped = cache.invalidate_where(lambda key: key[0][0] in moved)
+            logger_Orion.info(f"Dropped {dropped} cached entities of the tenants served by another Orion")
+
+    return commit
+
+
+Config.add_listener(("ORION_HOST", "ORION_PORT", "ORION_TENANTS", "ORION_PAGE_SIZE",
+                     "ORION_CACHE_TTL", "ORION_CACHE_SIZE"), _prepareReload)
 
 
-def get(object_id: str, host: str=ORION_HOST, port: int =ORION_PORT):
+def _options(representation: str = None, *extra: str):
+    """Construct the options query parameter
+
+    Args:
+        representation (str): None for the normalized representation,
+            "keyValues" or "values"
+        extra (str): other options, for example "count"
+
+    Returns:
+        the value of the options query parameter or None if it is empty
+
+    Raises:
+        ValueError: if the representation is unknown
+    """
+    if representation not in (None, "normalized", "keyValues", "values"):
+        raise ValueError(f"Unknown NGSIv2 representation: {representation}")
+    options = list(extra)
+    if representation in ("keyValues", "values"):
+        options.append(representation)
+    return ",".join(options) if options else None
+
+
+def _iterJsonArray(response):
+    """Parse the JSON array of a streamed response element by element
+
+    The response body is read in chunks and each element of the array
+    is yielded as soon as it is complete, so only one element
+    and one chunk are held in memory at a time.
+
+    Args:
+        response: a requests response object opened with stream=True
+
+    Yields:
+        the decoded elements of the JSON array
+
+    Raises:
+        ValueError: if the response body is not a JSON array,
+            for example if a comma is missing or stray
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+    buffer = ""
+    index = 0
+    exhausted = False
+    started = False
+    # an element was read, a comma or the closing bracket must follow
+    after_element = False
+    # a comma was read, an element must follow
+    after_comma = False
+
+    def read_more():
+        nonlocal buffer, index, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer = buffer[index:] + utf8.decode(b"", final=True)
+        else:
+            buffer = buffer[index:] + utf8.decode(chunk)
+        index = 0
+
+    while True:
+        while index < len(buffer) and buffer[index] in " \t\r\n":
+            index += 1
+        if index == len(buffer):
+            if exhausted:
+                raise ValueError("The response ended before the JSON array was closed")
+            read_more()
+            continue
+        if not started:
+            if buffer[index] != "[":
+                raise ValueError(f"The response does not contain a JSON array: {buffer[:100]}")
+            started = True
+            index += 1
+            continue
+        if buffer[index] == "]" and not after_comma:
+            return
+        if after_element:
+            if buffer[index] != ",":
+                raise ValueError(f"Expected a comma in the JSON array: {buffer[index:index + 100]}")
+            after_element, after_comma = False, True
+            index += 1
+            continue
+        if buffer[index] in ",]":
+            raise ValueError(f"Expected an element in the JSON array: {buffer[index:index + 100]}")
+        try:
+            element, end = decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError as error:
+            if exhausted:
+                raise ValueError("The JSON array in the response could not be decoded") from error
+            read_more()
+            continue
+        if end == len(buffer) and not exhausted:
+            # a number may continue in the next chunk
+            read_more()
+            continue
+        index = end
+        after_element, after_comma = True, False
+        yield element
+
+
+def iterEntities(
+    entity_type: str = None,
+    id_pattern: str = None,
+    q: str = None,
+    attrs: list = None,
+    representation: str = None,
+    page_size: int = None,
+    host: str = None,
+    port: int = None,
+    tenant: tuple = None,
+):
+    """Iterate over the entities in Orion matching the filters
+
+    The entities are requested page by page using limit and offset,
+    until the Fiware-Total-Count header (options=count) is reached
+    or a page is short. If the header is missing, the pages are requested
+    until a short or empty one.
+    Each page is streamed and parsed incrementally,
+    so the memory usage does not depend on the number of entities.
+    If the entities are sharded, the shards are listed one after the other.
+
+    Args:
+        entity_type (str): only list entities of this type
+        id_pattern (str): only list entities whose id matches this regex
+        q (str): an NGSIv2 simple query, for example "refJob==urn:ngsi_ld:Job:1"
+        attrs (list): only transfer these attributes. Default: all attributes
+        representation (str): None for the normalized representation,
+            "keyValues" or "values"
+        page_size (int): the number of entities per request. Default: ORION_PAGE_SIZE
+        host (str): Orion host. Default: the Orion of the tenant
+        port (int): Orion port. Default: the Orion of the tenant
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
+
+    Yields:
+        the entities one by one
+
+    Raises:
+        RuntimeError: if a request fails or its status code is not 200
+        ValueError: if a page cannot be decoded
+    """
+    params = {"limit": page_size or ORION_PAGE_SIZE}
+    if entity_type is not None:
+        params["type"] = entity_type
+    if id_pattern is not None:
+        params["idPattern"] = id_pattern
+    if q is not None:
+        params["q"] = q
+    if attrs is not None:
+        params["attrs"] = ",".join(attrs)
+    params["options"] = _options(representation, "count")
+    if host is not None:
+        targets = [(host, port or ORION_PORT)]
+    else:
+        targets = _allTargets(tenant, entity_type)
+    for target_host, target_port in targets:
+        yield from _iterPages(f"http://{target_host}:{target_port}/v2/entities", dict(params), tenant)
+
+
+def _iterPages(url: str, params: dict, tenant: tuple = None):
+    """Iterate over the entities of one Orion instance page by page, see iterEntities"""
+    offset = 0
+    while True:
+        params["offset"] = offset
+        try:
+            with Tracing.span("orion.list", url=url, offset=offset):
+                response = Sessions.get_session(url).get(url, params=params, headers=_headers(tenant=tenant), stream=True)
+        except Exception as error:
+            raise RuntimeError(f"Get request failed to URL: {url}") from error
+        try:
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"Failed to list entities from Orion with GET request to URL: {url}, params: {params}, status_code: {response.status_code}"
+                )
+            total = response.headers.get("Fiware-Total-Count")
+            total = int(total) if total is not None else None
+            count = 0
+            for entity in _iterJsonArray(response):
+                count += 1
+                yield entity
+        finally:
+            response.close()
+        offset += count
+        logger_Orion.debug(f"iterEntities: {offset}/{total} entities listed")
+        if count < params["limit"] or (total is not None and offset >= total):
+            return
+
+
+def get(object_id: str, host: str = None, port: int = None, attrs: list = None, representation: str = None,
+        tenant: tuple = None):
     """Get an object from Orion identified by the ID
 
+    Requesting only the attributes needed and a compact representation
+    keeps the transferred and parsed payload small.
+
     Args:
         object_id (str): the Orion object id
-        host (str): Orion host. Default: ORION_HOST environment variable
-        port (int): Orion port. Default: ORION_PORT environment variable
+        host (str): Orion host. Default: the Orion of the tenant
+        port (int): Orion port. Default: the Orion of the tenant
+        attrs (list): only get these attributes. Default: all attributes
+        representation (str): None for the normalized representation,
+            "keyValues" or "values"
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
 
     Returns:
-        The object in JSON format idenfitied by object_id
+        The object in JSON format idenfitied by object_id,
+        or the list of the attribute values if representation is "values"
 
     Raises:
         RuntimeError: if the get request's status code is not 200
     """
-    url = f"http://{host}:{port}/v2/entities/{object_id}"
-    logger_Orion.debug(url)
-    status_code, json_ = getRequest(url)
+    url = _url(f"/v2/entities/{object_id}", host, port, tenant, object_id)
+    params = {}
+    if attrs is not None:
+        params["attrs"] = ",".join(attrs)
+    options = _options(representation)
+    if options is not None:
+        params["options"] = options
+    logger_Orion.debug(f"{url} {params}")
+    status_code, json_ = getRequest(url, params=params, tenant=tenant)
     if status_code != 200:
         raise RuntimeError(
             f"Failed to get object from Orion broker:{object_id}, status_code:{status_code}; no OEE data"
@@ -90,69 +542,232 @@ def get(object_id: str, host: str=ORION_HOST, port: int =ORION_PORT):
     return json_
 
 
-def exists(object_id: str):
+def getAttributeValue(object_id: str, attr: str, host: str = None, port: int = None, tenant: tuple = None):
+    """Get the value of a single attribute of an object from Orion
+
+    Only the value itself is transferred, not the entity.
+
+    Args:
+        object_id (str): the Orion object id
+        attr (str): the attribute name
+        host (str): Orion host. Default: the Orion of the tenant
+        port (int): Orion port. Default: the Orion of the tenant
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
+
+    Returns:
+        The value of the attribute
+
+    Raises:
+        RuntimeError: if the get request's status code is not 200
+    """
+    url = _url(f"/v2/entities/{object_id}/attrs/{attr}/value", host, port, tenant, object_id)
+    logger_Orion.debug(url)
+    # Orion returns strings, numbers, booleans and null as text/plain
+    # in JSON encoding, objects and arrays as application/json
+    status_code, value = getRequest(url, headers={"Accept": "text/plain, application/json"}, tenant=tenant)
+    if status_code != 200:
+        raise RuntimeError(
+            f"Failed to get attribute {attr} of object from Orion broker:{object_id}, status_code:{status_code}"
+        )
+    return value
+
+
+def exists(object_id: str, tenant: tuple = None):
     """Check if an object exists in Orion
 
+    Only the id and type of the object are transferred.
+
     Args:
         object_id (str): the object's id in Orion
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
 
     Returns:
         True if the object idenfitied by object_id exists,
         False otherwise.
     """
     try:
-        get(object_id)
+        get(object_id, attrs=["dateModified"], representation="keyValues", tenant=tenant)
         return True
     except RuntimeError:
         return False
 
 
-def getWorkstations():
-    """Download all Workstation objects at once from Orion
+def queryEntities(object_ids: list, attrs: list = None, host: str = None, port: int = None, tenant: tuple = None):
+    """Get several objects from Orion in one round-trip
+
+    Uses the NGSIv2 batch query operation (POST /v2/op/query).
+    The objects are returned in keyValues representation.
+    If the objects are sharded, one query is sent to each of their shards.
+
+    Args:
+        object_ids (list): the Orion object ids, at most ORION_PAGE_SIZE
+        attrs (list): only get these attributes. Default: all attributes
+        host (str): Orion host. Default: the Orion of the tenant
+        port (int): Orion port. Default: the Orion of the tenant
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
 
     Returns:
-        A list of the Workstation objects
+        A dict of the found objects by id.
+        Objects that do not exist are missing from the dict.
 
     Raises:
-        RuntimeError: if the get request's status_code is not 200
+        RuntimeError: if the request fails or its status code is not 200
+        ValueError: if too many objects are queried at once
     """
-    url = f"http://{ORION_HOST}:{ORION_PORT}/v2/entities?type=Workstation"
-    status_code, workstations = getRequest(url)
-    if status_code != 200:
+    if len(object_ids) > ORION_PAGE_SIZE:
+        raise ValueError(f"Cannot query more than {ORION_PAGE_SIZE} objects at once")
+    if host is None and _isSharded(tenant):
+        groups = _groupByTarget(object_ids, tenant)
+        if len(groups) > 1:
+            found = {}
+            for (shard_host, shard_port), ids in groups.items():
+                found.update(queryEntities(ids, attrs, shard_host, shard_port, tenant))
+            return found
+        if groups:
+            host, port = next(iter(groups))
+    url = _url("/v2/op/query", host, port, tenant)
+    json_ = {"entities": [{"id": object_id} for object_id in object_ids]}
+    if attrs is not None:
+        json_["attrs"] = list(attrs)
+    logger_Orion.debug(f"queryEntities: {json_}")
+    try:
+        with Tracing.span("orion.query", url=url, entities=len(object_ids)):
+            response = Sessions.get_session(url).post(url, params={"options": "keyValues", "limit": max(len(object_ids), 1)},
+                                                      headers=_headers(tenant=tenant), json=json_)
+            response.close()
+    except Exception as error:
+        raise RuntimeError(f"Post request failed to URL: {url}") from error
+    if response.status_code != 200:
         raise RuntimeError(
-            f"Critical: could not get Workstations from Orion with GET request to URL: {url}"
+            f"Failed to query objects from Orion broker: {object_ids}, status_code: {response.status_code}"
         )
-    return workstations
+    return {entity["id"]: entity for entity in response.json()}
+
+
+def getCachedEntities(object_ids: list, attrs: list, tenant: tuple = None, fresh: tuple = ()):
+    """Get the attributes of several objects, using the shared cache
+
+    The objects that are not in the cache are downloaded
+    with batch queries and put into the cache. The fresh objects
+    are always downloaded, in the same batch queries, and never cached.
+    If more than ORION_PAGE_SIZE objects are missing, or they are
+    in several shards, the batches are queried concurrently.
+
+    Args:
+        object_ids (list): the Orion object ids
+        attrs (list): the attributes needed
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
+        fresh (tuple): the ids of the objects whose attributes change too often to be cached
+
+    Returns:
+        A dict of the found objects by id in keyValues representation.
+        Objects that do not exist are missing from the dict.
+
+    Raises:
+        RuntimeError: if a batch query fails
+    """
+    if tenant is None:
+        tenant = Tenancy.DEFAULT_TENANT
+    found = {}
+    missing = []
+    for object_id in dict.fromkeys(object_ids):
+        values = None if object_id in fresh else cache.get((tenant, object_id), attrs)
+        if values is None:
+            missing.append(object_id)
+        else:
+            found[object_id] = values
+    batches = [(host, port, ids[i:i + ORION_PAGE_SIZE])
+               for (host, port), ids in _groupByTarget(missing, tenant).items()
+               for i in range(0, len(ids), ORION_PAGE_SIZE)]
+
+    def query(batch):
+        host, port, ids = batch
+        return queryEntities(ids, attrs=attrs, host=host, port=port, tenant=tenant)
+
+    # the batches queried on other threads keep the deadline and the trace of the request
+    trace = Tracing.current()
+    deadline = Deadlines.current()
+
+    def query_in_thread(batch):
+        Tracing.activate(trace)
+        Deadlines.activate(deadline)
+        try:
+            return query(batch)
+        finally:
+            Tracing.activate(None)
+            Deadlines.activate(None)
+
+    if len(batches) <= 1:
+        results = [query(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(batches), MAX_CONCURRENT_QUERIES)) as executor:
+            results = list(executor.map(query_in_thread, batches))
+    for downloaded in results:
+        for object_id, values in downloaded.items():
+            if object_id not in fresh:
+                cache.put((tenant, object_id), values, attrs)
+        found.update(downloaded)
+    return found
+
+
+def getWorkstations(tenant: tuple = None):
+    """Download all Workstation objects from Orion
 
+    The Workstations are listed page by page, see iterEntities.
+
+    Args:
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
+
+    Returns:
+        A list of the Workstation objects
 
-def update(objects: list):
+    Raises:
+        RuntimeError: if the get request's status_code is not 200
+    """
+    try:
+        return list(iterEntities(entity_type="Workstation", tenant=tenant))
+    except (RuntimeError, ValueError) as error:
+        raise RuntimeError("Critical: could not get Workstations from Orion") from error
+
+
+def update(objects: list, tenant: tuple = None):
     """Updates the objects in Orion
 
     This method takes an iterable (objects) that contain Orion objects
     then updates them in Orion.
     If an object already exists, it will be overwritten. More information:
     https://github.com/FIWARE/tutorials.CRUD-Operations#six-request
+    If the objects are sharded, one update is sent to each of their shards.
 
     Args:
         objects: an iterable containing Orion objects
+        tenant (tuple): the (service, service path) tuple. Default: the default tenant
 
     Raises:
         TypeError: if the objects does not contain an iterable
         RuntimeError: if the POST request's status code is not 204
     """
     logger_Orion.debug(f"update: objects: {objects}")
-    url = f"http://{ORION_HOST}:{ORION_PORT}/v2/op/update"
     try:
-        json_ = {"actionType": "append", "entities": list(objects)}
-        logger_Orion.debug(f"update: json_: {json_}")
+        objects = list(objects)
     except TypeError as error:
         raise TypeError(
             f"The objects {objects} are not iterable, cannot make a list. Please, provide an iterable object"
         ) from error
-    response = requests.post(url, json=json_)
-    if response.status_code != 204:
-        raise RuntimeError(
-            f"Failed to update objects in Orion.\nStatus_code: {response.status_code}\nObjects:\n{objects}"
-        )
+    if _isSharded(tenant):
+        groups = {}
+        for object_ in objects:
+            groups.setdefault(target(tenant, object_.get("id")), []).append(object_)
     else:
-        return response.status_code
+        groups = {target(tenant): objects}
+    for (host, port), entities in groups.items():
+        url = _url("/v2/op/update", host, port, tenant)
+        json_ = {"actionType": "append", "entities": entities}
+        logger_Orion.debug(f"update: json_: {json_}")
+        with Tracing.span("orion.update", url=url):
+            response = Sessions.get_session(url).post(url, headers=_headers(tenant=tenant), json=json_)
+        if response.status_code != 204:
+            raise RuntimeError(
+                f"Failed to update objects in Orion.\nStatus_code: {response.status_code}\nObjects:\n{entities}"
+            )
+    return 204
@@ -0,0 +1,292 @@
+"""Declarative transform rules
+
+Instead of writing Python, the transformation of the requests
+can be described in a JSON (or YAML, if PyYAML is installed) rule file.
+The rules are compiled once, when the plugin is imported,
+into callables with precompiled expressions and URL templates.
+The Orion lookups of the rules go through the shared entity cache.
+
+A rule file contains a list of rules. The first rule
+whose "match" fits the transform field of the request is applied.
+The rule below does the same as the built-in transform:
+
+    {"rules": [{
+        "name": "partCounter",
+        "match": {"ws": null, "ct": null, "cc": null},
+        "vars": {
+            "counter": {"field": "ct", "map": {"good": "goodPartCounter"}, "default": "rejectPartCounter"},
+            "job": {"entity": "ws", "attr": "refJob", "fresh": true},
+            "operation": {"entity": "job", "attr": "refOperation"},
+            "partsPerCycle": {"entity": "operation", "attr": "partsPerCycle"},
+            "value": {"expr": "cc * partsPerCycle"}
+        },
+        "request": {
+            "method": "PUT",
+            "url": "/v2/entities/{job}/attrs/{counter}/value",
+            "headers": {"Content-Type": "text/plain"},
+            "data": "{value}"
+        }
+    }]}
+
+match: the transform fields the rule needs. A null value means
+    the field only has to be present, otherwise it has to be equal.
+vars: evaluated in order, each var can use the transform fields
+    and the vars before it. A var is one of:
+        {"field": <name>, "map": {...}, "default": ...}: a transform field,
+            optionally translated with a map
+        {"entity": <name>, "attr": <attr>, "fresh": false}: the attribute value
+            of the entity whose id is in the field or var <name>.
+            With "fresh": true, the entity is always looked up in Orion,
+            never in the cache, for the attributes that change often,
+            like the refJob of a Workstation
+        {"expr": <expression>}: arithmetic (+ - * / // %), comparison
+            and min, max, abs, round, int, float on the fields and vars
+        {"value": <constant>}
+request: the request to send. Relative urls are prefixed with
+    the Orion host and port. Strings may contain {name} placeholders,
+    a string that is a single placeholder keeps the type of the value.
+
+The lookups, the relative urls and the headers of the transformed request
+follow the tenant of the request (Fiware-Service, Fiware-ServicePath).
+"""
+# Standard Library imports
+import ast
+import json
+import os
+import sys
+
+# custom imports
+from . import Orion
+from . import Logger
+
+logger = Logger.getLogger(__name__)
+
+sys.path.insert(0, "..")
+from HTTPRequest import HTTPRequest
+import Tenancy
+from Templates import compile_template
+
+# the functions allowed in expressions
+EXPRESSION_FUNCTIONS = {
+    "min": min,
+    "max": max,
+    "abs": abs,
+    "round": round,
+    "int": int,
+    "float": float,
+}
+
+EXPRESSION_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp, ast.IfExp,
+    ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.USub, ast.UAdd, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+def _compile_expression(expression: str, rule_name: str):
+    """Compile an arithmetic expression into a function of the variables
+
+    Raises:
+        ValueError: if the expression is invalid or uses forbidden syntax
+    """
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as error:
+        raise ValueError(f"Rule {rule_name}: invalid expression: {expression}") from error
+    for node in ast.walk(tree):
+        if not isinstance(node, EXPRESSION_NODES):
+            raise ValueError(f"Rule {rule_name}: {type(node).__name__} is not allowed in expression: {expression}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in EXPRESSION_FUNCTIONS or node.keywords:
+                raise ValueError(f"Rule {rule_name}: only {list(EXPRESSION_FUNCTIONS)} can be called in expression: {expression}")
+    code = compile(tree, f"<rule {rule_name}>", "eval")
+    globals_ = {"__builtins__": {}, **EXPRESSION_FUNCTIONS}
+    return lambda variables: eval(code, globals_, variables)
+
+
+def _compile_var(name: str, spec: dict, rule_name: str, attrs: list):
+    """Compile a var of a rule into a function of the variables and the tenant
+
+    Args:
+        name (str): the name of the var
+        spec (dict): the definition of the var
+        rule_name (str): the name of the rule, for error messages
+        attrs (list): all the attributes looked up by the rule
+
+    Raises:
+        ValueError: if the definition is invalid
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"Rule {rule_name}: var {name} must be an object")
+    if "field" in spec:
+        field = spec["field"]
+        if "map" not in spec:
+            return lambda variables, tenant: variables[field]
+        mapping = spec["map"]
+        default = spec.get("default")
+        return lambda variables, tenant: mapping.get(variables[field], default)
+    if "entity" in spec:
+        source = spec["entity"]
+        attr = spec.get("attr")
+        if not isinstance(attr, str):
+            raise ValueError(f"Rule {rule_name}: var {name} needs an attr")
+        fresh = spec.get("fresh", False)
+        if not isinstance(fresh, bool):
+            raise ValueError(f"Rule {rule_name}: fresh of var {name} must be true or false")
+
+        def lookup(variables, tenant):
+            entity_id = variables[source]
+            entities = Orion.getCachedEntities([entity_id], attrs, tenant, fresh=(entity_id,) if fresh else ())
+            if entity_id not in entities:
+                raise RuntimeError(f"Rule {rule_name}: the entity {entity_id} does not exist")
+            if attr not in entities[entity_id]:
+                raise RuntimeError(f"Rule {rule_name}: the entity {entity_id} has no attribute {attr}")
+            return entities[entity_id][attr]
+
+        return lookup
+    if "expr" in spec:
+        expression = _compile_expression(str(spec["expr"]), rule_name)
+        return lambda variables, tenant: expression(variables)
+    if "value" in spec:
+        value = spec["value"]
+        return lambda variables, tenant: value
+    raise ValueError(f"Rule {rule_name}: var {name} must have one of field, entity, expr or value")
+
+
+class Rule:
+    """A compiled transform rule
+
+    Args:
+        spec (dict): the rule definition, see the module docstring
+        host (str): Orion host for relative urls, None for the Orion of the tenant
+        port (int): Orion port for relative urls
+
+    Raises:
+        ValueError: if the definition is invalid
+    """
+
+    def __init__(self, spec: dict, host: str, port: int):
+        self.name = str(spec.get("name", "unnamed"))
+        match = spec.get("match", {})
+        if not isinstance(match, dict):
+            raise ValueError(f"Rule {self.name}: match must be an object")
+        self.required = tuple(match)
+        self.equal = tuple((field, value) for field, value in match.items() if value is not None)
+        vars_ = spec.get("vars", {})
+        if not isinstance(vars_, dict):
+            raise ValueError(f"Rule {self.name}: vars must be an object")
+        # every lookup of the rule requests the same attributes,
+        # so one cache entry per entity serves all of them
+        self.attrs = sorted({var["attr"] for var in vars_.values() if isinstance(var, dict) and "entity" in var and "attr" in var})
+        self.vars = tuple((name, _compile_var(name, var, self.name, self.attrs)) for name, var in vars_.items())
+        request = spec.get("request")
+        if not isinstance(request, dict) or "url" not in request:
+            raise ValueError(f"Rule {self.name}: request with url is required")
+        self.method = str(request.get("method", "PUT")).upper()
+        if self.method not in ("GET", "POST", "PUT", "DELETE"):
+            raise ValueError(f"Rule {self.name}: not implemented HTTP method: {self.method}")
+        url = str(request["url"])
+        # relative urls without a fixed host go to the Orion of the tenant
+        self.relative = url.startswith("/") and host is None
+        if url.startswith("/") and host is not None:
+            url = f"http://{host}:{port}{url}"
+        self.url = compile_template(url, f"Rule {self.name}")
+        self.headers = compile_template(dict(request.get("headers", {})), f"Rule {self.name}")
+        self.has_data = "data" in request
+        self.data = compile_template(request.get("data"), f"Rule {self.name}")
+
+    def matches(self, fields: dict) -> bool:
+        """Check if the rule applies to the transform field of a request"""
+        for field in self.required:
+            if field not in fields:
+                return False
+        for field, value in self.equal:
+            if fields[field] != value:
+                return False
+        return True
+
+    def __call__(self, req: HTTPRequest) -> HTTPRequest:
+        """Apply the rule to a request
+
+        Raises:
+            RuntimeError: if a looked up entity or attribute does not exist
+            KeyError: if a placeholder refers to an unknown variable
+        """
+        tenant = Tenancy.tenant_of(req.headers)
+        variables = dict(req.transform)
+        for name, evaluate in self.vars:
+            variables[name] = evaluate(variables, tenant)
+        data = ""
+        if self.has_data:
+            data = self.data(variables)
+            if not isinstance(data, str):
+                data = json.dumps(data)
+        url = self.url(variables)
+        if self.relative:
+            url = Orion.baseUrl(tenant) + url
+        return HTTPRequest(url=url,
+                           method=self.method,
+                           headers={**Tenancy.tenant_headers(tenant), **self.headers(variables)},
+                           data=data)
+
+
+def compile_rules(spec: dict, host: str = None, port: int = None) -> list:
+    """Compile a rule set
+
+    Args:
+        spec (dict): the rule set, {"rules": [...]}
+        host (str): Orion host for relative urls.
+            Default: the Orion of the tenant of each request, see Orion.target
+        port (int): Orion port for relative urls
+
+    Returns:
+        the list of compiled rules
+
+    Raises:
+        ValueError: if the rule set is invalid
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get("rules"), list):
+        raise ValueError('The rule set must be an object with a "rules" list')
+    return [Rule(rule, host, port) for rule in spec["rules"]]
+
+
+def load_rules(path: str) -> list:
+    """Load and compile a rule file
+
+    Args:
+        path (str): a .json file, or a .yaml/.yml file if PyYAML is installed
+
+    Returns:
+        the list of compiled rules
+
+    Raises:
+        ValueError: if the rule file is invalid
+        ImportError: if the file is YAML, but PyYAML is not installed
+    """
+    with open(path, encoding="utf-8") as file:
+        if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+            import yaml
+            spec = yaml.safe_load(file)
+        else:
+            spec = json.load(file)
+    rules = compile_rules(spec)
+    logger.info(f"Compiled {len(rules)} transform rules from {path}")
+    return rules
+
+
+def apply_rules(rules: list, req: HTTPRequest):
+    """Apply the first matching rule to a request
+
+    Args:
+        rules (list): compiled rules
+        req (HTTPRequest): request to transform
+
+    Returns:
+        the transformed HTTPRequest, or None if no rule matches
+    """
+    for rule in rules:
+        if rule.matches(req.transform):
+            logger.debug(f"Applying rule {rule.name}")
+            return rule(req)
+    return None
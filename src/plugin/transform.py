@@ -1,24 +1,147 @@
 """The main part of the plugin that transforms the HTTP request 
 
 The transform function will be applied to the HTTPRequest object before sending it. 
+
+The lookups and the transformed request go to the tenant of the request,
+given by its Fiware-Service and Fiware-ServicePath headers, see Tenancy.py.
+
+Environment variables:
+    TRANSFORM_RULES: the path of a declarative rule file, see rules.py.
+        If set, the compiled rules replace the built-in transform logic.
+        Default: not set
+    PLUGIN_PREFETCH: if "true", the Jobs and Operations of all Workstations
+        are looked up in the background when the plugin is imported.
+        Default: false
 """
 # Standard Library imports
-import os
+from collections import OrderedDict
 import sys
+import threading
 
 # PyPI imports
 
 # custom imports
 from . import Orion
 from . import Logger
+from . import rules
 
 logger = Logger.getLogger(__name__)
 
 sys.path.insert(0, "..")
 from HTTPRequest import HTTPRequest
+import Config
+import Tenancy
+
+PLUGIN_PREFETCH = Config.get("PLUGIN_PREFETCH")
+if PLUGIN_PREFETCH is not None and PLUGIN_PREFETCH.lower() == "true":
+    PLUGIN_PREFETCH = True
+else:
+    PLUGIN_PREFETCH = False
+
+TRANSFORM_RULES = Config.get("TRANSFORM_RULES")
+if TRANSFORM_RULES:
+    try:
+        compiled_rules = rules.load_rules(TRANSFORM_RULES)
+    except (OSError, ValueError) as error:
+        raise ImportError(f"Cannot load the transform rules from {TRANSFORM_RULES}: {error}") from error
+else:
+    compiled_rules = None
+
+# the attributes used along the Workstation -> Job -> Operation chain
+CHAIN_ATTRS = ["refJob", "refOperation", "partsPerCycle"]
+
+# the Job and Operation ids last seen for each (tenant, Workstation),
+# least recently used first. They are queried together with the Workstation,
+# so that the whole chain is usually resolved in one round-trip
+likely_chain = OrderedDict()
+MAX_LIKELY_CHAINS = 10000
+# the sender threads resolve chains concurrently
+_chains_lock = threading.Lock()
+
+
+def resolve_chain(ws_id: str, tenant: tuple = Tenancy.DEFAULT_TENANT):
+    """Resolve the Job and the partsPerCycle of a Workstation
+
+    The Workstation, its likely Job and likely Operation are queried
+    in one batch query. Only if the Job or the Operation changed,
+    is another round-trip needed for each changed entity.
+    The Workstation is never cached, so a Job changeover applies
+    to the next request, the Job and the Operation are.
+
+    Args:
+        ws_id (str): the Workstation id
+        tenant (tuple): the (service, service path) of the Workstation. Default: the default tenant
+
+    Returns:
+        (job_id, partsPerCycle) or None if the Workstation does not exist
+
+    Raises:
+        RuntimeError: if the Job or the Operation does not exist
+            or the Orion request fails
+    """
+    with _chains_lock:
+        job_id, operation_id = likely_chain.get((tenant, ws_id), (None, None))
+    ids = [ws_id] + [i for i in (job_id, operation_id) if i is not None]
+    entities = Orion.getCachedEntities(ids, CHAIN_ATTRS, tenant, fresh=(ws_id,))
+    if ws_id not in entities:
+        return None
+    job_id = entities[ws_id]["refJob"]
+    if job_id not in entities:
+        logger.debug(f"Job of {ws_id} changed to {job_id}")
+        entities.update(Orion.getCachedEntities([job_id], CHAIN_ATTRS, tenant))
+    if job_id not in entities:
+        raise RuntimeError(f"The Job {job_id} of the Workstation {ws_id} does not exist")
+    operation_id = entities[job_id]["refOperation"]
+    if operation_id not in entities:
+        logger.debug(f"Operation of {job_id} changed to {operation_id}")
+        entities.update(Orion.getCachedEntities([operation_id], CHAIN_ATTRS, tenant))
+    if operation_id not in entities:
+        raise RuntimeError(f"The Operation {operation_id} of the Job {job_id} does not exist")
+    _remember_chain((tenant, ws_id), (job_id, operation_id))
+    return job_id, entities[operation_id]["partsPerCycle"]
+
+
+def _remember_chain(key: tuple, chain: tuple):
+    """Remember the likely chain of a Workstation, evict the least recently used chain above MAX_LIKELY_CHAINS"""
+    with _chains_lock:
+        likely_chain[key] = chain
+        likely_chain.move_to_end(key)
+        while len(likely_chain) > MAX_LIKELY_CHAINS:
+            likely_chain.popitem(last=False)
+
+
+def prefetch(ws_ids: list = None, tenant: tuple = Tenancy.DEFAULT_TENANT):
+    """Look up the chains of several Workstations at once
 
-ORION_HOST = os.environ.get("ORION_HOST")
-ORION_PORT = os.environ.get("ORION_PORT")
+    Each level of the chain is downloaded with batch queries
+    for all Workstations, so the cache is warmed up
+    in three round-trips regardless of the number of Workstations.
+
+    Args:
+        ws_ids (list): the Workstation ids. Default: all Workstations of the tenant
+        tenant (tuple): the (service, service path) of the Workstations. Default: the default tenant
+    """
+    if ws_ids is None:
+        ws_ids = [ws["id"] for ws in Orion.iterEntities(entity_type="Workstation", attrs=["refJob"],
+                                                        representation="keyValues", tenant=tenant)]
+    workstations = Orion.getCachedEntities(ws_ids, CHAIN_ATTRS, tenant, fresh=frozenset(ws_ids))
+    job_ids = [ws["refJob"] for ws in workstations.values() if "refJob" in ws]
+    jobs = Orion.getCachedEntities(job_ids, CHAIN_ATTRS, tenant)
+    operation_ids = [job["refOperation"] for job in jobs.values() if "refOperation" in job]
+    Orion.getCachedEntities(operation_ids, CHAIN_ATTRS, tenant)
+    for ws_id, ws in workstations.items():
+        job_id = ws.get("refJob")
+        if job_id in jobs:
+            _remember_chain((tenant, ws_id), (job_id, jobs[job_id].get("refOperation")))
+    logger.info(f"Prefetched the Jobs and Operations of {len(workstations)} Workstations")
+
+
+def _prefetch_in_background():
+    """Run prefetch, log errors instead of raising them"""
+    try:
+        prefetch()
+    except Exception as error:
+        logger.error(f"Prefetching Workstations failed: {error}")
 
 
 def transform(req: HTTPRequest) -> HTTPRequest:
@@ -69,29 +192,35 @@ def transform(req: HTTPRequest) -> HTTPRequest:
     So the GoodPartCounter's real value must be 8*14 = 96
 
     The plugin needs setting the ORION_HOST and ORION_PORT
-    environment variables.
+    environment variables. The requests of the services in ORION_TENANTS
+    are looked up in and sent to the Orion of their service.
 
     Steps:
         1. Check if the transform attribute of the HTTPRequest is empy or not
             If empty, the transform function returns the request unchanged
         2. If the transform attribute of the HTTPRequest does not contain a valid Orion id,
             the transform function returns the request unchanged
-        3. Get the Workstation Orion object whose id is in the transform attribute
-        4. Get the refJob attribute
-        5. Get the Job from Orion
-        6. Get the Job's refPart
-        7. Get the Part from Orion
-        8. Get the Operation based on the CurrentOperationType of the Job
-        9. Get partsPerCycle
-        10. Multiply "cc" (cycle count) by partsPerCycle to get the Counter
-        11. Check if the GoodPartCounter or the RejectPartCounter
+        3. Get the refJob attribute value of the Workstation
+            whose id is in the transform attribute
+        4. Get the refOperation attribute value of the Job
+        5. Get the partsPerCycle attribute value of the Operation
+            Steps 3-5 usually take one batch query, see resolve_chain
+        6. Multiply "cc" (cycle count) by partsPerCycle to get the Counter
+        7. Check if the GoodPartCounter or the RejectPartCounter
             needs to be updated (transform["ct"])
-        12. Construct a HTTPRequest that updates the Job's counter.
-        13. Return request
+        8. Construct a HTTPRequest that updates the Job's counter.
+        9. Return request
         """
     if req.transform == {}:
         # do not modify a request without an empty transform field
         return req
+    if compiled_rules is not None:
+        transformed = rules.apply_rules(compiled_rules, req)
+        if transformed is None:
+            logger.warning(f"No transform rule matches {req.transform}, request unchanged")
+            return req
+        logger.debug(f"transformed request: {transformed}")
+        return transformed
     ws_id = req.transform["ws"]
     logger.debug(f"wd_id: {ws_id}")
     counter_type = req.transform["ct"]
@@ -103,28 +232,29 @@ def transform(req: HTTPRequest) -> HTTPRequest:
     logger.debug(f"counter_name: {counter_name}")
     cycle_count = req.transform["cc"]
     logger.debug(f"cycle_count: {cycle_count}")
-    if not Orion.exists(ws_id):
+    tenant = Tenancy.tenant_of(req.headers)
+    chain = resolve_chain(ws_id, tenant)
+    if chain is None:
         logger.error(f"Error: cannot transform request: Workstation {ws_id} does not exist")
         return req
-    workstation = Orion.get(ws_id)
-    logger.debug(f"workstation: {workstation}")
-    job_id = workstation["refJob"]["value"]
-    job = Orion.get(job_id)
-    logger.debug(f"job: {job}")
-    # part_id = job["refPart"]["value"]
-    operation_id = job["refOperation"]["value"]
-    operation = Orion.get(operation_id)
-    logger.debug(f"operation: {operation}")
-    partsPerCycle = operation["partsPerCycle"]["value"]
+    job_id, partsPerCycle = chain
+    logger.debug(f"job_id: {job_id}")
     logger.debug(f"partsPerCycle: {partsPerCycle}")
     counter_value = cycle_count * partsPerCycle
     logger.debug(f"counter_value: {counter_value}")
-    url = f"http://{ORION_HOST}:{ORION_PORT}/v2/entities/{job_id}/attrs/{counter_name}/value"
+    url = f"{Orion.baseUrl(tenant, job_id)}/v2/entities/{job_id}/attrs/{counter_name}/value"
     logger.debug(f"url: {url}")
     method = "PUT"
-    headers = {"Content-Type": "text/plain"}
+    headers = {"Content-Type": "text/plain", **Tenancy.tenant_headers(tenant)}
     data = str(counter_value)
     logger.debug(f"data: {data}")
     transformed = HTTPRequest(url=url, method=method, headers=headers, data=data)
     logger.debug(f"transformed request: {transformed}")
     return transformed
+
+
+# the background prefetch, the IoT agent is ready when it finished
+prefetcher = None
+if PLUGIN_PREFETCH:
+    prefetcher = threading.Thread(target=_prefetch_in_background, name="plugin-prefetch", daemon=True)
+    prefetcher.start()
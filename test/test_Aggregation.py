@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Aggregation.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import json
+import sys
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Aggregation
+from HTTPRequest import HTTPRequest
+from IdempotencyStore import IdempotencyStore
+import main
+
+URL = "http://orion:1026/v2/entities/urn:ngsi_ld:Oven:1/attrs/temperature"
+
+
+def reading(value, url: str = URL, headers: dict = None) -> HTTPRequest:
+    return HTTPRequest(url=url, method="PUT", headers=headers or {"Content-Type": "application/json"},
+                       data=json.dumps({"value": value, "type": "Number", "metadata": {}}))
+
+
+class TestAggregation(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.sent = []
+        self.aggregator = Aggregation.Aggregator(
+            Aggregation.parse_rules("temperature=mean:10, pressure=max:5,level=last:5"),
+            send=self.sent.append, clock=lambda: self.now)
+
+    def test_parse_rules(self):
+        self.assertEqual(Aggregation.parse_rules("a=MEAN:2.5"), {"a": ("mean", 2.5)})
+        for text in ("a=median:5", "a=mean", "a=mean:0", "=min:1"):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                Aggregation.parse_rules(text)
+
+    def test_mean_over_a_window(self):
+        for value in (20, 21.5, 22):
+            self.assertTrue(self.aggregator.add(reading(value)))
+        self.now = 109.9
+        self.assertEqual(self.aggregator.flush(), [])
+        self.now = 110.0
+        [update] = self.aggregator.flush()
+        self.assertEqual(json.loads(update.data), {"value": 21.166666666666668, "type": "Number", "metadata": {}})
+        self.assertEqual(update.url, URL)
+        self.assertEqual(self.sent, [update])
+        # the next window starts empty
+        self.assertEqual(self.aggregator.flush(everything=True), [])
+
+    def test_series(self):
+        pressure = URL.replace("temperature", "pressure")
+        level = URL.replace("temperature", "level") + "/value"
+        for value in (3, 7, 5):
+            self.aggregator.add(reading(value, pressure))
+            self.aggregator.add(reading(value, pressure, {"Content-Type": "application/json",
+                                                          "Fiware-Service": "line2"}))
+            self.assertTrue(self.aggregator.add(HTTPRequest(url=level, method="PUT", data=str(value),
+                                                            headers={"Content-Type": "text/plain"})))
+        updates = self.aggregator.flush(everything=True)
+        self.assertEqual([update.data for update in updates],
+                         [json.dumps({"value": 7, "type": "Number", "metadata": {}})] * 2 + ["5"])
+        self.assertEqual(updates[1].headers["Fiware-Service"], "line2")
+
+    def test_idle_slots(self):
+        other = URL.replace("Oven:1", "Oven:2")
+        self.aggregator.add(reading(20))
+        self.now = 110.0
+        self.aggregator.flush()
+        # idle for less than AGGREGATE_IDLE_WINDOWS windows: the series keeps its slot
+        self.now = 200.0
+        self.aggregator.flush()
+        self.assertEqual(len(self.aggregator._slots), 1)
+        self.now = 210.0
+        self.aggregator.flush()
+        self.assertEqual(len(self.aggregator._slots), 0)
+        # a new series reuses the reclaimed slot
+        self.assertTrue(self.aggregator.add(reading(30, other)))
+        self.assertEqual(len(self.aggregator._requests), 1)
+        self.now = 220.0
+        [update] = self.aggregator.flush()
+        self.assertEqual((update.url, json.loads(update.data)["value"]), (other, 30))
+
+    def test_passthrough(self):
+        for req in (reading(1, URL.replace("temperature", "alarm")),
+                    reading({"$inc": 1}),
+                    reading(True),
+                    HTTPRequest(url=URL, method="GET", headers={}),
+                    HTTPRequest(url=URL + "/value", method="PUT", data="20",
+                                headers={"Content-Type": "application/json"})):
+            with self.subTest(req=req):
+                self.assertFalse(self.aggregator.add(req))
+
+    def test_handler(self):
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        agent.headers = {}
+        agent._set_response = mock.Mock()
+        agent.wfile = mock.Mock()
+        body = json.dumps({"url": URL, "method": "PUT", "headers": ["Content-Type: application/json"],
+                           "data": {"value": 20, "type": "Number"}}).encode("utf-8")
+        with mock.patch.object(main, "aggregator", self.aggregator), \
+                mock.patch.object(main.IoTAgent, "_process_request") as process:
+            agent._handle_post_data(body)
+            agent._set_response.assert_called_once_with(202)
+            process.assert_not_called()
+
+    def test_retried_reading(self):
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        agent.headers = {}
+        agent._set_response = mock.Mock()
+        agent._replay_response = mock.Mock()
+        agent.wfile = mock.Mock()
+        body = json.dumps({"url": URL, "method": "PUT", "headers": ["Content-Type: application/json"],
+                           "data": {"value": 20, "type": "Number"}, "idempotency_key": "reading-1"}).encode("utf-8")
+        with mock.patch.object(main, "aggregator", self.aggregator), \
+                mock.patch.object(main, "idempotency_store", IdempotencyStore(ttl=60, max_keys=10)):
+            agent._handle_post_data(body)
+            agent._handle_post_data(body)
+        # the retry is answered with the stored response, it is not counted twice
+        agent._set_response.assert_called_once_with(202)
+        agent._replay_response.assert_called_once_with((202, main.AGGREGATED_RESPONSE))
+        self.assertEqual(self.aggregator._count[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
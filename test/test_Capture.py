@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Capture.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Capture
+import main
+import Metrics
+
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        Metrics.reset()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_encoding(self):
+        headers = {"Content-Type": "application/cbor", "Fiware-Service": "plant"}
+        record = Capture.encode(1700000000.25, b"\xa1body", headers)
+        self.assertEqual(Capture.decode(record), (1700000000.25, b"\xa1body", headers))
+        self.assertEqual(Capture.decode(Capture.encode(1.0, b"", {})), (1.0, b"", {}))
+        with self.assertRaises(ValueError):
+            Capture.decode(record[:4])
+        with self.assertRaises(ValueError):
+            Capture.decode(record[:Capture.RECORD_HEADER.size + 3])
+
+    def test_rotation(self):
+        capture = Capture.Capture(self.directory, segment_bytes=1024, max_bytes=4096)
+        for i in range(200):
+            capture.record(f'{{"n": {i}}}'.encode("utf-8") + b" " * 40, {"Content-Type": "application/json"})
+        capture.close()
+        bodies = [body for _, body, _ in Capture.read(self.directory)]
+        # the oldest segments were dropped, the newest requests are kept in order
+        self.assertLess(len(bodies), 200)
+        self.assertEqual(bodies[-1].rstrip(), b'{"n": 199}')
+        numbers = [int(body.split()[1].rstrip(b"}")) for body in bodies]
+        self.assertEqual(numbers, sorted(numbers))
+        self.assertEqual(Metrics.get("capture_records_total"), 200)
+
+    def test_do_POST(self):
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        agent.headers = {"Content-Length": "2", "Content-Type": "application/json"}
+        agent.rfile = mock.Mock(read=mock.Mock(return_value=b"{}"))
+        agent.path = "/"
+        agent.client_address = ("127.0.0.1", 0)
+        agent._handle_post_data = mock.Mock(return_value=None)
+        agent._log_access = mock.Mock()
+        capture = Capture.Capture(self.directory)
+        with mock.patch.object(main, "capture", capture):
+            agent.do_POST()
+            agent.path = "/admin/reload"
+            agent._handle_admin = mock.Mock()
+            agent.do_POST()
+        capture.close()
+        self.assertEqual([(body, headers) for _, body, headers in Capture.read(self.directory)],
+                         [(b"{}", {"Content-Type": "application/json"})])
+
+
+if __name__ == "__main__":
+    unittest.main()
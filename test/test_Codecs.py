@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Codecs.py and the binary requests
+
+These tests do not need a running Orion broker.
+The CBOR and MessagePack tests need the optional cbor2 and msgpack packages.
+"""
+
+# Standard Library imports
+import importlib.util
+import json
+import sys
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Codecs
+import main
+
+ENVELOPE = {"url": "http://localhost:1026/v2/entities/urn:ngsi_ld:Storage:1/attrs/Counter",
+            "method": "PUT",
+            "headers": ["Content-Type: application/json"],
+            "data": {"value": {"$inc": -1.5}, "type": "Number"},
+            "idempotency_key": "k1"}
+
+
+class TestCodecs(unittest.TestCase):
+    def setUp(self):
+        # a handler without a connection
+        self.agent = main.IoTAgent.__new__(main.IoTAgent)
+
+    def test_media_type(self):
+        self.assertEqual(Codecs.media_type("Application/CBOR; charset=binary"), "application/cbor")
+        self.assertEqual(Codecs.media_type(None), "")
+
+    def test_json_is_the_default(self):
+        body = json.dumps(ENVELOPE).encode("utf-8")
+        for content_type in (None, "text/plain", "application/json"):
+            self.assertEqual(Codecs.decode(body, content_type), ENVELOPE)
+
+    @unittest.skipUnless(importlib.util.find_spec("cbor2"), "cbor2 is not installed")
+    def test_cbor(self):
+        import cbor2
+        req = self.agent._prepare_request(cbor2.dumps(ENVELOPE), "application/cbor")
+        self.assertEqual(json.loads(req.data), ENVELOPE["data"])
+        self.assertEqual((req.method, req.idempotency_key), ("PUT", "k1"))
+        with self.assertRaises(ValueError):
+            Codecs.decode(b"\xff\x00", "application/cbor")
+        # CBOR allows keys that are not strings
+        with self.assertRaises(ValueError):
+            self.agent._prepare_request(cbor2.dumps({1: "GET"}), "application/cbor")
+
+    @unittest.skipUnless(importlib.util.find_spec("msgpack"), "msgpack is not installed")
+    def test_msgpack(self):
+        import msgpack
+        for content_type in Codecs.MSGPACK_TYPES:
+            req = self.agent._prepare_request(msgpack.packb(ENVELOPE), content_type)
+            self.assertEqual(req.url, ENVELOPE["url"])
+            self.assertEqual(json.loads(req.data), ENVELOPE["data"])
+        with self.assertRaises(ValueError):
+            Codecs.decode(msgpack.packb(ENVELOPE)[:-3], "application/msgpack")
+
+    def test_missing_package(self):
+        with mock.patch.dict(Codecs._modules, {"cbor2": None}):
+            self.assertNotIn("application/cbor", Codecs.available())
+            with self.assertRaises(Codecs.UnsupportedMediaTypeError):
+                Codecs.decode(b"\xa0", "application/cbor")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Compression.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import sys
+import threading
+import unittest
+from unittest import mock
+import zlib
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Compression
+from HTTPRequest import HTTPRequest
+import main
+import Sessions
+
+LARGE = json.dumps([{"id": f"urn:ngsi_ld:Sensor:{i}", "type": "Sensor", "temperature": {"type": "Number", "value": i}}
+                    for i in range(100)])
+
+
+class Recorder(BaseHTTPRequestHandler):
+    """Records the requests and answers with a list of entities"""
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        Recorder.received.append((self.headers.get("Content-Encoding"), body))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(LARGE)))
+        self.end_headers()
+        self.wfile.write(LARGE.encode("utf-8"))
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+class TestCompression(unittest.TestCase):
+    def test_accepted_encoding(self):
+        for header, expected in ((None, None), ("", None), ("identity", None), ("br", None),
+                                 ("gzip", "gzip"), ("deflate, gzip;q=0.5", "gzip"), ("gzip;q=0, deflate", "deflate"),
+                                 ("GZIP", "gzip"), ("*", "gzip"), ("gzip;q=0", None),
+                                 ("gzip;q=0, *", "deflate"), ("gzip;q=0, deflate;q=0, *", None)):
+            with self.subTest(header=header):
+                self.assertEqual(Compression.accepted_encoding(header), expected)
+
+    def test_threshold(self):
+        body = LARGE.encode("utf-8")
+        with mock.patch.object(Compression, "ORION_COMPRESSION", "gzip"):
+            self.assertEqual(Compression.compress_request(b'{"value": 1}'), (b'{"value": 1}', None))
+            compressed, encoding = Compression.compress_request(body)
+            self.assertEqual((gzip.decompress(compressed), encoding), (body, "gzip"))
+        self.assertEqual(Compression.compress_request(body), (body, None))
+        with mock.patch.object(Compression, "COMPRESS_RESPONSES", True):
+            compressed, encoding = Compression.compress_response(body, "deflate")
+            self.assertEqual((zlib.decompress(compressed), encoding), (body, "deflate"))
+            self.assertEqual(Compression.compress_response(body, None), (body, None))
+
+
+class TestCompressedForwarding(unittest.TestCase):
+    def setUp(self):
+        Recorder.received = []
+        server = ThreadingHTTPServer(("localhost", 0), Recorder)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(Sessions.close_all)
+        self.url = f"http://localhost:{server.server_address[1]}/v2/op/update"
+
+    def test_request_to_orion(self):
+        req = HTTPRequest(url=self.url, method="POST", data=LARGE,
+                          headers={"Content-Type": "application/json", "Content-Length": str(len(LARGE))})
+        with mock.patch.object(Compression, "ORION_COMPRESSION", "deflate"):
+            res = main.IoTAgent._send_to_target(req)
+        self.assertEqual(res.status_code, 200)
+        encoding, body = Recorder.received[0]
+        self.assertEqual((encoding, zlib.decompress(body).decode("utf-8")), ("deflate", LARGE))
+
+    def test_response_to_device(self):
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        agent.headers = {"Accept-Encoding": "gzip, deflate"}
+        agent._set_response = mock.Mock()
+        agent.wfile = io.BytesIO()
+        req = HTTPRequest(url=self.url, method="POST", data="{}", headers={"Content-Type": "application/json"})
+        with mock.patch.object(Compression, "COMPRESS_RESPONSES", True):
+            res = agent._manage_send_request_to_broker(req)
+        agent._set_response.assert_called_once_with(200, "gzip")
+        self.assertEqual(gzip.decompress(agent.wfile.getvalue()), f"{res.content}".encode("utf-8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
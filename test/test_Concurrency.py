@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Concurrency.py and the limited sessions
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Concurrency
+from Concurrency import AdaptiveLimiter
+from HTTPRequest import HTTPRequest
+import main
+from SegmentLog import SegmentLog
+import Sessions
+from StoreAndForward import StoreAndForward
+
+
+class Overloaded(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.limiter = AdaptiveLimiter(initial=2, min_limit=1, max_limit=4, tolerance=2.0, backoff=0.5,
+                                       clock=lambda: self.now)
+
+    def saturate(self, latency: float, overloaded: bool = False):
+        """Send as many requests as the limit allows, then complete them"""
+        slots = int(self.limiter.limit)
+        for _ in range(slots):
+            self.assertTrue(self.limiter.acquire(0))
+        self.assertFalse(self.limiter.acquire(0))
+        for _ in range(slots):
+            self.now += latency
+            self.limiter.release(latency, overloaded)
+
+    def test_increase_while_latency_is_flat(self):
+        for _ in range(10):
+            self.saturate(0.01)
+        self.assertEqual(int(self.limiter.limit), 4)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_no_increase_without_load(self):
+        for _ in range(10):
+            self.assertTrue(self.limiter.acquire(0))
+            self.limiter.release(0.01)
+        self.assertEqual(self.limiter.limit, 2)
+
+    def test_decrease_when_latency_climbs(self):
+        for _ in range(10):
+            self.saturate(0.01)
+        for _ in range(10):
+            self.saturate(0.1)
+        self.assertEqual(self.limiter.limit, 1)
+        # once per round trip only
+        limiter = AdaptiveLimiter(initial=4, backoff=0.5, clock=lambda: self.now)
+        limiter.acquire(0)
+        limiter.acquire(0)
+        limiter.release(0.01)
+        limiter.release(0.01, overloaded=True)
+        self.assertEqual(limiter.limit, 2)
+        limiter.acquire(0)
+        limiter.release(0.01, overloaded=True)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_waiting_for_a_slot(self):
+        limiter = AdaptiveLimiter(initial=1)
+        self.assertTrue(limiter.acquire(0))
+        threading.Timer(0.05, limiter.release, args=(0.05,)).start()
+        self.assertTrue(limiter.acquire(5))
+
+
+class TestLimitedSession(unittest.TestCase):
+    def test_overloaded_target(self):
+        server = ThreadingHTTPServer(("localhost", 0), Overloaded)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        limiter = AdaptiveLimiter(initial=8, backoff=0.5)
+        session = Sessions._new_session()
+        session.mount("http://", Sessions._adapter(limiter))
+        self.addCleanup(session.close)
+        response = session.get(f"http://localhost:{server.server_address[1]}/version", timeout=5)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual((limiter.limit, limiter.in_flight), (4, 0))
+
+    def test_slot_timeout(self):
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=1)
+        self.assertTrue(limiter.acquire(0))
+        session = Sessions._new_session()
+        session.mount("http://", Sessions._adapter(limiter))
+        self.addCleanup(session.close)
+        url = "http://localhost:9/v2/entities"
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # BUFFER_DIR is set
+        buffer = StoreAndForward(SegmentLog(directory, fsync=False), send=None)
+        self.addCleanup(buffer.log.close)
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        agent.headers = {}
+        agent.wfile = io.BytesIO()
+        agent.send_response = mock.Mock()
+        agent.send_header = mock.Mock()
+        agent.end_headers = mock.Mock()
+        req = HTTPRequest(url=url, method="POST", data="{}", headers={"Content-Type": "application/json"})
+        with mock.patch.object(Concurrency, "CONCURRENCY_TIMEOUT", 0.05), \
+                mock.patch.object(main, "store_and_forward", buffer), mock.patch.object(main, "pipeline", None), \
+                mock.patch.object(main.IoTAgent, "_send_request_to_broker",
+                                  staticmethod(lambda req: session.post(req.url, data=req.data, timeout=5))):
+            self.assertIsNone(agent._manage_send_request_to_broker(req))
+        # Orion is saturated, not down: the device retries later, the request is not buffered
+        agent.send_response.assert_called_once_with(503)
+        agent.send_header.assert_any_call("Retry-After", "1")
+        self.assertEqual(buffer.backlog(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Config.py and the reload of the settings
+
+These tests do not need a running Orion broker.
+The plugin needs the ORION_HOST environment variable, see env.
+"""
+
+# Standard Library imports
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Config
+import Logger
+import main
+from plugin import Orion
+import Sessions
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        file, self.path = tempfile.mkstemp()
+        os.close(file)
+        self.addCleanup(os.remove, self.path)
+        patcher = mock.patch.object(Config, "CONFIG_FILE", self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # restore the settings of the environment after every test
+        self.addCleanup(self.restore)
+
+    def write(self, text: str):
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write(text)
+
+    def restore(self):
+        with mock.patch.object(Config, "CONFIG_FILE", None):
+            Config.reload()
+
+    def test_read_file(self):
+        self.write("# comment\n\nexport A=1\nB = two words\nC=\n")
+        self.assertEqual(Config.read_file(self.path), {"A": "1", "B": "two words", "C": ""})
+        self.write("A=1\nnot a setting\n")
+        with self.assertRaises(ValueError):
+            Config.read_file(self.path)
+
+    def test_typed_getters(self):
+        config = Config.Config({"N": "5", "F": "0.5", "B": "TRUE", "X": "x"})
+        self.assertEqual(config.get_int("N", 1), 5)
+        self.assertEqual(config.get_int("N", 1, minimum=10), 1)
+        self.assertEqual(config.get_int("X", 1), 1)
+        self.assertEqual(config.get_float("F", 1.0), 0.5)
+        self.assertTrue(config.get_bool("B", False))
+        self.assertFalse(config.get_bool("X", False))
+
+    def test_reload(self):
+        self.write("LOGGING_LEVEL=ERROR\nHTTP_POOL_SIZE=3\nSENDER_THREADS=7\n")
+        result = main.reload_config()
+        self.assertIn("LOGGING_LEVEL", result["changed"])
+        self.assertEqual(result["restart_required"], ["SENDER_THREADS"])
+        self.assertEqual(logging.getLogger(main.__name__).level, logging.ERROR)
+        self.assertEqual(logging.getLogger(Orion.__name__).level, logging.ERROR)
+        self.assertEqual(Sessions.HTTP_POOL_SIZE, 3)
+        self.assertEqual(Config.get("SENDER_THREADS"), "7")
+
+    def test_invalid_reload_is_atomic(self):
+        level = Logger.LOGGING_LEVEL
+        self.write("HTTP_POOL_SIZE=4\nLOGGING_LEVEL=LOUD\n")
+        with self.assertRaises(ValueError):
+            main.reload_config()
+        self.assertEqual(Logger.LOGGING_LEVEL, level)
+        self.assertNotEqual(Sessions.HTTP_POOL_SIZE, 4)
+        self.assertIsNone(Config.get("HTTP_POOL_SIZE"))
+
+    def test_orion_reload_keeps_the_cache(self):
+        Orion.cache.clear()
+        Orion.cache.put((("", "/"), "urn:ngsi_ld:Job:1"), {"refOperation": "urn:ngsi_ld:Operation:1"})
+        Orion.cache.put((("line2", "/"), "urn:ngsi_ld:Job:1"), {"refOperation": "urn:ngsi_ld:Operation:2"})
+        self.write("ORION_CACHE_SIZE=50\nORION_TENANTS=line2=orion-b:1026\n")
+        Config.reload()
+        self.assertEqual(Orion.cache.max_size, 50)
+        self.assertEqual(Orion.target(("line2", "/")), ("orion-b", 1026))
+        # only the entities of the tenant served by another Orion are dropped
+        self.assertEqual(Orion.cache.keys(), [(("", "/"), "urn:ngsi_ld:Job:1")])
+
+    def test_plugin_reload(self):
+        old = main.transform
+        old_module = sys.modules["plugin.transform"]
+        old_module.likely_chain[(("", "/"), "urn:ngsi_ld:Workstation:1")] = ("urn:ngsi_ld:Job:1", None)
+        self.write("PLUGIN_PREFETCH=false\n")
+        Config.reload()
+        self.assertIsNot(main.transform, old)
+        self.assertIsNot(sys.modules["plugin.transform"], old_module)
+        self.assertIn((("", "/"), "urn:ngsi_ld:Workstation:1"), sys.modules["plugin.transform"].likely_chain)
+        self.assertIs(sys.modules["plugin.Orion"], Orion)
+        # a plugin that cannot be imported keeps the old one
+        current = main.transform
+        self.write("PLUGIN_PREFETCH=false\nTRANSFORM_RULES=/nonexistent/rules.json\n")
+        with self.assertRaises(ValueError):
+            Config.reload()
+        self.assertIs(main.transform, current)
+        self.assertIs(sys.modules["plugin"].transform, current)
+
+    def test_plugin_kept_until_commit(self):
+        def refuse(config):
+            raise ValueError("refused")
+
+        old_module = sys.modules["plugin.transform"]
+        # a listener after the plugin's one refuses the new settings
+        Config.add_listener(("PLUGIN_PREFETCH",), refuse)
+        self.addCleanup(Config._listeners.pop)
+        self.write("PLUGIN_PREFETCH=false\n")
+        with self.assertRaises(ValueError):
+            Config.reload()
+        self.assertIs(sys.modules["plugin.transform"], old_module)
+        self.assertIs(sys.modules["plugin"].transform, old_module.transform)
+        self.assertIs(sys.modules["plugin"].rules, sys.modules["plugin.rules"])
+
+
+if __name__ == "__main__":
+    unittest.main()
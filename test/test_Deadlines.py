@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Deadlines.py and the timeouts of the requests to Orion
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Deadlines
+import main
+import Metrics
+from Pipeline import Pipeline
+import Sessions
+
+
+class Slow(BaseHTTPRequestHandler):
+    """Responds after a second"""
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(1)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+class TestDeadlines(unittest.TestCase):
+    def tearDown(self):
+        Deadlines.activate(None)
+
+    def test_no_deadline(self):
+        self.assertIsNone(Deadlines.remaining())
+        self.assertFalse(Deadlines.expired())
+        self.assertEqual(Deadlines.timeout_for(), Deadlines.REQUEST_TIMEOUT)
+        self.assertEqual(Deadlines.timeout_for(3), 3)
+
+    def test_remaining_budget(self):
+        Deadlines.start(2)
+        self.assertLessEqual(Deadlines.timeout_for(), 2)
+        self.assertEqual(Deadlines.timeout_for(0.5), 0.5)
+        self.assertEqual(Deadlines.timeout_for((1, 5)), (1, 5))
+        Deadlines.start(-1)
+        self.assertTrue(Deadlines.expired())
+        with self.assertRaises(Deadlines.DeadlineExceededError):
+            Deadlines.timeout_for(5)
+        with self.assertRaises(Deadlines.DeadlineExceededError):
+            Deadlines.check()
+
+    def test_set_timeout(self):
+        started = time.monotonic()
+        Deadlines.start()
+        deadline = Deadlines.set_timeout("2.5")
+        self.assertAlmostEqual(deadline - started, 2.5, delta=0.5)
+        deadline = Deadlines.set_timeout(10 ** 6)
+        self.assertAlmostEqual(deadline - started, Deadlines.REQUEST_MAX_TIMEOUT, delta=0.5)
+        for timeout in (0, -1, "soon"):
+            with self.subTest(timeout=timeout), self.assertRaises(ValueError):
+                Deadlines.set_timeout(timeout)
+
+
+class TestTimeouts(unittest.TestCase):
+    def setUp(self):
+        server = ThreadingHTTPServer(("localhost", 0), Slow)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f"http://localhost:{server.server_address[1]}/v2/entities/urn:ngsi_ld:Storage:1/attrs/Counter"
+        self.addCleanup(Sessions.close_all)
+
+    def test_session_timeout(self):
+        import requests
+        Deadlines.start(0.2)
+        self.addCleanup(Deadlines.activate, None)
+        started = time.monotonic()
+        with self.assertRaises(requests.exceptions.Timeout):
+            Sessions.get_session(self.url).put(self.url, data="1")
+        self.assertLess(time.monotonic() - started, 0.9)
+        with self.assertRaises(Deadlines.DeadlineExceededError):
+            Sessions.get_session(self.url).put(self.url, data="1")
+
+    def test_gateway_timeout(self):
+        envelope = {"url": self.url, "method": "PUT", "headers": ["Content-Type: text/plain"],
+                    "data": "1", "timeout": 0.2}
+        status, _ = main.process_stream_message(json.dumps(envelope).encode("utf-8"), "application/json")
+        self.assertEqual(status, 504)
+        envelope["timeout"] = "soon"
+        status, _ = main.process_stream_message(json.dumps(envelope).encode("utf-8"), "application/json")
+        self.assertEqual(status, 400)
+
+    def test_queued_timeout(self):
+        release = threading.Event()
+        sent = []
+
+        def send(req):
+            release.wait(5)
+            sent.append(req)
+        pipeline = Pipeline(send, queue_size=2, senders=1)
+        pipeline.start()
+        self.addCleanup(release.set)
+        busy = pipeline.submit("busy")
+        Metrics.reset()
+        envelope = {"url": self.url, "method": "PUT", "headers": ["Content-Type: text/plain"],
+                    "data": "1", "timeout": 0.2}
+        started = time.monotonic()
+        with mock.patch.object(main, "pipeline", pipeline):
+            status, _ = main.process_stream_message(json.dumps(envelope).encode("utf-8"), "application/json")
+        # the handler stops waiting at the deadline, not at QUEUE_RESULT_TIMEOUT
+        self.assertEqual(status, 504)
+        self.assertLess(time.monotonic() - started, 0.9)
+        release.set()
+        busy.result(5)
+        pipeline.submit("after").result(5)
+        # the request was cancelled, the sender skipped it
+        self.assertEqual(sent, ["busy", "after"])
+        self.assertEqual(Metrics.get("pipeline_cancelled_total"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Health.py and the liveness and readiness checks
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import sys
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Health
+import main
+import Sessions
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, responses: list):
+        self.responses = responses
+
+    def get(self, url, timeout=None):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class TestOrionProbe(unittest.TestCase):
+    def test_breaker(self):
+        session = FakeSession([ConnectionError("down"), FakeResponse(503), ConnectionError("down"),
+                               FakeResponse(200)])
+        probe = Health.OrionProbe(lambda: ["orion:1026"], failure_threshold=3)
+        self.assertFalse(probe.healthy())
+        with mock.patch.object(Sessions, "get_session", return_value=session):
+            for breaker in ("closed", "closed", "open"):
+                self.assertEqual(probe.probe("orion:1026")["breaker"], breaker)
+                self.assertEqual(probe.healthy(), breaker == "closed")
+            state = probe.probe("orion:1026")
+        self.assertEqual(state["breaker"], "closed")
+        self.assertEqual(state["failures"], 0)
+        self.assertIsNone(state["error"])
+        self.assertTrue(probe.healthy())
+
+
+class TestReadiness(unittest.TestCase):
+    def test_readiness(self):
+        probe = Health.OrionProbe(lambda: ["orion:1026"])
+        pipeline = mock.Mock(**{"depth.return_value": 1, "size.return_value": 10})
+        with mock.patch.object(main, "USE_PLUGIN", True), mock.patch.object(main, "transform", None), \
+                mock.patch.object(main, "plugin_error", "ImportError: broken"), \
+                mock.patch.object(main, "pipeline", pipeline), mock.patch.object(main, "orion_probe", probe):
+            ready, checks = main.readiness()
+            self.assertFalse(ready)
+            self.assertEqual(checks["plugin"], "ImportError: broken")
+            self.assertCountEqual(checks["failures"], ["warm_up", "plugin", "orion"])
+            main.ready.set()
+            self.addCleanup(main.ready.clear)
+            with mock.patch.object(main, "transform", lambda req: req), \
+                    mock.patch.object(Sessions, "get_session", return_value=FakeSession([FakeResponse(200)])):
+                probe.probe("orion:1026")
+                self.assertEqual(main.readiness(), (True, mock.ANY))
+                pipeline.depth.return_value = 9
+                ready, checks = main.readiness()
+                self.assertEqual(checks["failures"], ["queue"])
+
+    def test_liveness(self):
+        with mock.patch.object(main, "pipeline", mock.Mock(**{"alive.return_value": False})):
+            self.assertFalse(main.liveness()[0])
+        with mock.patch.object(main, "pipeline", None):
+            self.assertTrue(main.liveness()[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""A file for testing IdempotencyStore.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+from IdempotencyStore import IdempotencyStore
+
+
+class TestIdempotencyStore(unittest.TestCase):
+    def test_duplicate(self):
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        self.assertIsNone(store.begin("a"))
+        store.complete("a", (204, b""))
+        self.assertEqual(store.begin("a"), (204, b""))
+        self.assertIsNone(store.begin("b"))
+
+    def test_abort(self):
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        self.assertIsNone(store.begin("a"))
+        store.abort("a")
+        self.assertIsNone(store.begin("a"))
+
+    def test_concurrent_duplicate_waits(self):
+        store = IdempotencyStore(ttl=60, max_keys=10)
+        self.assertIsNone(store.begin("a"))
+        results = []
+        thread = threading.Thread(target=lambda: results.append(store.begin("a")))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(results, [])
+        store.complete("a", (201, b"created"))
+        thread.join(5)
+        self.assertEqual(results, [(201, b"created")])
+
+    def test_expiry_and_size(self):
+        store = IdempotencyStore(ttl=60, max_keys=2)
+        for key in "abc":
+            store.begin(key)
+            store.complete(key, (204, b""))
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.begin("a"))
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 120):
+            self.assertIsNone(store.begin("c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
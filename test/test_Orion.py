@@ -0,0 +1,224 @@
+"""A file for testing plugin/Orion.py
+
+These tests do not need a running Orion broker,
+the HTTP responses are replaced by fake ones.
+The plugin needs the ORION_HOST environment variable, see env.
+"""
+
+# Standard Library imports
+import json
+import sys
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Deadlines
+from plugin import Orion
+from plugin.EntityCache import EntityCache
+
+
+class FakeResponse:
+    """A streamed response that returns its body in fixed size chunks"""
+
+    def __init__(self, body: bytes, chunk_size: int = 7, status_code: int = 200, headers: dict = None):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class TestOrion(unittest.TestCase):
+    def setUp(self):
+        self.entities = [
+            {"id": f"urn:ngsi_ld:Workstation:{i}", "type": "Workstation", "name": "ű" * i, "count": 10 ** i}
+            for i in range(10)
+        ]
+
+    def test__iterJsonArray(self):
+        body = json.dumps(self.entities, ensure_ascii=False).encode("utf-8")
+        for chunk_size in (1, 3, 7, 1000):
+            parsed = list(Orion._iterJsonArray(FakeResponse(body, chunk_size)))
+            self.assertEqual(parsed, self.entities)
+        numbers = list(Orion._iterJsonArray(FakeResponse(b"[123, 4567 ,89]", 2)))
+        self.assertEqual(numbers, [123, 4567, 89])
+        self.assertEqual(list(Orion._iterJsonArray(FakeResponse(b" [ ] "))), [])
+        with self.assertRaises(ValueError):
+            list(Orion._iterJsonArray(FakeResponse(b'{"id": 1}')))
+        with self.assertRaises(ValueError):
+            list(Orion._iterJsonArray(FakeResponse(b'[{"id": 1}, {"id"')))
+        for body in (b"[,,1]", b"[1,,2]", b"[1,]", b"[1 2]", b"[,]"):
+            with self.subTest(body=body), self.assertRaises(ValueError):
+                list(Orion._iterJsonArray(FakeResponse(body, 2)))
+
+    def test_iterEntities(self):
+        pages = []
+
+        def fake_get(url, params, headers, stream):
+            offset = params["offset"]
+            page = self.entities[offset:offset + params["limit"]]
+            pages.append(dict(params))
+            return FakeResponse(json.dumps(page).encode("utf-8"),
+                                headers={"Fiware-Total-Count": str(len(self.entities))})
+
+        with mock.patch.object(Orion.requests.Session, "get", side_effect=fake_get):
+            listed = list(Orion.iterEntities(entity_type="Workstation", attrs=["name"], representation="keyValues", page_size=4))
+        self.assertEqual(listed, self.entities)
+        self.assertEqual([p["offset"] for p in pages], [0, 4, 8])
+        self.assertEqual(pages[0]["options"], "count,keyValues")
+        self.assertEqual(pages[0]["attrs"], "name")
+        self.assertEqual(pages[0]["type"], "Workstation")
+
+    def test_iterEntities_without_count(self):
+        offsets = []
+
+        def fake_get(url, params, headers, stream):
+            offsets.append(params["offset"])
+            page = self.entities[params["offset"]:params["offset"] + params["limit"]]
+            return FakeResponse(json.dumps(page).encode("utf-8"))
+
+        # without Fiware-Total-Count, the pages are requested until a short or empty one
+        for page_size, expected in ((4, [0, 4, 8]), (5, [0, 5, 10])):
+            offsets.clear()
+            with self.subTest(page_size=page_size), \
+                    mock.patch.object(Orion.requests.Session, "get", side_effect=fake_get):
+                self.assertEqual(list(Orion.iterEntities(page_size=page_size, host="orion")), self.entities)
+                self.assertEqual(offsets, expected)
+
+    def test_get_projection(self):
+        with mock.patch.object(Orion, "getRequest", return_value=(200, ["urn:ngsi_ld:Job:1"])) as getRequest:
+            values = Orion.get("urn:ngsi_ld:Workstation:1", attrs=["refJob"], representation="values")
+        self.assertEqual(values, ["urn:ngsi_ld:Job:1"])
+        self.assertEqual(getRequest.call_args.kwargs["params"], {"attrs": "refJob", "options": "values"})
+        with self.assertRaises(ValueError):
+            Orion.get("urn:ngsi_ld:Workstation:1", representation="simplified")
+
+    def test_getAttributeValue(self):
+        with mock.patch.object(Orion, "getRequest", return_value=(200, 8)) as getRequest:
+            self.assertEqual(Orion.getAttributeValue("urn:ngsi_ld:Operation:1", "partsPerCycle"), 8)
+        self.assertTrue(getRequest.call_args.args[0].endswith("/v2/entities/urn:ngsi_ld:Operation:1/attrs/partsPerCycle/value"))
+        with mock.patch.object(Orion, "getRequest", return_value=(404, {"error": "NotFound"})):
+            with self.assertRaises(RuntimeError):
+                Orion.getAttributeValue("urn:ngsi_ld:Operation:1", "partsPerCycle")
+
+    def test_tenant_routing(self):
+        calls = []
+
+        def fake_post(url, params, headers, json):
+            calls.append((url, headers))
+            response = FakeResponse(b"")
+            response.json = lambda: [{"id": i["id"], "refJob": url} for i in json["entities"]]
+            return response
+
+        Orion.cache.clear()
+        with mock.patch.dict(Orion.ORION_TENANTS, {"line2": ("orion-b", 1027)}), \
+                mock.patch.object(Orion.requests.Session, "post", side_effect=fake_post):
+            default = Orion.getCachedEntities(["ws1"], ["refJob"])
+            line2 = Orion.getCachedEntities(["ws1"], ["refJob"], ("line2", "/"))
+            # the cache is partitioned by tenant
+            self.assertEqual(Orion.getCachedEntities(["ws1"], ["refJob"], ("line2", "/")), line2)
+            self.assertEqual(Orion.baseUrl(("line2", "/a")), "http://orion-b:1027")
+        self.assertEqual(len(calls), 2)
+        self.assertNotEqual(default["ws1"]["refJob"], line2["ws1"]["refJob"])
+        self.assertEqual(calls[1][0], "http://orion-b:1027/v2/op/query")
+        self.assertEqual(calls[1][1]["Fiware-Service"], "line2")
+        self.assertNotIn("Fiware-Service", calls[0][1])
+        Orion.cache.clear()
+
+    def test_shards(self):
+        queried = []
+
+        def fake_query(object_ids, attrs=None, host=None, port=None, tenant=None):
+            queried.append((host, sorted(object_ids)))
+            return {i: {"id": i, "shard": host} for i in object_ids}
+
+        ids = [f"urn:ngsi_ld:Workstation:{i}" for i in range(10)]
+        Orion.cache.clear()
+        with mock.patch.object(Orion.Sharding, "router", Orion.Sharding.Router(["orion-a", "orion-b"])), \
+                mock.patch.object(Orion, "queryEntities", side_effect=fake_query):
+            found = Orion.getCachedEntities(ids, ["refJob"])
+            self.assertEqual(len(queried), 2)
+            for entity_id, entity in found.items():
+                self.assertEqual(f"{entity['shard']}:1026", Orion.Sharding.shard_for(entity_id))
+            # moving a Workstation only drops its own cache entry
+            other = "orion-b:1026" if found[ids[0]]["shard"] == "orion-a" else "orion-a:1026"
+            Orion.Sharding.pin(ids[0], other)
+            self.assertEqual(len(Orion.cache), len(ids) - 1)
+            Orion.getCachedEntities(ids, ["refJob"])
+            self.assertEqual(queried[2:], [(other.split(":")[0], [ids[0]])])
+        Orion.cache.clear()
+
+    def test_batches_keep_the_deadline(self):
+        seen = []
+
+        def fake_query(object_ids, attrs=None, host=None, port=None, tenant=None):
+            seen.append((Deadlines.timeout_for(), Orion.Tracing.current()))
+            return {}
+
+        ids = [f"urn:ngsi_ld:Workstation:{i}" for i in range(10)]
+        Orion.cache.clear()
+        trace = Orion.Tracing.start_trace()
+        self.addCleanup(Orion.Tracing.activate, None)
+        Deadlines.start(0.5)
+        self.addCleanup(Deadlines.activate, None)
+        with mock.patch.object(Orion.Sharding, "router", Orion.Sharding.Router(["orion-a", "orion-b"])), \
+                mock.patch.object(Orion, "queryEntities", side_effect=fake_query):
+            Orion.getCachedEntities(ids, ["refJob"])
+        # the batches queried concurrently time out at the deadline of the request, not after REQUEST_TIMEOUT
+        self.assertEqual(len(seen), 2)
+        for timeout, current in seen:
+            self.assertLessEqual(timeout, 0.5)
+            self.assertIs(current, trace)
+        self.assertIs(Orion.Tracing.current(), trace)
+
+    def test_parseTenants(self):
+        self.assertEqual(Orion._parseTenants("Line1=orion-a:1026, line2=orion-b"),
+                         {"line1": ("orion-a", 1026), "line2": ("orion-b", 1026)})
+        for value in ("line1", "=orion-a", "line1=orion-a:x"):
+            with self.assertRaises(RuntimeError):
+                Orion._parseTenants(value)
+
+    def test_iterEntities_status_code(self):
+        with mock.patch.object(Orion.requests.Session, "get", return_value=FakeResponse(b"{}", status_code=400)):
+            with self.assertRaises(RuntimeError):
+                list(Orion.iterEntities(entity_type="Workstation"))
+
+
+class TestEntityCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = EntityCache(ttl=60, max_size=2)
+        self.assertIsNone(cache.get("a", ["x"]))
+        cache.put("a", {"x": 1}, ["x", "y"])
+        self.assertEqual(cache.get("a", ["x"]), {"x": 1})
+        # y was requested, but the entity does not have it
+        self.assertEqual(cache.get("a", ["y"]), {"x": 1})
+        self.assertIsNone(cache.get("a", ["z"]))
+        cache.put("a", {"z": 3})
+        self.assertEqual(cache.get("a", ["x", "z"]), {"x": 1, "z": 3})
+        cache.put("b", {"x": 2})
+        cache.put("c", {"x": 3})
+        self.assertIsNone(cache.get("a", ["x"]))
+        self.assertEqual(len(cache), 2)
+        cache.invalidate("b")
+        self.assertIsNone(cache.get("b", ["x"]))
+
+    def test_ttl(self):
+        cache = EntityCache(ttl=0, max_size=10)
+        cache.put("a", {"x": 1})
+        self.assertIsNone(cache.get("a", ["x"]))
+        cache = EntityCache(ttl=60, max_size=10)
+        cache.put("a", {"x": 1})
+        with mock.patch("time.monotonic", return_value=10 ** 9):
+            self.assertIsNone(cache.get("a", ["x"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
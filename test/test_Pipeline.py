@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Pipeline.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Deadlines
+from HTTPRequest import HTTPRequest
+import main
+import Metrics
+from Pipeline import Pipeline, QueueFullError
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        Metrics.reset()
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def slow_send(self, req):
+        self.started.set()
+        self.release.wait(5)
+        if req == "fail":
+            raise ValueError("send failed")
+        return req.upper()
+
+    def test_result(self):
+        pipeline = Pipeline(self.slow_send, queue_size=2, senders=2)
+        pipeline.start()
+        self.release.set()
+        self.assertEqual(pipeline.submit("a").result(timeout=5), "A")
+        with self.assertRaises(ValueError):
+            pipeline.submit("fail").result(timeout=5)
+        self.assertEqual(Metrics.get("pipeline_submitted_total"), 2)
+
+    def test_reject(self):
+        pipeline = Pipeline(self.slow_send, queue_size=1, senders=1, full_policy="reject")
+        pipeline.start()
+        first = pipeline.submit("a")
+        self.started.wait(5)
+        second = pipeline.submit("b")
+        self.assertEqual(pipeline.depth(), 1)
+        with self.assertRaises(QueueFullError):
+            pipeline.submit("c")
+        self.release.set()
+        self.assertEqual((first.result(5), second.result(5)), ("A", "B"))
+        self.assertEqual(Metrics.get("pipeline_rejected_total"), 1)
+
+    def test_block(self):
+        pipeline = Pipeline(self.slow_send, queue_size=1, senders=1, full_policy="block", put_timeout=0.05)
+        pipeline.start()
+        pipeline.submit("a")
+        self.started.wait(5)
+        pipeline.submit("b")
+        with self.assertRaises(QueueFullError):
+            pipeline.submit("c")
+
+    def test_drop_oldest(self):
+        pipeline = Pipeline(self.slow_send, queue_size=2, senders=1, full_policy="drop_oldest")
+        pipeline.start()
+        first = pipeline.submit("a")
+        self.started.wait(5)
+        jobs = [pipeline.submit(x) for x in "bcd"]
+        self.assertEqual(pipeline.depth(), 2)
+        self.release.set()
+        with self.assertRaises(QueueFullError):
+            jobs[0].result(5)
+        self.assertEqual([first.result(5), jobs[1].result(5), jobs[2].result(5)], ["A", "C", "D"])
+        self.assertEqual(Metrics.get("pipeline_dropped_total"), 1)
+
+    def test_high_priority(self):
+        def send(req):
+            if req != "alarm":
+                self.slow_send(req)
+            return req
+        pipeline = Pipeline(send, queue_size=5, senders=1, high_senders=1)
+        pipeline.start()
+        first = pipeline.submit("a")
+        self.started.wait(5)
+        jobs = [pipeline.submit(x) for x in "bcd"]
+        # the normal sender is busy, the high priority sender is not
+        self.assertEqual(pipeline.submit("alarm", "high").result(5), "alarm")
+        self.assertEqual(pipeline.depth(), 3)
+        self.release.set()
+        self.assertEqual([job.result(5) for job in [first] + jobs], ["a", "b", "c", "d"])
+        self.assertEqual(Metrics.get("pipeline_high_submitted_total"), 1)
+
+    def test_high_priority_first(self):
+        sent = []
+        pipeline = Pipeline(sent.append, queue_size=5, senders=1)
+        for req, priority in (("a", "normal"), ("b", "normal"), ("alarm", "high")):
+            pipeline.submit(req, priority)
+        self.assertEqual((pipeline.depth(), pipeline.depth("high")), (2, 1))
+        pipeline.start()
+        deadline = time.monotonic() + 5
+        while len(sent) < 3 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(sent, ["alarm", "a", "b"])
+
+    def test_expired_deadline(self):
+        pipeline = Pipeline(self.slow_send, queue_size=2, senders=1)
+        pipeline.start()
+        first = pipeline.submit("a")
+        self.started.wait(5)
+        try:
+            Deadlines.start(0.05)
+            expired = pipeline.submit("b")
+            Deadlines.start(5)
+            live = pipeline.submit("c")
+        finally:
+            Deadlines.activate(None)
+        time.sleep(0.1)
+        self.release.set()
+        self.assertEqual(first.result(5), "A")
+        with self.assertRaises(Deadlines.DeadlineExceededError):
+            expired.result(5)
+        self.assertEqual(live.result(5), "C")
+        self.assertEqual(Metrics.get("pipeline_expired_total"), 1)
+
+    def test_cancelled(self):
+        sent = []
+        pipeline = Pipeline(sent.append, queue_size=2, senders=1)
+        cancelled = pipeline.submit("a")
+        cancelled.cancel()
+        live = pipeline.submit("b")
+        pipeline.start()
+        live.result(5)
+        self.assertEqual(sent, ["b"])
+        self.assertEqual(Metrics.get("pipeline_cancelled_total"), 1)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Pipeline(self.slow_send, queue_size=1, senders=1, full_policy="wait")
+
+
+class TestAgent(unittest.TestCase):
+    def test_result_timeout(self):
+        release = threading.Event()
+        sent = []
+
+        def send(req):
+            release.wait(5)
+            sent.append(req)
+        pipeline = Pipeline(send, queue_size=2, senders=1)
+        pipeline.start()
+        busy = pipeline.submit("busy")
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        agent.headers = {}
+        agent._handle_overload = mock.Mock()
+        req = HTTPRequest(url="http://orion:1026/v2/entities", headers={}, method="GET")
+        with mock.patch.object(main, "pipeline", pipeline), mock.patch.object(main, "QUEUE_RESULT_TIMEOUT", 0.05):
+            self.assertIsNone(agent._manage_send_request_to_broker(req))
+        self.assertIsInstance(agent._handle_overload.call_args[0][0], TimeoutError)
+        release.set()
+        busy.result(5)
+        # the request was cancelled when its handler stopped waiting
+        pipeline.submit("after").result(5)
+        self.assertEqual(sent, ["busy", "after"])
+
+    def test_bounded_server(self):
+        server = main.BoundedThreadingHTTPServer(("localhost", 0), main.IoTAgent, max_threads=2)
+        try:
+            for _ in range(2):
+                server._slots.acquire()
+            # every slot is taken, so no more handler threads are started
+            self.assertFalse(server._slots.acquire(timeout=0.01))
+            server._slots.release()
+            request = mock.Mock()
+            with mock.patch.object(server, "finish_request"), mock.patch.object(server, "shutdown_request"):
+                server.process_request_thread(request, ("127.0.0.1", 0))
+            # the slot is released when the handler returns
+            self.assertTrue(server._slots.acquire(timeout=0.01))
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
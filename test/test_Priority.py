@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Priority.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import json
+import sys
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+from HTTPRequest import HTTPRequest
+import main
+import Priority
+
+ALARM_URL = "http://orion:1026/v2/entities/urn:ngsi_ld:Workstation:1/attrs/Failed"
+COUNTER_URL = "http://orion:1026/v2/entities/urn:ngsi_ld:Storage:1/attrs/Counter"
+
+
+class TestPriority(unittest.TestCase):
+    def setUp(self):
+        rules = Priority.Rules("attribute:Failed, template:alarm, url:urn:ngsi_ld:Alarm:")
+        patcher = mock.patch.object(Priority, "PRIORITY_HIGH", rules)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rules(self):
+        self.assertEqual(Priority.classify(HTTPRequest(url=ALARM_URL, headers={}, method="PUT")), "high")
+        self.assertEqual(Priority.classify(HTTPRequest(url=COUNTER_URL, headers={}, method="PUT")), "normal")
+        self.assertEqual(Priority.classify(HTTPRequest(url=COUNTER_URL, headers={}, method="PUT"), template="alarm"),
+                         "high")
+        batch = json.dumps({"actionType": "update", "entities": [{"id": "urn:ngsi_ld:Workstation:1",
+                                                                 "Failed": {"value": True}}]})
+        self.assertEqual(Priority.classify(HTTPRequest(url="http://orion:1026/v2/op/update", headers={},
+                                                       method="POST", data=batch)), "high")
+        self.assertEqual(Priority.classify(HTTPRequest(
+            url="http://orion:1026/v2/entities/urn:ngsi_ld:Alarm:1", headers={}, method="GET")), "high")
+
+    def test_requested_priority(self):
+        req = HTTPRequest(url=ALARM_URL, headers={}, method="PUT")
+        self.assertEqual(Priority.classify(req, "normal"), "normal")
+        self.assertEqual(Priority.classify(HTTPRequest(url=COUNTER_URL, headers={}, method="PUT"), "HIGH"), "high")
+        with self.assertRaises(ValueError):
+            Priority.classify(req, "urgent")
+
+    def test_invalid_rules(self):
+        for text in ("entity:1", "attribute:", "url:("):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                Priority.Rules(text)
+
+    def test_prepare_request(self):
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        req = agent._prepare_request(json.dumps({"url": ALARM_URL, "method": "PUT",
+                                                 "headers": ["Content-Type: application/json"],
+                                                 "data": {"value": True, "type": "Boolean"}}))
+        self.assertEqual(req.priority, "high")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Profiler.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import sys
+import threading
+import unittest
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Profiler
+
+
+def busy_function(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+    def test_sample(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_function, args=(stop,), name="busy")
+        thread.start()
+        try:
+            stacks = Profiler.sample(0.2, interval=0.001)
+        finally:
+            stop.set()
+            thread.join()
+        busy = [stack for stack in stacks if stack[0] == "busy"]
+        self.assertTrue(busy)
+        self.assertTrue(any("busy_function" in stack[-1] for stack in busy))
+        collapsed = Profiler.collapsed(stacks)
+        self.assertRegex(collapsed, r"(^|\n)busy;[^\n]*busy_function \(test_Profiler.py:\d+\) \d+\n")
+        self.assertIn("busy_function", Profiler.top(stacks))
+
+    def test_busy(self):
+        with Profiler._capture_lock:
+            with self.assertRaises(Profiler.ProfilerBusyError):
+                Profiler.sample(0.01)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""A file for testing SegmentLog.py and StoreAndForward.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# PyPI imports
+import requests
+
+# Custom imports
+sys.path.insert(0, "../src")
+from HTTPRequest import HTTPRequest
+from IdempotencyStore import IdempotencyStore
+import main
+from SegmentLog import SegmentLog
+from StoreAndForward import StoreAndForward
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+def drain(log: SegmentLog) -> list:
+    records = []
+    while True:
+        item = log.peek()
+        if item is None:
+            return records
+        records.append(item[0])
+        log.consume(item[1])
+
+
+class TestSegmentLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_append_and_consume(self):
+        log = SegmentLog(self.directory, segment_bytes=100, fsync=False)
+        records = [f"record {i}".encode() for i in range(50)]
+        for record in records:
+            log.append(record)
+        self.assertEqual(len(log), 50)
+        self.assertGreater(len(os.listdir(self.directory)), 2)
+        self.assertEqual(drain(log), records)
+        self.assertEqual(len(log), 0)
+        self.assertEqual(log.size(), 0)
+        log.close()
+
+    def test_reopen(self):
+        log = SegmentLog(self.directory, segment_bytes=100)
+        for i in range(30):
+            log.append(str(i).encode())
+        for _ in range(10):
+            log.consume(log.peek()[1])
+        log.close()
+        log = SegmentLog(self.directory, segment_bytes=100)
+        self.assertEqual(len(log), 20)
+        self.assertEqual(drain(log), [str(i).encode() for i in range(10, 30)])
+        log.close()
+
+    def test_torn_record(self):
+        log = SegmentLog(self.directory)
+        log.append(b"complete")
+        log.append(b"torn record")
+        log.close()
+        segment = os.path.join(self.directory, sorted(os.listdir(self.directory))[0])
+        with open(segment, "r+b") as file:
+            file.truncate(os.path.getsize(segment) - 3)
+        log = SegmentLog(self.directory)
+        self.assertEqual(len(log), 1)
+        log.append(b"after the crash")
+        self.assertEqual(drain(log), [b"complete", b"after the crash"])
+        log.close()
+
+    def test_compaction(self):
+        log = SegmentLog(self.directory, segment_bytes=100, fsync=False, max_bytes=300)
+        for i in range(100):
+            log.append(f"record {i:03d}".encode())
+        self.assertLessEqual(log.size(), 300)
+        self.assertEqual(log.dropped + len(log), 100)
+        records = drain(log)
+        self.assertEqual(records[-1], b"record 099")
+        self.assertEqual(records, sorted(records))
+        log.close()
+
+    def test_concurrent_append(self):
+        log = SegmentLog(self.directory, segment_bytes=1000)
+        threads = [threading.Thread(target=lambda n=n: [log.append(f"{n} {i}".encode()) for i in range(50)])
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(drain(log)), 200)
+        log.close()
+
+
+class TestStoreAndForward(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.log = SegmentLog(self.directory, fsync=False)
+        self.addCleanup(self.log.close)
+
+    def test_replay(self):
+        sent = []
+        responses = [requests.exceptions.ConnectionError("down"), FakeResponse(503), FakeResponse(204)]
+
+        def send(req):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            sent.append(req)
+            return response
+
+        buffer = StoreAndForward(self.log, send)
+        req = HTTPRequest(url="http://orion:1026/v2/entities/urn:ngsi_ld:Job:1/attrs/goodPartCounter/value",
+                          headers={"Content-Type": "text/plain"}, method="PUT", data="96", idempotency_key="k1")
+        buffer.store(req)
+        self.assertEqual(buffer.backlog(), 1)
+        self.assertIs(buffer.replay_one(), False)
+        self.assertIs(buffer.replay_one(), False)
+        self.assertIs(buffer.replay_one(), True)
+        self.assertIsNone(buffer.replay_one())
+        self.assertEqual(buffer.backlog(), 0)
+        self.assertEqual(sent[-1], req)
+
+    def test_rejected_request_is_dropped(self):
+        buffer = StoreAndForward(self.log, lambda req: FakeResponse(422))
+        buffer.store(HTTPRequest(url="http://orion:1026/v2/entities", headers={}, method="POST", data="{}"))
+        self.assertIs(buffer.replay_one(), True)
+        self.assertEqual(buffer.backlog(), 0)
+
+    def test_duplicate_during_outage(self):
+        def unavailable(req):
+            raise requests.exceptions.ConnectionError("down")
+
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        agent.headers = {}
+        agent._set_response = mock.Mock()
+        agent._replay_response = mock.Mock()
+        agent.wfile = mock.Mock()
+        body = json.dumps({"url": "http://orion:1026/v2/entities/urn:ngsi_ld:Storage:1/attrs/Counter",
+                           "method": "PUT", "headers": ["Content-Type: application/json"],
+                           "data": {"value": {"$inc": -1}, "type": "Number"},
+                           "idempotency_key": "tray-1"}).encode("utf-8")
+        buffer = StoreAndForward(self.log, send=None)
+        with mock.patch.object(main, "store_and_forward", buffer), mock.patch.object(main, "pipeline", None), \
+                mock.patch.object(main, "idempotency_store", IdempotencyStore(ttl=60, max_keys=10)), \
+                mock.patch.object(main, "_get_transform", return_value=None), \
+                mock.patch.object(main.IoTAgent, "_send_request_to_broker", staticmethod(unavailable)):
+            agent._handle_post_data(body)
+            agent._handle_post_data(body)
+        # the retry gets the stored 202, the update is buffered and applied once
+        agent._set_response.assert_called_once_with(202)
+        agent._replay_response.assert_called_once_with((202, main.BUFFERED_RESPONSE))
+        self.assertEqual(buffer.backlog(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
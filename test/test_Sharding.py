@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Sharding.py and the routing of the forwarded requests
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+from HTTPRequest import HTTPRequest
+from main import IoTAgent
+import Sharding
+
+SHARDS = ["orion-a:1026", "orion-b:1026", "orion-c:1026"]
+
+
+class TestSharding(unittest.TestCase):
+    def test_entity_type(self):
+        self.assertEqual(Sharding.entity_type("urn:ngsi_ld:Workstation:1"), "Workstation")
+        self.assertEqual(Sharding.entity_type("urn:ngsi-ld:Job:202200045"), "Job")
+        self.assertIsNone(Sharding.entity_type("Workstation1"))
+
+    def test_consistent_hashing(self):
+        ids = [f"urn:ngsi_ld:Workstation:{i}" for i in range(3000)]
+        three = Sharding.Router(SHARDS)
+        counts = {shard: 0 for shard in SHARDS}
+        for entity_id in ids:
+            counts[three.shard_for(entity_id)] += 1
+        for count in counts.values():
+            self.assertGreater(count, 600)
+        # adding a shard only moves entities to the new shard
+        four = Sharding.Router(SHARDS + ["orion-d:1026"])
+        moved = [entity_id for entity_id in ids if three.shard_for(entity_id) != four.shard_for(entity_id)]
+        self.assertLess(len(moved), len(ids) / 2)
+        self.assertTrue(all(four.shard_for(entity_id) == "orion-d:1026" for entity_id in moved))
+
+    def test_types_and_pins(self):
+        router = Sharding.Router(SHARDS, types={"Job": "orion-c"}, pins={"urn:ngsi_ld:Job:2": "orion-a:1026"})
+        self.assertEqual(router.shard_for("urn:ngsi_ld:Job:1"), "orion-c:1026")
+        self.assertEqual(router.shard_for("urn:ngsi_ld:Job:2"), "orion-a:1026")
+
+    def test_pin_notifies(self):
+        notified = []
+        with mock.patch.object(Sharding, "router", Sharding.Router(SHARDS)), \
+                mock.patch.object(Sharding, "_listeners", [notified.append]):
+            entity_id = "urn:ngsi_ld:Workstation:1"
+            other = next(shard for shard in SHARDS if shard != Sharding.shard_for(entity_id))
+            Sharding.pin(entity_id, other)
+            self.assertEqual(Sharding.shard_for(entity_id), other)
+            # pinning to the same shard again does not move anything
+            Sharding.pin(entity_id, other)
+        self.assertEqual(len(notified), 1)
+        self.assertTrue(notified[0](entity_id))
+        self.assertFalse(notified[0]("urn:ngsi_ld:Workstation:2"))
+        with mock.patch.object(Sharding, "router", None):
+            with self.assertRaises(RuntimeError):
+                Sharding.pin(entity_id, "orion-a")
+
+    def test_persisted_pins(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "pins.json")
+        self.assertEqual(Sharding.load_pins(path), {})
+        with mock.patch.object(Sharding, "router", Sharding.Router(SHARDS)), \
+                mock.patch.object(Sharding, "ORION_SHARD_PINS_FILE", path), \
+                mock.patch.object(Sharding, "_listeners", []):
+            Sharding.pin("urn:ngsi_ld:Job:1", "orion-b")
+            Sharding.pin("urn:ngsi_ld:Job:2", "orion-c:1026")
+            Sharding.pin("urn:ngsi_ld:Job:1", None)
+        # read again at the next startup
+        self.assertEqual(Sharding.load_pins(path), {"urn:ngsi_ld:Job:2": "orion-c:1026"})
+        with open(path, "w") as file:
+            file.write("[]")
+        with self.assertRaises(ValueError):
+            Sharding.load_pins(path)
+
+
+class TestShardRouting(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Sharding, "router", Sharding.Router(SHARDS, types={"Job": "orion-c:1026"}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entity_request(self):
+        req = HTTPRequest(url="http://orion-a:1026/v2/entities/urn:ngsi_ld:Job:1/attrs/goodPartCounter/value",
+                          headers={"Content-Type": "text/plain"}, method="PUT", data="96")
+        routed = IoTAgent._shard_requests(req)
+        self.assertEqual(routed[0].url, "http://orion-c:1026/v2/entities/urn:ngsi_ld:Job:1/attrs/goodPartCounter/value")
+        # other hosts are not routed
+        req.url = "http://other:1026/v2/entities/urn:ngsi_ld:Job:1"
+        self.assertIs(IoTAgent._shard_requests(req)[0], req)
+
+    def test_batch_update(self):
+        entities = [{"id": "urn:ngsi_ld:Job:1"}] + [{"id": f"urn:ngsi_ld:Workstation:{i}"} for i in range(20)]
+        req = HTTPRequest(url="http://orion-a:1026/v2/op/update", headers={"Content-Type": "application/json"},
+                          method="POST", data=json.dumps({"actionType": "append", "entities": entities}))
+        routed = IoTAgent._shard_requests(req)
+        self.assertGreater(len(routed), 1)
+        received = []
+        for part in routed:
+            body = json.loads(part.data)
+            self.assertEqual(part.headers["Content-Length"], str(len(part.data)))
+            for entity in body["entities"]:
+                self.assertEqual(f"http://{Sharding.shard_for(entity['id'])}/v2/op/update", part.url)
+                received.append(entity)
+        self.assertCountEqual(received, entities)
+
+
+if __name__ == "__main__":
+    unittest.main()
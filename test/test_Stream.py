@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Stream.py and the stream listener
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import json
+import socket
+import sys
+import threading
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import main
+import Stream
+
+ENVELOPE = {"url": "http://localhost:1026/v2/entities/urn:ngsi_ld:Storage:1/attrs/Counter",
+            "method": "PUT",
+            "headers": ["Content-Type: application/json"],
+            "data": {"value": {"$inc": -1}, "type": "Number"},
+            "idempotency_key": "k1"}
+
+
+class FakeResponse:
+    status_code = 204
+    content = b""
+
+
+class TestFrameDecoder(unittest.TestCase):
+    def test_newline(self):
+        decoder = Stream.FrameDecoder("newline", max_frame=10)
+        self.assertEqual(decoder.feed(b"a\n\nbc"), [b"a"])
+        self.assertEqual(decoder.feed(b"d\ne"), [b"bcd"])
+        self.assertEqual(decoder.feed(b"f", final=True), [b"ef"])
+        with self.assertRaises(ValueError):
+            decoder.feed(b"x" * 20)
+
+    def test_length(self):
+        decoder = Stream.FrameDecoder("length", max_frame=10)
+        data = Stream.encode_frame(b"a\nb", "length") + Stream.encode_frame(b"cd", "length")
+        self.assertEqual(decoder.feed(data[:5]), [])
+        self.assertEqual(decoder.feed(data[5:]), [b"a\nb", b"cd"])
+        with self.assertRaises(ValueError):
+            decoder.feed(Stream.encode_frame(b"x" * 11, "length"))
+        with self.assertRaises(ValueError):
+            Stream.FrameDecoder("length").feed(data[:-1], final=True)
+
+
+class TestFraming(unittest.TestCase):
+    def test_binary_needs_length(self):
+        Stream.check_framing("newline", "application/json")
+        Stream.check_framing("length", "application/msgpack")
+        for content_type in ("application/cbor", "application/x-msgpack; charset=binary"):
+            with self.subTest(content_type=content_type), self.assertRaises(ValueError):
+                Stream.check_framing("newline", content_type)
+
+
+class TestStreamListener(unittest.TestCase):
+    def listen(self, **kwargs) -> Stream.StreamListener:
+        self.received = []
+        self.done = threading.Event()
+
+        def process(payload, content_type):
+            self.received.append((payload, content_type))
+            if len(self.received) == 2:
+                self.done.set()
+            return (204, "k") if payload == b"ok" else (400, "")
+
+        listener = Stream.StreamListener(process, host="localhost", **kwargs)
+        listener.start()
+        self.addCleanup(listener.close)
+        return listener
+
+    def test_tcp_acks(self):
+        listener = self.listen(udp_port=None, tcp_port=0, framing="length", acks=True)
+        with socket.create_connection(listener.tcp_address) as connection:
+            connection.sendall(Stream.encode_frame(b"ok", "length") + Stream.encode_frame(b"bad", "length"))
+            decoder = Stream.FrameDecoder("length")
+            acks = []
+            while len(acks) < 2:
+                acks += decoder.feed(connection.recv(1024))
+        self.assertEqual(acks, [b"204 k", b"400"])
+        self.assertEqual(self.received[0], (b"ok", "application/json"))
+
+    def test_udp(self):
+        listener = self.listen(udp_port=0, tcp_port=None, acks=False)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"ok\nbad", listener.udp_address)
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([payload for payload, _ in self.received], [b"ok", b"bad"])
+
+
+class TestProcessStreamMessage(unittest.TestCase):
+    def test_process(self):
+        with mock.patch.object(main, "pipeline", None), \
+                mock.patch.object(main.IoTAgent, "_forward", return_value=FakeResponse()) as forward:
+            self.assertEqual(main.process_stream_message(json.dumps(ENVELOPE).encode("utf-8"), "application/json"),
+                             (204, "k1"))
+            self.assertEqual(forward.call_args.args[-1].url, ENVELOPE["url"])
+            self.assertEqual(main.process_stream_message(b"{}", "application/json"), (400, ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Templates.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import main
+import Templates
+
+TEMPLATES = {"templates": {
+    "storageDecrement": {
+        "method": "PUT",
+        "url": "/v2/entities/{id}/attrs/Counter",
+        "headers": ["Content-Type: application/json", "Fiware-Service: {service}"],
+        "data": {"value": {"$inc": "{delta}"}, "type": "Number"}
+    },
+    "constant": {
+        "method": "POST",
+        "url": "http://orion:1026/v2/op/update",
+        "headers": ["Content-Type: application/json"],
+        "data": {"actionType": "append", "entities": []},
+        "transform": {"source": "plc"}
+    },
+    "read": {"method": "GET", "url": "/v2/entities/{id}"}
+}}
+
+
+class TestTemplates(unittest.TestCase):
+    def setUp(self):
+        file, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(file)
+        self.addCleanup(os.remove, self.path)
+
+    def load(self, spec: dict) -> dict:
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump(spec, file)
+        return Templates.load_templates(self.path, "orion", 1026)
+
+    def test_render(self):
+        templates = self.load(TEMPLATES)
+        req = templates["storageDecrement"].render({"id": "urn:ngsi_ld:Storage:1 a", "delta": -1, "service": "line1"},
+                                                   idempotency_key="k1")
+        self.assertEqual(req.url, "http://orion:1026/v2/entities/urn:ngsi_ld:Storage:1%20a/attrs/Counter")
+        self.assertEqual(json.loads(req.data), {"value": {"$inc": -1}, "type": "Number"})
+        self.assertEqual(req.headers["Fiware-Service"], "line1")
+        self.assertEqual(req.headers["Content-Length"], str(len(req.data)))
+        self.assertEqual(req.idempotency_key, "k1")
+        constant = templates["constant"].render({})
+        self.assertEqual(constant.transform, {"source": "plc"})
+        # every request gets its own headers
+        constant.headers["X"] = "1"
+        self.assertNotIn("X", templates["constant"].render({}).headers)
+        read = templates["read"].render({"id": "urn:ngsi_ld:Job:1"})
+        self.assertEqual((read.method, read.data), ("GET", ""))
+
+    def test_params_must_match(self):
+        templates = self.load(TEMPLATES)
+        with self.assertRaises(ValueError):
+            templates["read"].render({})
+        with self.assertRaises(ValueError):
+            templates["read"].render({"id": "1", "other": 2})
+        with self.assertRaises(ValueError):
+            templates["read"].render(["1"])
+
+    def test_invalid_templates(self):
+        for template in ({"method": "PATCH", "url": "/v2/entities"},
+                         {"method": "PUT", "url": "/v2/entities", "data": {}},
+                         {"method": "POST", "url": "/v2/entities", "headers": ["Content-Type: application/json"],
+                          "data": "text"},
+                         {"method": "GET", "url": "/v2/entities", "headers": ["a: b: c"]},
+                         {"method": "GET", "url": "/v2/{id"},
+                         {"method": "GET", "url": "not a url {id}"}):
+            with self.subTest(template=template), self.assertRaises(ValueError):
+                self.load({"templates": {"invalid": template}})
+
+    def test_underscore_host(self):
+        # the hostname of a docker compose service, like an inline request url
+        template = Templates.Template("read", {"method": "GET", "url": "http://my_orion:1026/v2/entities/{id}"}, None, None)
+        self.assertEqual(template.render({"id": "urn:ngsi_ld:Job:1"}).url,
+                         "http://my_orion:1026/v2/entities/urn:ngsi_ld:Job:1")
+        template = Templates.Template("read", {"method": "GET", "url": "/v2/entities/{id}"}, "my_orion", 1026)
+        self.assertEqual(template.render({"id": "1"}).url, "http://my_orion:1026/v2/entities/1")
+
+    def test_prepare_request(self):
+        templates = self.load(TEMPLATES)
+        # a handler without a connection
+        agent = main.IoTAgent.__new__(main.IoTAgent)
+        with mock.patch.object(Templates, "templates", templates):
+            req = agent._prepare_request(json.dumps(
+                {"Template": "read", "params": {"id": "urn:ngsi_ld:Job:1"}, "idempotency_key": 5}))
+            self.assertEqual(req.url, "http://orion:1026/v2/entities/urn:ngsi_ld:Job:1")
+            self.assertEqual(req.idempotency_key, "5")
+            with self.assertRaises(ValueError):
+                agent._prepare_request(json.dumps({"template": "unknown", "params": {}}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Tenancy.py and Sessions.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Sessions
+import Tenancy
+
+
+class Slow(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.3)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+class TestTenancy(unittest.TestCase):
+    def test_tenant_of(self):
+        self.assertEqual(Tenancy.tenant_of({}), Tenancy.DEFAULT_TENANT)
+        self.assertEqual(Tenancy.tenant_of({"Content-Type": "text/plain"}), ("", "/"))
+        self.assertEqual(Tenancy.tenant_of({"Fiware-Service": "Line1", "Fiware-ServicePath": "/assembly"}),
+                         ("line1", "/assembly"))
+        self.assertEqual(Tenancy.tenant_of({"fiware-service": "line2"}), ("line2", "/"))
+
+    def test_tenant_headers(self):
+        self.assertEqual(Tenancy.tenant_headers(), {})
+        self.assertEqual(Tenancy.tenant_headers(("", "/")), {})
+        self.assertEqual(Tenancy.tenant_headers(("line1", "/")), {"Fiware-Service": "line1"})
+        self.assertEqual(Tenancy.tenant_headers(("line1", "/a")),
+                         {"Fiware-Service": "line1", "Fiware-ServicePath": "/a"})
+        self.assertTrue(Tenancy.has_tenant_headers({"Fiware-ServicePath": "/a"}))
+        self.assertFalse(Tenancy.has_tenant_headers({"Content-Type": "text/plain"}))
+
+
+class TestSessions(unittest.TestCase):
+    def tearDown(self):
+        Sessions.close_all()
+
+    def test_get_session(self):
+        session = Sessions.get_session("http://orion:1026/v2/entities")
+        self.assertIs(Sessions.get_session("http://ORION:1026/v2/op/query"), session)
+        self.assertIsNot(Sessions.get_session("http://orion-b:1026/v2/entities"), session)
+        self.assertIsNot(Sessions.get_session("https://orion:1026/v2/entities"), session)
+
+    def test_evicted_session_drains(self):
+        server = ThreadingHTTPServer(("localhost", 0), Slow)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://localhost:{server.server_address[1]}/version"
+        session = Sessions.get_session(url)
+        adapter = session.get_adapter(url)
+        responses = []
+        sender = threading.Thread(target=lambda: responses.append(session.get(url)))
+        with mock.patch.object(Sessions, "HTTP_MAX_TARGETS", 1):
+            sender.start()
+            # the request is in flight once its connection pool exists
+            while not adapter.poolmanager.pools:
+                time.sleep(0.01)
+            # evicts the session with a request in flight
+            Sessions.get_session("http://orion-b:1026/v2/entities")
+        self.assertTrue(adapter.retired)
+        self.assertEqual(len(adapter.poolmanager.pools), 1)
+        sender.join(5)
+        self.assertEqual(responses[0].status_code, 200)
+        # closed after the request finished
+        self.assertEqual(len(adapter.poolmanager.pools), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
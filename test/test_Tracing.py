@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""A file for testing Tracing.py
+
+These tests do not need a running Orion broker.
+"""
+
+# Standard Library imports
+import importlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Config
+import Tracing
+from Pipeline import Pipeline
+
+
+class TestTracing(unittest.TestCase):
+    def tearDown(self):
+        Tracing.activate(None)
+
+    def test_no_trace(self):
+        self.assertIsNone(Tracing.current())
+        self.assertEqual(Tracing.correlation_headers(), {})
+        with Tracing.span("parse"):
+            pass
+
+    def test_spans(self):
+        trace = Tracing.start_trace("corr-1")
+        self.assertIs(Tracing.current(), trace)
+        self.assertEqual(Tracing.correlation_headers(), {"Fiware-Correlator": "corr-1"})
+        with Tracing.span("parse"):
+            pass
+        with self.assertRaises(ValueError):
+            with Tracing.span("orion.get", url="http://orion:1026/v2/entities/1"):
+                raise ValueError
+        self.assertEqual([span[0] for span in trace.spans], ["parse", "orion.get"])
+        self.assertEqual(trace.spans[1][3]["error"], "ValueError")
+        self.assertEqual(set(trace.durations()), {"parse", "orion.get"})
+        self.assertTrue(Tracing.start_trace().correlation_id)
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traces.jsonl")
+            with mock.patch.object(Tracing, "TRACE_FILE", path), mock.patch.object(Tracing, "TRACE_SAMPLE_RATE", 1.0):
+                trace = Tracing.start_trace("corr-2")
+                with Tracing.span("forward"):
+                    pass
+                trace.finish(status=204)
+                Tracing.start_trace("corr-3").finish()
+            with open(path) as file:
+                lines = [json.loads(line) for line in file]
+        self.assertEqual(len(lines), 2)
+        spans = lines[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        self.assertEqual([span["name"] for span in spans], ["request", "forward"])
+        self.assertEqual(spans[1]["parentSpanId"], spans[0]["spanId"])
+        self.assertIn({"key": "status", "value": {"intValue": "204"}}, spans[0]["attributes"])
+
+    def test_not_sampled(self):
+        with mock.patch.object(Tracing, "TRACE_SAMPLE_RATE", 0.0):
+            self.assertFalse(Tracing.start_trace().sampled)
+
+    def test_settings_from_config(self):
+        # the CONFIG_FILE settings, not only the environment variables
+        self.addCleanup(importlib.reload, Tracing)
+        with mock.patch.object(Config, "_current", Config.Config({"TRACE_SAMPLE_RATE": "2", "TRACE_FILE": "spans.json"})):
+            importlib.reload(Tracing)
+        self.assertEqual((Tracing.TRACE_SAMPLE_RATE, Tracing.TRACE_FILE), (1.0, "spans.json"))
+
+    def test_pipeline_propagation(self):
+        seen = []
+        pipeline = Pipeline(lambda req: seen.append((threading.current_thread().name, Tracing.correlation_headers())),
+                            queue_size=1, senders=1)
+        pipeline.start()
+        Tracing.start_trace("corr-4")
+        pipeline.submit("req").result(5)
+        self.assertEqual(seen[0][1], {"Fiware-Correlator": "corr-4"})
+        self.assertNotEqual(seen[0][0], threading.current_thread().name)
+
+
+if __name__ == "__main__":
+    unittest.main()
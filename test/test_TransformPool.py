@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""A file for testing TransformPool.py
+
+These tests do not need a running Orion broker.
+The worker processes import the transform function of this file.
+"""
+
+# Standard Library imports
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Custom imports
+sys.path.insert(0, "../src")
+import Config
+import Deadlines
+from HTTPRequest import HTTPRequest
+import main
+import Tracing
+import TransformPool
+
+
+def transform(req: HTTPRequest) -> HTTPRequest:
+    """Count the requests seen by the worker, sleep for the seconds in the data, or return the deadline and the trace"""
+    if req.method == "SLEEP":
+        time.sleep(float(req.data))
+    if req.method == "CONTEXT":
+        trace = Tracing.current()
+        return HTTPRequest(url=req.url, method="PUT", headers=Tracing.correlation_headers(), data="",
+                           transform={"remaining": Deadlines.remaining(), "trace": trace is not None})
+    transform.seen += 1
+    return HTTPRequest(url=req.url, method="PUT", headers=req.headers, data=str(transform.seen),
+                       transform={"pid": os.getpid()}, priority=req.priority)
+
+
+transform.seen = 0
+
+
+class TestTransformPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = TransformPool.TransformPool(1, plugin="test_TransformPool")
+        cls.pool.warm_up()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def tearDown(self):
+        Deadlines.activate(None)
+        Tracing.activate(None)
+
+    def test_encoding(self):
+        req = HTTPRequest(url="http://orion:1026/v2/entities", method="POST", headers={"Content-Type": "text/plain"},
+                          data="1", transform={"a": [1]}, idempotency_key="key", priority="high")
+        self.assertEqual(TransformPool.decode(TransformPool.encode(req)), req)
+
+    def test_warm_worker(self):
+        req = HTTPRequest(url="http://orion:1026/v2/entities", method="GET", headers={}, priority="high")
+        first = self.pool.transform(req)
+        second = self.pool.transform(req)
+        self.assertEqual((first.method, first.priority), ("PUT", "high"))
+        self.assertNotEqual(first.transform["pid"], os.getpid())
+        # the same worker keeps its state between the requests
+        self.assertEqual(first.transform["pid"], second.transform["pid"])
+        self.assertEqual(int(second.data), int(first.data) + 1)
+
+    def test_deadline(self):
+        Deadlines.start(0.1)
+        with self.assertRaises(Deadlines.DeadlineExceededError):
+            self.pool.transform(HTTPRequest(url="http://orion:1026/v2/entities", method="SLEEP", headers={},
+                                            data="0.5"))
+
+
+    def test_context(self):
+        req = HTTPRequest(url="http://orion:1026/v2/entities", method="CONTEXT", headers={})
+        self.assertEqual(self.pool.transform(req).transform, {"remaining": None, "trace": False})
+        Tracing.start_trace("correlation-1")
+        Deadlines.start(2)
+        transformed = self.pool.transform(req)
+        self.assertEqual(transformed.headers, {Tracing.CORRELATOR_HEADER: "correlation-1"})
+        self.assertLess(transformed.transform["remaining"], 2)
+
+    def test_queue_wait(self):
+        # the only worker is busy, the time in the queue counts against the deadline
+        busy = threading.Thread(target=self.pool.transform, args=(
+            HTTPRequest(url="http://orion:1026/v2/entities", method="SLEEP", headers={}, data="0.5"),))
+        busy.start()
+        time.sleep(0.1)
+        Deadlines.start(2)
+        transformed = self.pool.transform(HTTPRequest(url="http://orion:1026/v2/entities", method="CONTEXT", headers={}))
+        busy.join()
+        self.assertLess(transformed.transform["remaining"], 1.7)
+
+
+class TestPluginReload(unittest.TestCase):
+    def test_pool_created_by_reload(self):
+        # the plugin was disabled at startup, so run() did not create a pool
+        with mock.patch.object(main, "transform_pool", None), \
+                mock.patch.object(main, "_import_fresh_plugin", return_value=(transform, lambda: None)), \
+                mock.patch.object(TransformPool, "TRANSFORM_PROCESSES", 2), \
+                mock.patch.object(TransformPool, "TransformPool") as pool_class, \
+                mock.patch.multiple(main, USE_PLUGIN=False, transform=None, _plugin_loaded=True, plugin_error=None):
+            main._prepare_plugin_reload(Config.Config({"USE_PLUGIN": "true"}))()
+            self.assertIs(main.transform_pool, pool_class.return_value)
+            pool_class.assert_called_once_with(2)
+            # the next reload restarts the workers of that pool
+            main._prepare_plugin_reload(Config.Config({"USE_PLUGIN": "true"}))()
+            pool_class.assert_called_once()
+            pool_class.return_value.restart.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
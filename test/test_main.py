@@ -184,13 +184,13 @@ class TestIotAgent(unittest.TestCase):
         self.assertEqual(IoTAgent._construct_request(IoTAgent, self.pd_transform, self.headers), self.req_transform)
 
     def test__send_request_to_broker(self):
-        res = IoTAgent._send_request_to_broker(IoTAgent, self.req_post)
+        res = IoTAgent._send_request_to_broker(self.req_post)
         self.assertEqual(res.status_code, 201)
-        res = IoTAgent._send_request_to_broker(IoTAgent, self.req_put)
+        res = IoTAgent._send_request_to_broker(self.req_put)
         self.assertEqual(res.status_code, 204)
-        res = IoTAgent._send_request_to_broker(IoTAgent, self.req_get)
+        res = IoTAgent._send_request_to_broker(self.req_get)
         self.assertEqual(res.status_code, 200)
-        res = IoTAgent._send_request_to_broker(IoTAgent, self.req_delete)
+        res = IoTAgent._send_request_to_broker(self.req_delete)
         self.assertEqual(res.status_code, 204)
 
     # def test__apply_plugin_if_present(self):
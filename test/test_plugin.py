@@ -6,14 +6,19 @@ Never run it in a production environment!
 """
 
 # Standard Library imports
+import json
 import os
 import sys
+import threading
 import unittest
+from unittest import mock
 
 # Custom imports
 sys.path.insert(0, "../src")
 from HTTPRequest import HTTPRequest
 from plugin import transform, Orion
+from plugin.transform import likely_chain, prefetch, resolve_chain
+from plugin import rules
 
 ORION_HOST = os.environ.get("ORION_HOST")
 ORION_PORT = os.environ.get("ORION_PORT")
@@ -121,5 +126,166 @@ class TestIotAgent(unittest.TestCase):
         req_reject_transformed = transform(req_reject)
         self.assertEqual(req_reject_expected, req_reject_transformed)
 
+
+class TestResolveChain(unittest.TestCase):
+    """Test the lookups of transform without Orion"""
+
+    def setUp(self):
+        self.entities = {
+            "ws1": {"id": "ws1", "refJob": "job1"},
+            "job1": {"id": "job1", "refOperation": "op1"},
+            "op1": {"id": "op1", "partsPerCycle": 8},
+            "job2": {"id": "job2", "refOperation": "op1"},
+        }
+        self.queries = []
+        Orion.cache.clear()
+        likely_chain.clear()
+
+    def fake_query(self, object_ids, attrs=None, host=None, port=None, tenant=None):
+        self.queries.append(list(object_ids))
+        return {i: dict(self.entities[i]) for i in object_ids if i in self.entities}
+
+    def test_resolve_chain(self):
+        with mock.patch.object(Orion, "queryEntities", side_effect=self.fake_query):
+            # cold: one query per level
+            self.assertEqual(resolve_chain("ws1"), ("job1", 8))
+            self.assertEqual(self.queries, [["ws1"], ["job1"], ["op1"]])
+            # warm: the Job and the Operation are served from the cache, the Workstation is not cached
+            self.assertEqual(resolve_chain("ws1"), ("job1", 8))
+            self.assertEqual(self.queries[3:], [["ws1"]])
+            # the Job changed: seen by the next request, one more round-trip
+            self.entities["ws1"]["refJob"] = "job2"
+            self.assertEqual(resolve_chain("ws1"), ("job2", 8))
+            self.assertEqual(self.queries[4:], [["ws1"], ["job2"]])
+            # expired cache: the likely chain is queried in one round-trip
+            Orion.cache.clear()
+            self.assertEqual(resolve_chain("ws1"), ("job2", 8))
+            self.assertEqual(self.queries[6:], [["ws1", "job2", "op1"]])
+            self.assertIsNone(resolve_chain("ws2"))
+
+    def test_likely_chain_eviction(self):
+        self.entities.update({"ws2": {"id": "ws2", "refJob": "job1"}, "ws3": {"id": "ws3", "refJob": "job1"}})
+        with mock.patch.object(Orion, "queryEntities", side_effect=self.fake_query), \
+                mock.patch.dict(resolve_chain.__globals__, {"MAX_LIKELY_CHAINS": 2}):
+            for ws_id in ("ws1", "ws2", "ws1", "ws3"):
+                resolve_chain(ws_id)
+        # the least recently used chain is evicted, not all of them
+        self.assertEqual(list(likely_chain), [(("", "/"), "ws1"), (("", "/"), "ws3")])
+
+    def test_concurrent_chains(self):
+        remember_chain = resolve_chain.__globals__["_remember_chain"]
+
+        def remember(first):
+            for i in range(first, first + 2000):
+                remember_chain((("", "/"), f"ws{i % 150}"), ("job1", "op1"))
+
+        with mock.patch.dict(resolve_chain.__globals__, {"MAX_LIKELY_CHAINS": 100}):
+            threads = [threading.Thread(target=remember, args=(i * 50,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(likely_chain), 100)
+
+    def test_tenants(self):
+        other = {"ws1": {"id": "ws1", "refJob": "job2"}, "job2": {"id": "job2", "refOperation": "op2"},
+                 "op2": {"id": "op2", "partsPerCycle": 3}}
+
+        def fake_query(object_ids, attrs=None, host=None, port=None, tenant=None):
+            entities = other if tenant == ("line2", "/") else self.entities
+            return {i: dict(entities[i]) for i in object_ids if i in entities}
+
+        with mock.patch.object(Orion, "queryEntities", side_effect=fake_query):
+            self.assertEqual(resolve_chain("ws1"), ("job1", 8))
+            self.assertEqual(resolve_chain("ws1", ("line2", "/")), ("job2", 3))
+            transformed = transform(HTTPRequest(url="", headers={"Fiware-Service": "line2"}, method="PUT",
+                                                transform={"ws": "ws1", "ct": "good", "cc": 2}))
+        self.assertEqual(transformed.data, "6")
+        self.assertEqual(transformed.headers["Fiware-Service"], "line2")
+
+    def test_prefetch(self):
+        with mock.patch.object(Orion, "queryEntities", side_effect=self.fake_query):
+            prefetch(["ws1", "ws2"])
+            self.assertEqual(likely_chain, {(("", "/"), "ws1"): ("job1", "op1")})
+            self.assertEqual(resolve_chain("ws1"), ("job1", 8))
+        self.assertEqual(self.queries, [["ws1", "ws2"], ["job1"], ["op1"], ["ws1"]])
+
+
+class TestRules(unittest.TestCase):
+    """Test the declarative transform rules without Orion"""
+
+    def setUp(self):
+        Orion.cache.clear()
+        with open("../src/plugin/rules.example.json") as file:
+            self.spec = json.load(file)
+
+        self.entities = {
+            "ws1": {"id": "ws1", "refJob": "job1"},
+            "job1": {"id": "job1", "refOperation": "op1"},
+            "op1": {"id": "op1", "partsPerCycle": 8},
+            "job2": {"id": "job2", "refOperation": "op1"},
+        }
+
+    def fake_query(self, object_ids, attrs=None, host=None, port=None, tenant=None):
+        return {i: dict(self.entities[i]) for i in object_ids if i in self.entities}
+
+    def test_example_rule(self):
+        compiled = rules.compile_rules(self.spec, host="orion", port=1026)
+        req = HTTPRequest(url="", headers={}, method="PUT", transform={"ws": "ws1", "ct": "good", "cc": 14})
+        with mock.patch.object(Orion, "queryEntities", side_effect=self.fake_query):
+            transformed = rules.apply_rules(compiled, req)
+            self.assertEqual(transformed, HTTPRequest(url="http://orion:1026/v2/entities/job1/attrs/goodPartCounter/value",
+                                                      headers={"Content-Type": "text/plain"},
+                                                      method="PUT",
+                                                      data="112"))
+            req.transform["ct"] = "reject"
+            self.assertIn("rejectPartCounter", rules.apply_rules(compiled, req).url)
+            req.transform["ws"] = "ws2"
+            with self.assertRaises(RuntimeError):
+                rules.apply_rules(compiled, req)
+        self.assertIsNone(rules.apply_rules(compiled, HTTPRequest(url="", headers={}, method="PUT", transform={"ws": "ws1"})))
+
+    def test_fresh_lookup(self):
+        compiled = rules.compile_rules(self.spec, host="orion", port=1026)
+        req = HTTPRequest(url="", headers={}, method="PUT", transform={"ws": "ws1", "ct": "good", "cc": 1})
+        with mock.patch.object(Orion, "queryEntities", side_effect=self.fake_query):
+            self.assertIn("/job1/", rules.apply_rules(compiled, req).url)
+            # the Workstation is not cached, the Job changeover applies to the next request
+            self.entities["ws1"]["refJob"] = "job2"
+            self.assertIn("/job2/", rules.apply_rules(compiled, req).url)
+        self.assertNotIn((("", "/"), "ws1"), Orion.cache.keys())
+        spec = {"rules": [{"vars": {"x": {"entity": "ws", "attr": "refJob", "fresh": "yes"}},
+                           "request": {"url": "/v2/entities"}}]}
+        with self.assertRaises(ValueError):
+            rules.compile_rules(spec)
+
+    def test_json_skeleton(self):
+        spec = {"rules": [{"match": {"kind": "alarm", "ws": None},
+                           "vars": {"failed": {"expr": "code != 0 and not ignore"}},
+                           "request": {"method": "post", "url": "http://orion:1026/v2/op/update",
+                                       "headers": {"Content-Type": "application/json"},
+                                       "data": {"actionType": "append",
+                                                "entities": [{"id": "{ws}", "failed": {"type": "Boolean", "value": "{failed}"}}]}}}]}
+        compiled = rules.compile_rules(spec)
+        req = HTTPRequest(url="", headers={}, method="PUT", transform={"kind": "alarm", "ws": "ws1", "code": 3, "ignore": False})
+        transformed = rules.apply_rules(compiled, req)
+        self.assertEqual(transformed.method, "POST")
+        self.assertEqual(json.loads(transformed.data)["entities"][0], {"id": "ws1", "failed": {"type": "Boolean", "value": True}})
+        req.transform["kind"] = "counter"
+        self.assertIsNone(rules.apply_rules(compiled, req))
+
+    def test_invalid_rules(self):
+        for expr in ("__import__('os')", "cc.real", "[x for x in cc]", "open('f')", "cc +"):
+            spec = {"rules": [{"vars": {"x": {"expr": expr}}, "request": {"url": "/v2/entities"}}]}
+            with self.assertRaises(ValueError):
+                rules.compile_rules(spec)
+        with self.assertRaises(ValueError):
+            rules.compile_rules({"rules": [{"request": {"url": "/v2/entities/{"}}]})
+        with self.assertRaises(ValueError):
+            rules.compile_rules({"rules": [{"vars": {"x": {}}, "request": {"url": "/v2/entities"}}]})
+        with self.assertRaises(ValueError):
+            rules.compile_rules({"rules": {}})
+
+
 if __name__ == "__main__":
     unittest.main()